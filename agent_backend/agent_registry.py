@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import importlib
+import os
+import time
+
+from deadline import with_deadline
+from providers import pool
+from tenancy import scheduler
+
+# Imports the agent modules and creates the LLM clients in the background once the server is up
+AGENT_PREWARM = os.environ.get("AGENT_PREWARM", "1") != "0"
+
+# Default per-agent limits; an agent's declaration can override them
+AGENT_CONCURRENCY = int(os.environ.get("AGENT_CONCURRENCY", 4))  # Concurrent calls per agent
+COPILOT_CONCURRENCY = int(os.environ.get("COPILOT_CONCURRENCY", 2))  # Separate lane per agent for copilot requests
+AGENT_QUEUE_SIZE = int(os.environ.get("AGENT_QUEUE_SIZE", 16))  # Calls waiting per lane before new ones are rejected
+
+# Agent used when routing finds no better match
+DEFAULT_AGENT = "general"
+
+class AgentBusy(Exception):
+    pass
+
+# Module name -> seconds its first import took
+load_times = {}
+
+def load_module(module_name: str):
+    """Imports an agent module on first use."""
+    if module_name not in load_times:
+        start = time.perf_counter()
+        importlib.import_module(module_name)
+        load_times[module_name] = time.perf_counter() - start
+    return importlib.import_module(module_name)
+
+class Bulkhead:
+    """
+    Caps the concurrent calls of one agent lane. At most `queue_size` calls wait for a free slot,
+    further calls are rejected with AgentBusy, so a flood for one agent cannot take the capacity of the others.
+    """
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self.created_at = time.monotonic()
+
+    async def _acquire(self, deadline=None):
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+            return
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise AgentBusy(f"Agent '{self.name}' is at capacity, try again later")
+
+        self.waiting += 1
+        acquired = False
+        try:
+            # Waiting here must not hold one of the scheduler's slots, or a flood for this
+            # agent would still block the other agents at the scheduler
+            async with scheduler.yielded(deadline):
+                await with_deadline(deadline, self.semaphore.acquire(), f"{self.name} queue")
+                acquired = True
+        except BaseException:
+            if acquired:
+                self.semaphore.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, deadline=None):
+        await self._acquire(deadline)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.busy_seconds += time.monotonic() - start
+            self.semaphore.release()
+
+    def metrics(self) -> dict:
+        elapsed = time.monotonic() - self.created_at
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "peak": self.peak,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            # Share of the lane's slot-time spent serving calls since startup
+            "utilization": self.busy_seconds / (elapsed * self.concurrency) if elapsed > 0 else 0.0,
+        }
+
+class AgentSpec:
+    """
+    Declares an agent: its routing label, the module implementing it, how the router recognizes it,
+    and its resource limits. The module defines generate_prompt and an async function named after the
+    module, which is also the agent's model registry stage. The module is imported on first use.
+    Each agent gets its own bulkhead, with a separate lane for copilot requests.
+    """
+    def __init__(
+        self,
+        name: str,
+        module: str,
+        title: str,
+        description: str,
+        examples: list = (),
+        keywords: list = (),
+        route_priority: int = 0,
+        concurrency: int = AGENT_CONCURRENCY,
+        copilot_concurrency: int = COPILOT_CONCURRENCY,
+        queue_size: int = AGENT_QUEUE_SIZE,
+    ):
+        self.name = name
+        self.module = module
+        self.title = title
+        self.description = description
+        self.examples = list(examples)
+        self.keywords = list(keywords)
+        self.route_priority = route_priority  # The local router checks higher priorities first
+        self.bulkheads = {
+            "default": Bulkhead(name, concurrency, queue_size),
+            "copilot": Bulkhead(f"{name}:copilot", copilot_concurrency, queue_size),
+        }
+
+    @property
+    def stage(self) -> str:
+        return self.module
+
+    def load(self):
+        return load_module(self.module)
+
+    def function(self):
+        return getattr(self.load(), self.module)
+
+    def bulkhead(self, request_type=None) -> Bulkhead:
+        return self.bulkheads["copilot" if request_type == "copilot" else "default"]
+
+    async def run(self, user_query: str, deadline=None, request_type=None):
+        async with self.bulkhead(request_type).slot(deadline):
+            return await self.function()(user_query, deadline, request_type)
+
+    def metrics(self) -> dict:
+        return {lane: bulkhead.metrics() for lane, bulkhead in self.bulkheads.items()}
+
+# Routing label -> agent, in the order the router prompt lists them
+AGENTS = {}
+
+def register_agent(spec: AgentSpec) -> AgentSpec:
+    AGENTS[spec.name] = spec
+    return spec
+
+def get_agent(name: str) -> AgentSpec:
+    return AGENTS.get(name, AGENTS[DEFAULT_AGENT])
+
+register_agent(AgentSpec(
+    "general",
+    "hello_world_agent",
+    title="General Agent",
+    description="Use this agent for queries related to strings, greetings, or general-purpose tasks.",
+    examples=[
+        "Write a smart contract that returns \"Hello, World!\"",
+        "Generate a simple greeting message",
+        "Explain how to use strings in Soroban",
+    ],
+    keywords=["hello", "string", "greeting", "general", "example"],
+    route_priority=0,
+))
+register_agent(AgentSpec(
+    "storage",
+    "storage_agent",
+    title="Storage Agent",
+    description="Use this agent for queries related to storing or retrieving data.",
+    examples=[
+        "Write a smart contract that stores user details",
+        "How do I retrieve data from persistent storage?",
+        "Create a contract that saves and fetches data",
+    ],
+    keywords=["store", "retrieve", "storage", "persist", "save", "fetch", "extend_ttl"],
+    route_priority=1,
+))
+register_agent(AgentSpec(
+    "cross_contract",
+    "cross_contract_agent",
+    title="Cross-Contract Agent",
+    description="Use this agent for queries related to cross-contract interactions.",
+    examples=[
+        "Write a contract that calls another contract",
+        "How do I interact with another contract in Soroban?",
+        "Create a contract that uses another contract's function",
+    ],
+    keywords=[
+        "cross contract", "cross-contract", "call contract", "contract interaction",
+        "interact with contract", "another contract", "contractimport",
+    ],
+    route_priority=2,
+))
+register_agent(AgentSpec(
+    "atomic_swap",
+    "atomic_swap_agent",
+    title="Atomic Swap Agent",
+    description="Use this agent for queries related to atomic swaps between tokens.",
+    examples=[
+        "Write a contract for atomic swaps between two tokens",
+        "How do I implement an atomic swap in Soroban?",
+        "Create a contract that swaps tokens atomically",
+    ],
+    keywords=["atomic swap", "token swap", "swap tokens", "atomic exchange", "swap"],
+    route_priority=3,
+))
+
+# Routes and answers in one completion (AGENT_MODE=fused); not a routing target itself
+FUSED_AGENT = AgentSpec(
+    "fused",
+    "fused_agent",
+    title="Fused Agent",
+    description="Picks the domain and answers in a single completion.",
+)
+
+def agent_metrics() -> dict:
+    metrics = {name: spec.metrics() for name, spec in AGENTS.items()}
+    metrics[FUSED_AGENT.name] = FUSED_AGENT.metrics()
+    return metrics
+
+def _prewarm_sync():
+    for module_name in [spec.module for spec in AGENTS.values()] + [FUSED_AGENT.module, "functioniser_agent"]:
+        load_module(module_name)
+    # Importing the provider SDKs is the largest part of a cold first request
+    for endpoint in pool.endpoints:
+        endpoint.client
+
+async def prewarm() -> float:
+    """
+    Loads every lazy module and creates the LLM clients in a worker thread,
+    so requests arriving meanwhile are still served. Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    await asyncio.to_thread(_prewarm_sync)
+    return time.perf_counter() - start
@@ -0,0 +1,110 @@
+"""
+Compares full and code-only answers for each of the four agents. Reports latency and
+prompt/completion tokens per agent and response mode, on a generation and a copilot query per agent.
+
+Usage:
+    python benchmark_response_mode.py [--runs 1] [--agents general storage cross_contract atomic_swap]
+
+Calls the endpoints configured in llm_config.json; point it at mock_llm.py to benchmark offline.
+Routing is skipped: every query goes straight to the agent it is listed under.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from agent_registry import AGENTS, get_agent
+from code_only import run_code_only
+from tenancy import FairScheduler
+from utils import build_query
+
+# Agent -> (request_type, user_code, context)
+AGENT_QUERIES = {
+    "general": [
+        ("generation", "", "Write a smart contract that returns \"Hello, World!\""),
+        (
+            "copilot",
+            "pub fn hello(env: Env, to: String) -> Vec<String> {\n######\n######\n}",
+            "Return a greeting followed by the name",
+        ),
+    ],
+    "storage": [
+        ("generation", "", "Write a smart contract that stores user details"),
+        (
+            "copilot",
+            "pub fn increment(env: Env) -> u32 {\n    let mut count: u32 = env.storage().instance().get(&COUNTER).unwrap_or(0);\n######\n######\n    count\n}",
+            "Increment the counter and store it back",
+        ),
+    ],
+    "cross_contract": [
+        ("generation", "", "Write a contract that calls another contract to add two numbers"),
+        (
+            "copilot",
+            "pub fn add_with(env: Env, contract: Address, x: u32, y: u32) -> u32 {\n######\n######\n}",
+            "Call add on the other contract",
+        ),
+    ],
+    "atomic_swap": [
+        ("generation", "", "Write a contract for atomic swaps between two tokens"),
+        (
+            "copilot",
+            "pub fn swap(env: Env, a: Address, b: Address, token_a: Address, token_b: Address, amount_a: i128, amount_b: i128) {\n######\n######\n}",
+            "Authorize both parties and transfer the tokens",
+        ),
+    ],
+}
+
+MODES = ["full", "code_only"]
+
+async def answer(mode: str, agent, final_query: str, request_type: str):
+    if mode == "code_only":
+        return await run_code_only(agent, final_query, request_type=request_type)
+    return await agent.run(final_query, request_type=request_type)
+
+async def run_agent_mode(agent_name: str, mode: str, scheduler, runs: int) -> dict:
+    agent = get_agent(agent_name)
+    latencies = []
+    prompt_tokens = []
+    completion_tokens = []
+    # Upstream usage is recorded against the tenant the scheduler runs the query for
+    tenant = scheduler.tenant(f"{agent_name}:{mode}")
+    for _ in range(runs):
+        for request_type, user_code, context in AGENT_QUERIES[agent_name]:
+            final_query = build_query(request_type, user_code, context)
+            prompt_before, completion_before = tenant.prompt_tokens, tenant.completion_tokens
+            start = time.perf_counter()
+            await scheduler.run(tenant.name, answer(mode, agent, final_query, request_type))
+            latencies.append(time.perf_counter() - start)
+            prompt_tokens.append(tenant.prompt_tokens - prompt_before)
+            completion_tokens.append(tenant.completion_tokens - completion_before)
+
+    return {
+        "agent": agent_name,
+        "mode": mode,
+        "queries": len(latencies),
+        "p50_latency": statistics.median(latencies),
+        "max_latency": max(latencies),
+        "mean_prompt_tokens": statistics.mean(prompt_tokens),
+        "mean_completion_tokens": statistics.mean(completion_tokens),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark full vs code-only answers per agent")
+    parser.add_argument("--runs", type=int, default=1, help="Passes over each agent's queries")
+    parser.add_argument("--agents", nargs="+", default=list(AGENT_QUERIES), choices=list(AGENTS))
+    args = parser.parse_args()
+
+    scheduler = FairScheduler(concurrency=1)
+
+    print(f"{'agent':<15} {'mode':<10} {'queries':>8} {'p50 (s)':>8} {'max (s)':>8} {'prompt':>8} {'completion':>11}")
+    for agent_name in args.agents:
+        for mode in MODES:
+            result = await run_agent_mode(agent_name, mode, scheduler, args.runs)
+            print(
+                f"{result['agent']:<15} {result['mode']:<10} {result['queries']:>8} "
+                f"{result['p50_latency']:>8.2f} {result['max_latency']:>8.2f} "
+                f"{result['mean_prompt_tokens']:>8.0f} {result['mean_completion_tokens']:>11.0f}"
+            )
+
+if __name__ == "__main__":
+    asyncio.run(main())
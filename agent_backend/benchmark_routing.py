@@ -0,0 +1,93 @@
+"""
+Compares the two-stage (determine_agent + agent) and fused routing modes on a
+labeled query set. Reports latency, token cost and routing accuracy per mode.
+
+Usage:
+    python benchmark_routing.py [--runs 1] [--modes two_stage fused]
+
+Calls the endpoints configured in llm_config.json; point it at mock_llm.py to benchmark offline.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import fused_agent
+from tenancy import FairScheduler
+from utils import build_query, route_and_answer
+
+# (request_type, user_code, context, expected agent)
+LABELED_QUERIES = [
+    ("generation", "", "Write a smart contract that returns \"Hello, World!\"", "general"),
+    ("assistance", "", "Explain how to use strings in Soroban", "general"),
+    ("generation", "", "Generate a simple greeting message contract", "general"),
+    ("generation", "", "Write a smart contract that stores user details", "storage"),
+    ("assistance", "", "How do I retrieve data from persistent storage?", "storage"),
+    ("generation", "", "Create a counter contract that saves the count and extends its TTL", "storage"),
+    ("generation", "", "Write a contract that calls another contract to add two numbers", "cross_contract"),
+    ("assistance", "", "How do I interact with another contract in Soroban?", "cross_contract"),
+    ("generation", "", "Write a contract for atomic swaps between two tokens", "atomic_swap"),
+    ("assistance", "", "How do I implement an atomic swap in Soroban?", "atomic_swap"),
+    (
+        "debugging",
+        "pub fn swap(env: Env, a: Address, b: Address) {\n    token_a.transfer(&a, &b, &amount_a);\n}",
+        "error[E0425]: cannot find value `token_a` in this scope",
+        "atomic_swap",
+    ),
+    (
+        "copilot",
+        "pub fn increment(env: Env) -> u32 {\n    let mut count: u32 = env.storage().instance().get(&COUNTER).unwrap_or(0);\n######\n######\n    count\n}",
+        "Increment the counter and store it back",
+        "storage",
+    ),
+]
+
+async def run_mode(mode, scheduler, runs):
+    latencies = []
+    tokens = []
+    correct = 0
+    total = 0
+
+    for _ in range(runs):
+        for request_type, user_code, context, expected in LABELED_QUERIES:
+            final_query = build_query(request_type, user_code, context)
+            # Upstream usage is recorded against the tenant the scheduler runs the query for
+            tenant = scheduler.tenant(mode)
+            tokens_before = tenant.prompt_tokens + tenant.completion_tokens
+            start = time.perf_counter()
+            if mode == "fused":
+                agent, _ = await scheduler.run(mode, fused_agent.fused_agent(final_query))
+            else:
+                agent, _ = await scheduler.run(mode, route_and_answer(final_query))
+            latencies.append(time.perf_counter() - start)
+            tokens.append(tenant.prompt_tokens + tenant.completion_tokens - tokens_before)
+            correct += agent == expected
+            total += 1
+
+    return {
+        "mode": mode,
+        "queries": total,
+        "accuracy": correct / total,
+        "p50_latency": statistics.median(latencies),
+        "max_latency": max(latencies),
+        "mean_tokens": statistics.mean(tokens),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark two-stage vs fused routing")
+    parser.add_argument("--runs", type=int, default=1, help="Passes over the labeled query set")
+    parser.add_argument("--modes", nargs="+", default=["two_stage", "fused"], choices=["two_stage", "fused"])
+    args = parser.parse_args()
+
+    scheduler = FairScheduler(concurrency=1)
+
+    print(f"{'mode':<10} {'queries':>8} {'accuracy':>9} {'p50 (s)':>8} {'max (s)':>8} {'tokens':>8}")
+    for mode in args.modes:
+        result = await run_mode(mode, scheduler, args.runs)
+        print(
+            f"{result['mode']:<10} {result['queries']:>8} {result['accuracy']:>9.0%} "
+            f"{result['p50_latency']:>8.2f} {result['max_latency']:>8.2f} {result['mean_tokens']:>8.0f}"
+        )
+
+if __name__ == "__main__":
+    asyncio.run(main())
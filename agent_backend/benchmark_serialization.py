@@ -0,0 +1,89 @@
+"""
+Measures serialization time and bytes on the wire for typical /ai and /functioniser payloads,
+comparing the default JSON response with FastJSONResponse and gzip/br compression.
+
+Usage:
+    python benchmark_serialization.py [--iterations 2000]
+"""
+import argparse
+import gzip
+import time
+
+from starlette.responses import JSONResponse
+
+from functioniser_agent import atomic_swap_contract, increment_contract
+from responses import FastJSONResponse, GZIP_LEVEL, BROTLI_QUALITY, brotli, orjson
+
+EXPLANATION = (
+    "The user is asking for an atomic swap between two parties.\n\n"
+    "- Both parties authorize the swap with `require_auth_for_args`.\n"
+    "- Each token is moved with the token client, so the swap either completes on both sides or fails.\n"
+    "- Minimum amounts protect each side from receiving less than expected.\n\n"
+)
+
+def metadata_function(name: str, params: list) -> dict:
+    return {
+        "name": name,
+        "description": f"Calls {name} on the contract",
+        "parameters": [{"name": param, "type": "Address" if param in ("a", "b") else "i128"} for param in params],
+        "returns": "()",
+        "mutates_state": True,
+        "requires_auth": True,
+    }
+
+# (name, payload) pairs shaped like real endpoint responses
+PAYLOADS = [
+    ("copilot", {"agent_response": "let count: u32 = count + 1;\nenv.storage().instance().set(&COUNTER, &count);\n"}),
+    ("generation", {"agent_response": EXPLANATION + "```rust\n" + atomic_swap_contract + "\n```\n"}),
+    (
+        "generation-large",
+        {"agent_response": EXPLANATION + ("```rust\n" + atomic_swap_contract + increment_contract + "\n```\n") * 4},
+    ),
+    (
+        "functioniser",
+        {"functions": [
+            metadata_function(f"swap_{index}", ["a", "b", "token_a", "token_b", "amount_a", "min_b_for_a"])
+            for index in range(12)
+        ]},
+    ),
+]
+
+def time_render(response_class, payload, iterations: int) -> float:
+    # Microseconds per render
+    start = time.perf_counter()
+    for _ in range(iterations):
+        response_class(payload)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON rendering and compression of agent outputs")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if orjson else 'no'}  brotli: {'yes' if brotli else 'no'}")
+    print(
+        f"{'payload':<18} {'json (us)':>10} {'fast (us)':>10} {'bytes':>8} "
+        f"{'gzip':>8} {'gzip (us)':>10} {'br':>8} {'br (us)':>8}"
+    )
+    for name, payload in PAYLOADS:
+        default_us = time_render(JSONResponse, payload, args.iterations)
+        fast_us = time_render(FastJSONResponse, payload, args.iterations)
+        body = FastJSONResponse(payload).body
+
+        start = time.perf_counter()
+        gzipped = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        gzip_us = (time.perf_counter() - start) * 1e6
+        if brotli is not None:
+            start = time.perf_counter()
+            br_bytes = len(brotli.compress(body, quality=BROTLI_QUALITY))
+            br_us = f"{(time.perf_counter() - start) * 1e6:.0f}"
+        else:
+            br_bytes, br_us = "-", "-"
+
+        print(
+            f"{name:<18} {default_us:>10.1f} {fast_us:>10.1f} {len(body):>8} "
+            f"{len(gzipped):>8} {gzip_us:>10.0f} {br_bytes:>8} {br_us:>8}"
+        )
+
+if __name__ == "__main__":
+    main()
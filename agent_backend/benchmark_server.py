@@ -0,0 +1,113 @@
+"""
+Compares the development launch (`python main.py`: one process, auto-reload) with the
+production launcher (serve.py) under concurrent /ai load.
+
+Usage:
+    python benchmark_server.py [--requests 500] [--concurrency 64] [--workers 4]
+
+Run mock_llm.py and point LLM_CONFIG at a config that routes to it, so the numbers measure the
+server rather than the upstream provider. Each mode is started on its own port and stopped afterwards.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from replay import percentile
+
+QUERY = {
+    "request_type": "generation",
+    "user_code": "",
+    "context": "Write a smart contract that stores user details",
+}
+
+def launch(mode: str, port: int, workers: int) -> subprocess.Popen:
+    if mode == "dev":
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--reload"]
+    else:
+        command = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    # The load comes from one tenant, so lift its token quota unless one is set explicitly
+    env = dict(os.environ)
+    env.setdefault("TENANT_TOKEN_QUOTA", str(10**12))
+    # Every request has the same body, so the answer cache is off or all but the first would be cache hits
+    env.update(RESPONSE_CACHE_PATH="", RESPONSE_CACHE_SIZE="0")
+    # Own process group, so the reloader or gunicorn and all their workers are stopped together
+    return subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+async def wait_ready(url: str, timeout: float = 30):
+    start = time.perf_counter()
+    async with httpx.AsyncClient() as client:
+        while time.perf_counter() - start < timeout:
+            try:
+                await client.get(url + "/metrics/tenants")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+async def load(url: str, requests: int, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(client):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(url + "/ai", json=QUERY)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client) for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+    return sorted(latencies), errors, elapsed
+
+async def run_mode(mode: str, port: int, args):
+    url = f"http://127.0.0.1:{port}"
+    process = launch(mode, port, args.workers)
+    try:
+        await wait_ready(url)
+        # Warm up connections and per-worker clients before measuring
+        await load(url, args.concurrency, args.concurrency)
+        return await load(url, args.requests, args.concurrency)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the development launch against serve.py")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Workers for serve.py")
+    parser.add_argument("--port", type=int, default=8100, help="First port; each mode uses the next one")
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 (s)':>8} {'p99 (s)':>8}")
+    for offset, mode in enumerate(["dev", "serve"]):
+        latencies, errors, elapsed = await run_mode(mode, args.port + offset, args)
+        print(
+            f"{mode:<6} {len(latencies):>9} {errors:>7} {len(latencies) / elapsed:>8.1f} "
+            f"{percentile(latencies, 0.50):>8.3f} {percentile(latencies, 0.99):>8.3f}"
+        )
+
+if __name__ == "__main__":
+    asyncio.run(main())
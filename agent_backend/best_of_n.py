@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import statistics
+import time
+from collections import deque
+
+from compile_check import CheckResult, get_verifier
+from deadline import DeadlineExceeded
+from query_response_agent import extract_code_locally
+from structured_log import get_logger, log_event
+
+# Most candidates a request may ask for
+BEST_OF_MAX = int(os.environ.get("BEST_OF_MAX", 4))
+# Request types whose answers are verified; the others are answered once
+BEST_OF_REQUEST_TYPES = ("debugging", "generation")
+# contractimport! loads another contract's WASM file, which a sandbox crate does not have
+UNVERIFIABLE_MACROS = ("contractimport!",)
+
+logger = get_logger("best_of_n")
+
+class BestOfStats:
+    def __init__(self):
+        self.requests = 0
+        self.verified_requests = 0  # Requests answered with a candidate that compiled
+        self.candidates = 0  # Candidates checked
+        self.passed = 0
+        self.time_to_valid = deque(maxlen=1000)  # Seconds until the first candidate that compiled
+
+    def metrics(self) -> dict:
+        return {
+            "requests": self.requests,
+            "verified_requests": self.verified_requests,
+            "candidates_checked": self.candidates,
+            "candidates_passed": self.passed,
+            "pass_rate": self.passed / self.candidates if self.candidates else None,
+            "p50_time_to_valid": statistics.median(self.time_to_valid) if self.time_to_valid else None,
+        }
+
+stats = BestOfStats()
+
+async def verify_answer(verifier, answer: str) -> CheckResult:
+    """
+    Checks every Rust code block of the answer; an answer without code fails.
+    Blocks that import another contract's WASM are skipped, and an answer made only of them is unverifiable.
+    """
+    blocks = extract_code_locally(answer).code_requested
+    if not blocks:
+        return CheckResult(False, "The answer has no Rust code block")
+    checkable = [block for block in blocks if not any(macro in block for macro in UNVERIFIABLE_MACROS)]
+    if not checkable:
+        return CheckResult(False, "The code imports a contract WASM with contractimport!", unverifiable=True)
+    blocks = checkable
+    result = None
+    for block in blocks:
+        result = await verifier.check(block)
+        if not result.ok:
+            break
+    return result
+
+async def best_of_n(generate, n: int, deadline=None, verifier=None) -> dict:
+    """
+    Awaits `generate()` n times concurrently and checks the code of each answer as it arrives.
+    Returns the first answer that compiles and cancels the other candidates. When none compiles
+    (or the deadline leaves no time to finish checking), the first answer is returned unverified.
+    """
+    verifier = verifier or get_verifier()
+    start = time.monotonic()
+    answers = []  # In arrival order, for the unverified fallback
+
+    async def candidate():
+        answer = await generate()
+        answers.append(answer)
+        result = await verify_answer(verifier, answer)
+        stats.candidates += 1
+        stats.passed += result.ok
+        return answer, result
+
+    stats.requests += 1
+    tasks = {asyncio.create_task(candidate()) for _ in range(n)}
+    pending = tasks
+    errors = []
+    failures = []
+    try:
+        while pending:
+            timeout = deadline.remaining() if deadline is not None else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break  # Out of time
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                    continue
+                answer, result = task.result()
+                if result.unverifiable:
+                    # Other candidates would most likely import the same contract, so this is as good as it gets
+                    log_event(logger, logging.INFO, "best-of-n unverifiable", candidates=n, checked=len(failures) + 1)
+                    return {
+                        "agent_response": answer,
+                        "verification": {
+                            "verified": False,
+                            "unverifiable": True,
+                            "candidates": n,
+                            "checked": len(failures) + 1,
+                            "seconds": time.monotonic() - start,
+                            "errors": result.errors,
+                        },
+                    }
+                if result.ok:
+                    seconds = time.monotonic() - start
+                    stats.verified_requests += 1
+                    stats.time_to_valid.append(seconds)
+                    log_event(logger, logging.INFO, "best-of-n verified", candidates=n, checked=len(failures) + 1, seconds=round(seconds, 3))
+                    return {"agent_response": answer, "verification": {"verified": True, "candidates": n, "checked": len(failures) + 1, "seconds": seconds}}
+                failures.append(result)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if not answers:
+        if errors:
+            raise errors[0]
+        raise DeadlineExceeded(f"Deadline of {deadline.budget:.2f}s exceeded before any candidate finished")
+    log_event(logger, logging.INFO, "best-of-n unverified", candidates=n, checked=len(failures))
+    return {
+        "agent_response": answers[0],
+        "verification": {
+            "verified": False,
+            "candidates": n,
+            "checked": len(failures),
+            "seconds": time.monotonic() - start,
+            "errors": failures[0].errors if failures else None,
+        },
+    }
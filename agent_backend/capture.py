@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+# JSONL file that /ai and /functioniser payloads are appended to; capture is off when unset
+CAPTURE_LOG = os.environ.get("CAPTURE_LOG")
+# Salt for hashing tenant ids, so captured logs cannot be joined back to API keys
+CAPTURE_SALT = os.environ.get("CAPTURE_SALT", "stellar-orbit")
+
+# Secrets and personal data scrubbed from captured payloads
+SCRUB_PATTERNS = [
+    (re.compile(r"\bS[A-Z2-7]{55}\b"), "<stellar-secret>"),
+    (re.compile(r"\bG[A-Z2-7]{55}\b"), "<stellar-account>"),
+    (re.compile(r"\bC[A-Z2-7]{55}\b"), "<stellar-contract>"),
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+]
+
+def scrub(value):
+    if isinstance(value, str):
+        for pattern, placeholder in SCRUB_PATTERNS:
+            value = pattern.sub(placeholder, value)
+        return value
+    if isinstance(value, dict):
+        return {key: scrub(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+def anonymize_tenant(tenant: str) -> str:
+    return "t-" + hashlib.sha256((CAPTURE_SALT + tenant).encode()).hexdigest()[:10]
+
+class RequestCapture:
+    """
+    Appends anonymized request payloads with their arrival time to a JSONL log.
+    Records are queued and written by a background thread, so capture never blocks the event loop.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._start()
+        # Forked workers (a preloaded app) need their own writer thread
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._writer, name="request-capture", daemon=True)
+        self._thread.start()
+
+    def record(self, endpoint: str, payload: dict, tenant: str):
+        record = {
+            "ts": time.time(),
+            "endpoint": endpoint,
+            "tenant": anonymize_tenant(tenant),
+            "payload": scrub(payload),
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer(self):
+        # Server workers share the log: each record is one O_APPEND write, so lines never interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        while True:
+            record = self._queue.get()
+            os.write(fd, (json.dumps(record) + "\n").encode())
+
+capture = RequestCapture(CAPTURE_LOG) if CAPTURE_LOG else None
+
+def capture_request(endpoint: str, payload: dict, tenant: str):
+    if capture is not None:
+        capture.record(endpoint, payload, tenant)
@@ -0,0 +1,70 @@
+import functools
+import os
+
+from domain_guidance import DOMAIN_GUIDANCE, domain_rules
+from model_registry import stage_completion
+from prompt_budget import fit_prompt
+from query_response_agent import extract_code_locally
+
+# Completion tokens for a code-only answer; the agent stages allow far more for the full answer's prose
+CODE_ONLY_MAX_TOKENS = int(os.environ.get("CODE_ONLY_MAX_TOKENS", 1536))
+
+# Dropped first when the prompt is over the stage's token budget
+SAMPLE_CONTRACT = """#![no_std]
+use soroban_sdk::{contract, contractimpl, symbol_short, Env, Symbol};
+
+const COUNTER: Symbol = symbol_short!("COUNTER");
+
+#[contract]
+pub struct IncrementContract;
+
+#[contractimpl]
+impl IncrementContract {
+    pub fn increment(env: Env) -> u32 {
+        let mut count: u32 = env.storage().instance().get(&COUNTER).unwrap_or(0);
+        count += 1;
+        env.storage().instance().set(&COUNTER, &count);
+        env.storage().instance().extend_ttl(50, 100);
+        count
+    }
+}"""
+
+async def generate_prompt(agent_name: str, user_query, examples=True):
+    """A lean prompt that asks the agent's model for the code only, without explanations."""
+    examples_section = f"The shape of a contract, for reference:\n```rust\n{SAMPLE_CONTRACT}\n```\n\n" if examples else ""
+    return (
+        "You are an expert in Rust and smart contract development using the Stellar blockchain and Soroban SDK.\n"
+        f"{domain_rules(agent_name if agent_name in DOMAIN_GUIDANCE else 'general')}"
+        "All contracts start with `#![no_std]`, import from `soroban_sdk`, and use `#[contract]` and `#[contractimpl]`.\n\n"
+        f"{examples_section}"
+        "Answer with Rust code blocks only: no explanation, no text before or after the code.\n"
+        "- For a copilot request, give only the code that replaces the `######` location.\n"
+        "- For a compilation or runtime error, give the whole fixed contract.\n"
+        "- Otherwise, give the code that answers the query.\n\n"
+        f"User Query: {user_query}"
+    )
+
+async def run_code_only(agent, user_query: str, deadline=None, request_type=None) -> str:
+    """Answers with the code only, in the agent's bulkhead and with its stage's model, under a tight token cap."""
+    async with agent.bulkhead(request_type).slot(deadline):
+        prompt = await fit_prompt(agent.stage, functools.partial(generate_prompt, agent.name), user_query)
+        response = await stage_completion(
+            agent.stage,
+            messages=[{"role": "user", "content": prompt}],
+            top_p=0.95,
+            stream=False,
+            reasoning_format="hidden",
+            max_completion_tokens=CODE_ONLY_MAX_TOKENS,
+            deadline=deadline,
+            # Sized apart from full answers, which are several times longer
+            request_type=f"{request_type}:code_only",
+        )
+    return response.choices[0].message.content
+
+def code_only_result(response: str) -> dict:
+    """The answer with its code blocks taken out locally, so no extraction call is made."""
+    return {
+        "agent_response": response,
+        "response_mode": "code_only",
+        "code_requested": extract_code_locally(response).code_requested,
+    }
@@ -0,0 +1,82 @@
+FENCE = "```"
+# Info strings of the blocks whose code is extracted; an untagged block is taken to be Rust
+RUST_TAGS = ("", "rust", "rs")
+
+class CodeFenceParser:
+    """
+    Incremental parser over an agent's token stream that extracts the first Rust code block.
+    feed() returns the code confirmed to be inside the fence so far, so it can be sent to the
+    client while the answer is still being generated. `done` is set once the fence closes.
+    """
+    def __init__(self):
+        self.state = "before"  # before -> inside -> done
+        self.buffer = ""
+        self.in_other_block = False  # Before the Rust block, inside a block in another language
+        self.line_is_code = False  # The current partial line can no longer be a closing fence
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    def feed(self, text: str) -> str:
+        if self.state == "done":
+            return ""
+        self.buffer += text
+
+        if self.state == "before":
+            self._skip_to_code()
+            if self.state == "before":
+                return ""
+
+        return self._consume_code()
+
+    def _skip_to_code(self):
+        """Follows the fences of complete lines until one opens a Rust block, skipping other blocks whole."""
+        while True:
+            newline = self.buffer.find("\n")
+            if newline == -1:
+                # Only the last line can still turn into a fence
+                return
+            line = self.buffer[:newline].strip()
+            self.buffer = self.buffer[newline + 1:]
+            if not line.startswith(FENCE):
+                continue
+            if self.in_other_block:
+                # The closing fence of the block being skipped
+                self.in_other_block = False
+            elif line[len(FENCE):].strip().lower() in RUST_TAGS:
+                self.state = "inside"
+                return
+            else:
+                self.in_other_block = True
+
+    def _consume_code(self) -> str:
+        code = ""
+        while self.buffer:
+            newline = self.buffer.find("\n")
+            if newline == -1:
+                # Partial line: emit it unless it may still become the closing fence
+                stripped = self.buffer.lstrip()
+                if self.line_is_code or not (FENCE.startswith(stripped) or stripped.startswith(FENCE)):
+                    code += self.buffer
+                    self.buffer = ""
+                    self.line_is_code = True
+                break
+
+            line = self.buffer[:newline + 1]
+            self.buffer = self.buffer[newline + 1:]
+            if not self.line_is_code and line.lstrip().startswith(FENCE):
+                self.state = "done"
+                self.buffer = ""
+                break
+            code += line
+            self.line_is_code = False
+        return code
+
+    def finish(self) -> str:
+        """Flushes held-back text when the stream ends without a closing fence."""
+        if self.state != "inside":
+            return ""
+        code, self.buffer = self.buffer, ""
+        self.state = "done"
+        return "" if code.strip() == FENCE else code
@@ -0,0 +1,329 @@
+import asyncio
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import time
+from collections import OrderedDict, deque
+
+from structured_log import get_logger, log_event
+
+# "cargo" runs cargo check for the wasm target, "stub" accepts every candidate (for tests and local runs)
+COMPILE_VERIFIER = os.environ.get("COMPILE_VERIFIER", "cargo")
+# Builds the sandbox dependencies when the server starts instead of on the first check.
+# Off by default: the first build compiles soroban-sdk and its dependencies, minutes of CPU
+VERIFY_PREWARM = os.environ.get("VERIFY_PREWARM", "0") != "0"
+
+# Sandbox crates, and the warm target directory they share so dependencies are built once.
+# Each server process keeps its candidate crates in its own subdirectory; the warm-up is shared under a file lock.
+VERIFY_WORKSPACE_DIR = os.environ.get("VERIFY_WORKSPACE_DIR", os.path.join(tempfile.gettempdir(), "stellar_verify"))
+VERIFY_TARGET_DIR = os.environ.get("VERIFY_TARGET_DIR", os.path.join(VERIFY_WORKSPACE_DIR, "target"))
+VERIFY_WORKSPACES = int(os.environ.get("VERIFY_WORKSPACES", os.cpu_count() or 1))  # Concurrent checks
+# The sandbox crates use the soroban-sdk version the projects are locked to, unless overridden
+VERIFY_PROJECTS_DIR = os.environ.get("VERIFY_PROJECTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "projects"))
+VERIFY_SOROBAN_SDK = os.environ.get("VERIFY_SOROBAN_SDK")
+DEFAULT_SOROBAN_SDK = "22.0.0"
+VERIFY_CACHE_SIZE = int(os.environ.get("VERIFY_CACHE_SIZE", 1024))  # Check results kept by source hash
+VERIFY_TARGET = os.environ.get("VERIFY_TARGET", "wasm32-unknown-unknown")
+VERIFY_TIMEOUT = float(os.environ.get("VERIFY_TIMEOUT", 120))  # Seconds per check
+VERIFY_MAX_ERROR_CHARS = 4000
+
+logger = get_logger("compile_check")
+
+LOCKED_SDK_PATTERN = re.compile(r'name = "soroban-sdk"\nversion = "([^"]+)"')
+
+CARGO_TOML = """[package]
+name = "{name}"
+version = "0.0.0"
+edition = "2021"
+publish = false
+
+[lib]
+crate-type = ["cdylib"]
+doctest = false
+
+[dependencies]
+soroban-sdk = "{sdk}"
+
+[profile.dev]
+debug = 0
+"""
+
+# Checked once at startup so the shared target directory holds the built dependencies
+WARMUP_CONTRACT = """#![no_std]
+use soroban_sdk::{contract, contractimpl, vec, Env, String, Vec};
+
+#[contract]
+pub struct Contract;
+
+#[contractimpl]
+impl Contract {
+    pub fn hello(env: Env, to: String) -> Vec<String> {
+        vec![&env, String::from_str(&env, "Hello"), to]
+    }
+}
+"""
+
+class CheckResult:
+    def __init__(self, ok: bool, errors: str = "", seconds: float = 0.0, cached: bool = False, unverifiable: bool = False):
+        self.ok = ok
+        self.errors = errors
+        self.seconds = seconds
+        self.cached = cached
+        self.unverifiable = unverifiable  # The code cannot be checked in a sandbox crate, so `ok` says nothing
+
+    def to_dict(self) -> dict:
+        return {"ok": self.ok, "errors": self.errors, "seconds": self.seconds, "cached": self.cached}
+
+class StubVerifier:
+    """Accepts code for which `predicate(code)` is true (all code by default), after `delay` seconds."""
+    def __init__(self, predicate=None, delay: float = 0.0):
+        self.predicate = predicate
+        self.delay = delay
+
+    async def start(self):
+        pass
+
+    async def check(self, code: str) -> CheckResult:
+        start = time.monotonic()
+        await asyncio.sleep(self.delay)
+        ok = self.predicate(code) if self.predicate else True
+        return CheckResult(ok, "" if ok else "Rejected by the stub verifier", time.monotonic() - start)
+
+    def metrics(self) -> dict:
+        return {"stub": True}
+
+def pinned_sdk(projects_dir: str = VERIFY_PROJECTS_DIR) -> tuple:
+    """
+    The soroban-sdk version the projects are locked to (the most common one) and a Cargo.lock
+    that pins it with its dependencies. VERIFY_SOROBAN_SDK overrides the version, without a lockfile.
+    """
+    if VERIFY_SOROBAN_SDK:
+        return VERIFY_SOROBAN_SDK, None
+    locks = {}
+    for lockfile in sorted(glob.glob(os.path.join(projects_dir, "*", "Cargo.lock"))):
+        with open(lockfile) as f:
+            match = LOCKED_SDK_PATTERN.search(f.read())
+        if match:
+            locks.setdefault(match.group(1), []).append(lockfile)
+    if not locks:
+        return DEFAULT_SOROBAN_SDK, None
+    version = max(locks, key=lambda version: len(locks[version]))
+    return f"={version}", locks[version][0]
+
+class CheckCache:
+    """LRU cache of check results by source hash; identical code is only compiled once."""
+    def __init__(self, max_size: int = VERIFY_CACHE_SIZE):
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, code: str, salt: str = "") -> str:
+        return hashlib.sha256((salt + "\0" + code).encode()).hexdigest()
+
+    def get(self, key: str):
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._results.move_to_end(key)
+        return result
+
+    def put(self, key: str, result: CheckResult):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+class CargoVerifier:
+    """
+    Runs `cargo check` for the wasm target in a pool of sandbox crates pinned to the projects'
+    soroban-sdk version. The dependencies are built once into a single warm target directory at startup,
+    and every sandbox crate gets a hard-linked view of it, so up to `workspaces` checks run at once
+    (cargo locks a target directory per build) and each one only compiles the candidate itself.
+    Results are cached by source hash.
+    """
+    def __init__(self, root: str = VERIFY_WORKSPACE_DIR, target_dir: str = VERIFY_TARGET_DIR, workspaces: int = VERIFY_WORKSPACES):
+        self.root = root
+        self.target_dir = target_dir
+        self.workspaces = workspaces
+        self.sdk, self.lockfile = pinned_sdk()
+        self.cache = CheckCache()
+        self._free = None
+        self._ready = None
+        self.checks = 0
+        self.in_flight = 0
+        self.check_seconds = deque(maxlen=1000)
+        self.warm_seconds = None
+
+    def _create_crate(self, name: str) -> str:
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.join(path, "src"), exist_ok=True)
+        with open(os.path.join(path, "Cargo.toml"), "w") as f:
+            f.write(CARGO_TOML.format(name=os.path.basename(name), sdk=self.sdk))
+        if self.lockfile:
+            shutil.copyfile(self.lockfile, os.path.join(path, "Cargo.lock"))
+        return path
+
+    def _link_target(self, path: str):
+        """Gives a sandbox crate its own target directory made of hard links to the warm one."""
+        target = os.path.join(path, "target")
+        shutil.rmtree(target, ignore_errors=True)
+        if os.path.isdir(self.target_dir):
+            # Cargo's lock files must not be shared, or the crates would wait on each other again
+            shutil.copytree(self.target_dir, target, copy_function=os.link, ignore=shutil.ignore_patterns(".cargo-lock"))
+
+    def _lock_warm(self):
+        """Takes the cross-process warm-up lock; returns its file, whose closing releases it."""
+        os.makedirs(self.root, exist_ok=True)
+        lock = open(os.path.join(self.root, "warm.lock"), "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _remove_dead_workers(self):
+        """Removes the candidate crates of server processes that are gone."""
+        for path in glob.glob(os.path.join(self.root, "worker_*")):
+            pid = int(path.rsplit("_", 1)[1])
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                shutil.rmtree(path, ignore_errors=True)
+            except PermissionError:
+                pass
+
+    async def _build_warm(self):
+        """Builds the dependencies into the warm target directory, unless another process already did."""
+        stamp = os.path.join(self.target_dir, f".warm-{self.sdk}")
+        if os.path.exists(stamp):
+            return
+        warm = self._create_crate("warm")
+        with open(os.path.join(warm, "src", "lib.rs"), "w") as f:
+            f.write(WARMUP_CONTRACT)
+        try:
+            returncode, stderr = await self._cargo_check(warm, self.target_dir)
+        except (asyncio.TimeoutError, FileNotFoundError) as e:
+            log_event(logger, logging.WARNING, "verifier warm-up failed", errors=str(e) or type(e).__name__)
+            return
+        if returncode != 0:
+            log_event(logger, logging.WARNING, "verifier warm-up failed", errors=stderr[-VERIFY_MAX_ERROR_CHARS:])
+            return
+        with open(stamp, "w"):
+            pass
+
+    async def _warm(self):
+        start = time.monotonic()
+        # Server workers start together; the first one builds and the others wait for it
+        lock = await asyncio.to_thread(self._lock_warm)
+        try:
+            await asyncio.to_thread(self._remove_dead_workers)
+            await self._build_warm()
+        finally:
+            lock.close()
+
+        worker = f"worker_{os.getpid()}"
+        slots = [self._create_crate(os.path.join(worker, f"candidate_{index}")) for index in range(self.workspaces)]
+        await asyncio.to_thread(lambda: [self._link_target(slot) for slot in slots])
+        for slot in slots:
+            self._free.put_nowait(slot)
+        self.warm_seconds = time.monotonic() - start
+        log_event(logger, logging.INFO, "verifier ready", sdk=self.sdk, workspaces=self.workspaces, seconds=round(self.warm_seconds, 3))
+
+    async def start(self):
+        """Builds the dependencies and prepares the sandbox crates in the background."""
+        if self._ready is None:
+            self._free = asyncio.Queue()
+            self._ready = asyncio.create_task(self._warm())
+
+    async def _cargo_check(self, path: str, target_dir: str) -> tuple:
+        process = await asyncio.create_subprocess_exec(
+            "cargo", "check", "--quiet", "--message-format", "short", "--target", VERIFY_TARGET,
+            cwd=path,
+            env={**os.environ, "CARGO_TARGET_DIR": target_dir},
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), VERIFY_TIMEOUT)
+        except BaseException:
+            # Timed out, or the candidate was cancelled because another one already passed
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        return process.returncode, stderr.decode(errors="replace")
+
+    async def check(self, code: str) -> CheckResult:
+        key = self.cache.key(code, self.sdk)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return CheckResult(cached.ok, cached.errors, 0.0, cached=True)
+
+        await self.start()
+        # Checks arriving during the warm-up wait for it rather than building the dependencies again
+        ready = self._ready
+        try:
+            await asyncio.shield(ready)
+        except Exception as e:
+            # The sandbox could not be prepared (e.g. a permission error); the next check tries again
+            if self._ready is ready:
+                self._ready = None
+            log_event(logger, logging.WARNING, "verifier unavailable", errors=str(e) or type(e).__name__)
+            return CheckResult(False, f"The verifier is unavailable: {str(e) or type(e).__name__}", unverifiable=True)
+        path = await self._free.get()
+        start = time.monotonic()
+        self.in_flight += 1
+        try:
+            with open(os.path.join(path, "src", "lib.rs"), "w") as f:
+                f.write(code)
+            try:
+                returncode, stderr = await self._cargo_check(path, os.path.join(path, "target"))
+            except asyncio.TimeoutError:
+                return CheckResult(False, f"cargo check timed out after {VERIFY_TIMEOUT:.0f}s", time.monotonic() - start)
+            except FileNotFoundError:
+                return CheckResult(False, "cargo is not installed", time.monotonic() - start)
+            result = CheckResult(returncode == 0, stderr[-VERIFY_MAX_ERROR_CHARS:], time.monotonic() - start)
+            self.checks += 1
+            self.check_seconds.append(result.seconds)
+            self.cache.put(key, result)
+            return result
+        finally:
+            self.in_flight -= 1
+            self._free.put_nowait(path)
+
+    def metrics(self) -> dict:
+        return {
+            "sdk": self.sdk,
+            "ready": self._ready is not None and self._ready.done(),
+            "warm_seconds": self.warm_seconds,
+            "workspaces": self.workspaces,
+            "in_flight": self.in_flight,
+            "checks": self.checks,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "p50_check_seconds": statistics.median(self.check_seconds) if self.check_seconds else None,
+        }
+
+VERIFIERS = {
+    "stub": StubVerifier,
+    "cargo": CargoVerifier,
+}
+
+_verifier = None
+
+def get_verifier():
+    global _verifier
+    if _verifier is None:
+        _verifier = VERIFIERS[COMPILE_VERIFIER]()
+    return _verifier
+
+def set_verifier(verifier):
+    """Replaces the verifier, e.g. with a StubVerifier in tests."""
+    global _verifier
+    _verifier = verifier
@@ -0,0 +1,60 @@
+import math
+import os
+from collections import deque
+
+# Rolling window of observed completion lengths per (stage, request_type)
+SIZER_WINDOW = int(os.environ.get("SIZER_WINDOW", 200))
+# Samples needed before the observed sizes replace the configured limit
+SIZER_MIN_SAMPLES = int(os.environ.get("SIZER_MIN_SAMPLES", 20))
+SIZER_PERCENTILE = float(os.environ.get("SIZER_PERCENTILE", 0.95))
+SIZER_HEADROOM = float(os.environ.get("SIZER_HEADROOM", 0.25))  # Fraction added on top of the percentile
+SIZER_MIN_TOKENS = int(os.environ.get("SIZER_MIN_TOKENS", 256))
+
+class CompletionSizer:
+    """
+    Sets max_completion_tokens from the completion lengths actually observed for each
+    stage and request type: a rolling high percentile plus headroom, capped at the configured limit.
+    """
+    def __init__(self):
+        self._samples = {}
+        self.truncations = {}
+        self.retries = {}
+
+    def _key(self, stage: str, request_type=None) -> str:
+        return f"{stage}:{request_type or 'any'}"
+
+    def record(self, stage: str, request_type, completion_tokens: int):
+        key = self._key(stage, request_type)
+        if key not in self._samples:
+            self._samples[key] = deque(maxlen=SIZER_WINDOW)
+        self._samples[key].append(completion_tokens)
+
+    def record_truncation(self, stage: str, request_type, retried: bool):
+        key = self._key(stage, request_type)
+        self.truncations[key] = self.truncations.get(key, 0) + 1
+        if retried:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def max_tokens(self, stage: str, request_type, limit: int) -> int:
+        samples = self._samples.get(self._key(stage, request_type))
+        if not samples or len(samples) < SIZER_MIN_SAMPLES:
+            return limit
+        ordered = sorted(samples)
+        percentile = ordered[math.ceil(SIZER_PERCENTILE * (len(ordered) - 1))]
+        cap = int(percentile * (1 + SIZER_HEADROOM))
+        return max(SIZER_MIN_TOKENS, min(limit, cap))
+
+    def metrics(self) -> dict:
+        metrics = {}
+        for key in set(self._samples) | set(self.truncations):
+            ordered = sorted(self._samples.get(key, []))
+            metrics[key] = {
+                "samples": len(ordered),
+                "p50": ordered[len(ordered) // 2] if ordered else None,
+                "max": ordered[-1] if ordered else None,
+                "truncations": self.truncations.get(key, 0),
+                "retries": self.retries.get(key, 0),
+            }
+        return metrics
+
+sizer = CompletionSizer()
@@ -1,12 +1,41 @@
-from groq import Groq, AsyncGroq
+import asyncio
+import json
+import logging
 import os
+import time
+from typing import List
+from pydantic import BaseModel
+from model_registry import stage_completion, structured_completion
+from prompt_budget import fit_prompt
+from query_response_agent import extract_code_locally
+from json_repair import parse_model
+from structured_log import get_logger, log_event
 
-# Initialize Groq client
-client = AsyncGroq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
+# Generation requests are planned once and Contract A and Contract B are then written concurrently;
+# "0" writes both in one completion as before
+CROSS_CONTRACT_DECOMPOSE = os.environ.get("CROSS_CONTRACT_DECOMPOSE", "1") != "0"
 
-async def generate_prompt(user_query):
+logger = get_logger("cross_contract_agent")
+
+class Parameter(BaseModel):
+    name: str
+    type: str
+
+class ContractFunction(BaseModel):
+    name: str
+    parameters: List[Parameter]
+    returns: str  # "()" when the function returns nothing
+    description: str
+
+# The interface both halves are generated against
+class InterfacePlan(BaseModel):
+    explanation: str  # What the user asked for and how the two contracts work together
+    contract_a_crate: str  # Crate name of Contract A, which names its wasm file
+    contract_a_functions: List[ContractFunction]  # Called by Contract B
+    contract_b_functions: List[ContractFunction]
+    key_points: List[str]
+
+async def generate_prompt(user_query, examples=True):
     """
     Generates a prompt for the Groq model based on the user's query.
     Includes sample code for cross-contract calls, Rust data structures, functions, and examples.
@@ -145,6 +174,12 @@ async def generate_prompt(user_query):
     ```
     """
 
+    # Dropped first when the prompt is over the stage's token budget
+    examples_section = (
+        "Here are some key Rust data structures, functions, and examples to guide your responses:\n"
+        f"{rust_examples}\n\n"
+    ) if examples else ""
+
     prompt = (
         "You are an expert in Rust and smart contract development using the Stellar blockchain and Soroban SDK. "
         "Your task is to assist the user in one of the following ways:\n"
@@ -175,8 +210,7 @@ async def generate_prompt(user_query):
         "3. **Assistance**:\n"
         "   - Provide detailed explanations of functions, macros, or concepts, including their purpose, usage, and interaction with the Stellar blockchain.\n"
         "   - Include examples and best practices (e.g., storing contract IDs, error handling).\n\n"
-        "Here are some key Rust data structures, functions, and examples to guide your responses:\n"
-        f"{rust_examples}\n\n"
+        f"{examples_section}"
         "For each case, follow this output format:\n"
         "- First, explain what the user is asking for (debugging, generating code, or assistance).\n"
         "- Then, cite the important points (e.g., what is wrong in debugging, what the generated code does, or what the property/function does).\n"
@@ -188,27 +222,159 @@ async def generate_prompt(user_query):
     )
     return prompt
 
-async def cross_contract_agent(user_query):
+def render_functions(functions: list) -> str:
+    lines = []
+    for function in functions:
+        parameters = ", ".join(f"{parameter.name}: {parameter.type}" for parameter in function.parameters)
+        returns = "" if function.returns in ("()", "", "void") else f" -> {function.returns}"
+        lines.append(f"- `pub fn {function.name}({parameters}){returns}`: {function.description}")
+    return "\n".join(lines)
+
+def wasm_path(plan: InterfacePlan) -> str:
+    crate = plan.contract_a_crate.replace("-", "_")
+    return f"../{plan.contract_a_crate}/target/wasm32-unknown-unknown/release/{crate}.wasm"
+
+async def generate_plan_prompt(user_query, examples=True):
+    return (
+        "You are an expert in Soroban smart contracts on the Stellar blockchain. "
+        "The user wants two contracts: Contract A (the target contract) and Contract B (the caller), "
+        "which calls Contract A through `contractimport!` and `contract_a::Client`.\n"
+        "Fix the interface between them before any code is written:\n"
+        "- the crate name of Contract A;\n"
+        "- the public functions of Contract A that Contract B calls, with exact Soroban types (the `env: Env` parameter included);\n"
+        "- the public functions of Contract B, including how it learns the address of Contract A;\n"
+        "- a short explanation and the key points of the design.\n\n"
+        "The response must be a JSON object with the following schema:\n"
+        f"{json.dumps(InterfacePlan.model_json_schema(), indent=2)}\n\n"
+        f"User Query: {user_query}"
+    )
+
+async def generate_half_prompt(user_query, plan: InterfacePlan, side: str, examples=True):
+    """Prompt for writing one of the two contracts against the planned interface."""
+    if side == "A":
+        task = (
+            "Write Contract A (the target contract). It must implement exactly these public functions:\n"
+            f"{render_functions(plan.contract_a_functions)}\n"
+        )
+    else:
+        task = (
+            "Write Contract B (the caller contract). It must implement exactly these public functions:\n"
+            f"{render_functions(plan.contract_b_functions)}\n\n"
+            "It calls Contract A, which exposes these functions:\n"
+            f"{render_functions(plan.contract_a_functions)}\n\n"
+            "Import Contract A with:\n"
+            f"```rust\nmod contract_a {{\n    soroban_sdk::contractimport!(file = \"{wasm_path(plan)}\");\n}}\n```\n"
+            "and call it through `contract_a::Client::new(&env, &contract_id)`.\n"
+        )
+    example = ""
+    if examples:
+        example = (
+            "Contracts follow this structure:\n"
+            "```rust\n#![no_std]\nuse soroban_sdk::{contract, contractimpl, Env};\n\n"
+            "#[contract]\npub struct ContractA;\n\n#[contractimpl]\nimpl ContractA {\n"
+            "    pub fn add(env: Env, x: u32, y: u32) -> u32 {\n        x.checked_add(y).expect(\"no overflow\")\n    }\n}\n```\n\n"
+        )
+    return (
+        "You are an expert in Rust and smart contract development using the Stellar blockchain and Soroban SDK.\n"
+        f"The user asked: {user_query}\n\n"
+        f"Design: {plan.explanation}\n\n"
+        f"{task}\n"
+        f"{example}"
+        "The contract must start with `#![no_std]`, import from `soroban_sdk`, and use `#[contract]` and `#[contractimpl]`.\n"
+        "Answer with the complete contract in a single Rust code block and nothing else."
+    )
+
+def assemble(plan: InterfacePlan, answer_a: str, answer_b: str) -> str:
+    """Builds the response in the format of a single cross_contract_agent answer."""
+    def code(answer):
+        blocks = extract_code_locally(answer).code_requested
+        return blocks[0] if blocks else answer.strip("\n")
+
+    points = "\n".join(f"- {point}" for point in plan.key_points)
+    return (
+        f"{plan.explanation}\n\n"
+        f"{points}\n\n"
+        f"**Contract A (Target Contract)**:\n```rust\n{code(answer_a)}\n```\n\n"
+        f"**Contract B (Caller Contract)**:\n```rust\n{code(answer_b)}\n```\n\n"
+        "Deploy Contract A first, build it so Contract B can import its wasm, and pass its address to Contract B."
+    )
+
+async def generate_half(user_query, plan: InterfacePlan, side: str, deadline=None, request_type=None):
+    prompt = await fit_prompt(
+        "cross_contract_half",
+        lambda query, examples=True: generate_half_prompt(query, plan, side, examples),
+        user_query,
+    )
+    response = await stage_completion(
+        "cross_contract_half",
+        messages=[{"role": "user", "content": prompt}],
+        top_p=0.95,
+        stream=False,
+        reasoning_format="hidden",
+        deadline=deadline,
+        request_type=request_type,
+    )
+    return response.choices[0].message.content
+
+async def decomposed_answer(user_query, deadline=None, request_type=None):
+    """
+    Plans the interface between the two contracts in one short call, then writes Contract A and
+    Contract B concurrently against it, so the wall-clock time is about the longer of the two halves.
+    Raises ValueError when the plan cannot be parsed.
+    """
+    start = time.monotonic()
+    plan_prompt = await fit_prompt("cross_contract_plan", generate_plan_prompt, user_query)
+    plan = await structured_completion(
+        "cross_contract_plan",
+        lambda content: parse_model("cross_contract_plan", content, InterfacePlan),
+        messages=[{"role": "user", "content": plan_prompt}],
+        deadline=deadline,
+        request_type=request_type,
+    )
+    planned = time.monotonic()
+
+    halves = [asyncio.create_task(generate_half(user_query, plan, side, deadline, request_type)) for side in "AB"]
+    try:
+        answer_a, answer_b = await asyncio.gather(*halves)
+    finally:
+        # If one half failed, the other is not needed either
+        for half in halves:
+            half.cancel()
+        await asyncio.gather(*halves, return_exceptions=True)
+
+    log_event(
+        logger, logging.INFO, "cross-contract decomposed",
+        plan_ms=round((planned - start) * 1000), halves_ms=round((time.monotonic() - planned) * 1000),
+    )
+    return assemble(plan, answer_a, answer_b)
+
+async def cross_contract_agent(user_query, deadline=None, request_type=None):
     """
     Main function to handle user input and interact with the Groq API.
     """
+    if CROSS_CONTRACT_DECOMPOSE and request_type == "generation":
+        try:
+            return await decomposed_answer(user_query, deadline, request_type)
+        except ValueError as e:
+            log_event(logger, logging.WARNING, "cross-contract plan failed, answering in one completion", error=str(e))
+
     # Generate the prompt
-    prompt = await generate_prompt(user_query)
+    prompt = await fit_prompt("cross_contract_agent", generate_prompt, user_query)
 
-    # Call the Groq API
-    chat_completion = await client.chat.completions.create(
-        model="deepseek-r1-distill-llama-70b",
+    # Call the LLM with the model and limits configured for this stage
+    response = await stage_completion(
+        "cross_contract_agent",
         messages=[
             {
                 "role": "user",
                 "content": prompt
             }
         ],
-        temperature=0.6,  # Optimal temperature for reasoning tasks
-        max_completion_tokens=2048,  # Adjust based on complexity
         top_p=0.95,
         stream=False,  # Enable streaming for incremental output
-        reasoning_format="hidden"
+        reasoning_format="hidden",
+        deadline=deadline,
+        request_type=request_type,
     )
 
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+    return response.choices[0].message.content
\ No newline at end of file
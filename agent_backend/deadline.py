@@ -0,0 +1,69 @@
+import asyncio
+import os
+import time
+
+# Below this many seconds, routing uses the local keyword router instead of the LLM
+LOCAL_ROUTER_SECONDS = float(os.environ.get("DEADLINE_LOCAL_ROUTER_SECONDS", 5.0))
+# Below this many seconds, code extraction is done locally instead of with the LLM
+EXTRACTION_MIN_SECONDS = float(os.environ.get("DEADLINE_EXTRACTION_MIN_SECONDS", 4.0))
+# A stage is not started at all with less time than this left
+MIN_STAGE_SECONDS = float(os.environ.get("DEADLINE_MIN_STAGE_SECONDS", 0.5))
+# Rough upstream generation speed, used to size max_completion_tokens to the budget
+TOKENS_PER_SECOND = float(os.environ.get("DEADLINE_TOKENS_PER_SECOND", 200))
+MIN_COMPLETION_TOKENS = 128
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Deadline:
+    """
+    Absolute deadline for a request, created from a relative budget.
+    Passed down through routing and the agents so each stage can adapt to the time left.
+    """
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_ms(cls, milliseconds):
+        if milliseconds is None:
+            return None
+        return cls(float(milliseconds) / 1000)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str):
+        """Fails fast if there is not enough time left to start `stage`."""
+        if self.remaining() < MIN_STAGE_SECONDS:
+            raise DeadlineExceeded(f"Deadline of {self.budget:.2f}s cannot be met: not enough time left for {stage}")
+
+    def max_tokens(self, default: int) -> int:
+        """Lowers the completion token cap to what can be generated in the remaining time."""
+        affordable = int(self.remaining() * TOKENS_PER_SECOND)
+        return max(MIN_COMPLETION_TOKENS, min(default, affordable))
+
+    async def run(self, awaitable, stage: str):
+        """Awaits `awaitable`, cancelling it and raising DeadlineExceeded when the deadline passes."""
+        try:
+            self.check(stage)
+        except DeadlineExceeded:
+            awaitable.close()
+            raise
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Deadline of {self.budget:.2f}s exceeded during {stage}")
+
+async def with_deadline(deadline, awaitable, stage: str):
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(awaitable, stage)
+
+def completion_tokens(deadline, default: int) -> int:
+    if deadline is None:
+        return default
+    return deadline.max_tokens(default)
@@ -0,0 +1,45 @@
+# Condensed guidance per agent domain, shared by the fused prompt and the code-only prompts.
+# Domain -> (what it covers, rules, sample or None)
+DOMAIN_GUIDANCE = {
+    "general": (
+        "strings, greetings and general-purpose contracts",
+        [
+            "Use `String::from_str(&env, \"text\")` and `vec![&env, item1, item2]`.",
+        ],
+        "`pub fn hello(env: Env, to: String) -> Vec<String> { vec![&env, String::from_str(&env, \"Hello\"), to] }`",
+    ),
+    "storage": (
+        "storing, retrieving or persisting data",
+        [
+            "Use `env.storage().instance()`, `.persistent()` or `.temporary()` with `set(&key, &value)`, `get(&key)`, `has(&key)`, `remove(&key)`.",
+            "Keys are `symbol_short!(\"KEY\")` constants or `#[contracttype]` enums; call `extend_ttl(min, max)` after writes.",
+            "Use `unwrap_or(default)` instead of `expect` when reading.",
+        ],
+        None,
+    ),
+    "cross_contract": (
+        "contracts that call other contracts",
+        [
+            "Import the callee with `mod contract_a { soroban_sdk::contractimport!(file = \"...wasm\"); }`.",
+            "Call it through `contract_a::Client::new(&env, &contract_id)`.",
+            "Provide **Contract A** (callee) first and then **Contract B** (caller), each in its own code block.",
+        ],
+        None,
+    ),
+    "atomic_swap": (
+        "swapping tokens between two parties",
+        [
+            "Authorize both parties with `a.require_auth_for_args(...)` and `b.require_auth_for_args(...)`.",
+            "Check `amount_b >= min_b_for_a` and `amount_a >= min_a_for_b` before transferring.",
+            "Move tokens with `token::Client::new(&env, &token)` and `transfer(&from, &to, &amount)`.",
+        ],
+        None,
+    ),
+}
+
+def domain_rules(domain: str, indent: str = "", samples: bool = False) -> str:
+    """The domain's rules as a markdown list, with its sample when `samples` is set."""
+    _, rules, sample = DOMAIN_GUIDANCE[domain]
+    if samples and sample is not None:
+        rules = rules + [f"Sample: {sample}"]
+    return "".join(f"{indent}- {rule}\n" for rule in rules)
@@ -1,18 +1,19 @@
-from groq import Groq, AsyncGroq
-import os
 import json
+import logging
 from dotenv import load_dotenv
 import asyncio
+from deadline import DeadlineExceeded
+from model_registry import structured_completion
+from json_repair import parse_json
+from prompt_budget import fit_prompt, trim_contract
+from structured_log import get_logger, log_payload
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Groq client
-client = AsyncGroq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
+logger = get_logger("functioniser")
 
-async def generate_prompt(contract_code: str) -> str:
+async def generate_prompt(contract_code: str, examples: bool = True) -> str:
     """
     Generates a comprehensive prompt for the Groq model with:
     - Example contracts and expected outputs
@@ -98,21 +99,8 @@ async def generate_prompt(contract_code: str) -> str:
         ]
     }
 
-    prompt = f"""
-    You are an expert Rust/Soroban smart contract developer. Your task is to:
-    1. Analyze provided contract code
-    2. Extract all public contract functions
-    3. Return their metadata in the exact JSON format as shown below
-
-    Rules:
-    - Only include functions marked with `#[contractimpl]`
-    - Only include public (pub) functions
-    - Skip internal/private functions
-    - For parameters, use their exact Rust types
-    - For return types, use "void" if returning ()
-    - Maintain the exact output structure
-    - Always include the 'env' parameter if it exists
-
+    # Dropped first when the prompt is over the stage's token budget
+    examples_section = f"""
     Example 1:
     Contract:
     ```rust
@@ -130,7 +118,24 @@ async def generate_prompt(contract_code: str) -> str:
 
     Correct output:
     {json.dumps(sample_output_2, indent=2)}
+    """ if examples else ""
+
+    prompt = f"""
+    You are an expert Rust/Soroban smart contract developer. Your task is to:
+    1. Analyze provided contract code
+    2. Extract all public contract functions
+    3. Return their metadata in the exact JSON format as shown below
 
+    Rules:
+    - Only include functions marked with `#[contractimpl]`
+    - Only include public (pub) functions
+    - Skip internal/private functions
+    - For parameters, use their exact Rust types
+    - For return types, use "void" if returning ()
+    - Maintain the exact output structure
+    - Always include the 'env' parameter if it exists
+
+    {examples_section}
     Contract code to analyze:
     ```rust
     {contract_code}
@@ -141,39 +146,44 @@ async def generate_prompt(contract_code: str) -> str:
 
     return prompt
 
-async def analyze_contract(contract_code: str) -> dict:
+def parse_analysis(content: str) -> dict:
+    """Parses and validates the function metadata, dropping the implicit `env` parameter."""
+    result = parse_json("analyze_contract", content)
+    if not isinstance(result.get("functions"), list):
+        raise ValueError("Invalid response format")
+
+    for function in result["functions"]:
+        if not isinstance(function, dict):
+            raise ValueError("Invalid response format")
+        function["parameters"] = [
+            param for param in function.get("parameters") or []
+            if not (isinstance(param, dict) and param.get("name") == "env")
+        ]
+    return result
+
+async def analyze_contract(contract_code: str, deadline=None) -> dict:
     """
     Main function to:
     1. Generate the analysis prompt
-    2. Call Groq API
+    2. Call the LLM
     3. Return structured function metadata
     """
-    prompt = await generate_prompt(contract_code)
+    prompt = await fit_prompt("analyze_contract", generate_prompt, contract_code, trim=trim_contract)
     
-    # Debug: print the contract code being analyzed (first 200 chars)
-    print(f"Analyzing contract (preview): {contract_code[:200]}...")
+    # Debug: log a preview of the contract code being analyzed
+    log_payload(logger, logging.DEBUG, "analyzing contract", contract_code[:200])
 
     try:
-        response = await client.chat.completions.create(
-            model="deepseek-r1-distill-llama-70b",
+        # Malformed output is repaired locally before the model is asked again
+        return await structured_completion(
+            "analyze_contract",
+            parse_analysis,
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.05,  # Lower temp for precise formatting
-            response_format={"type": "json_object"},
-            max_tokens=2048
+            deadline=deadline,
         )
 
-        # Parse and validate the response
-        result = json.loads(response.choices[0].message.content)
-        if not isinstance(result, dict) or "functions" not in result:
-            raise ValueError("Invalid response format")
-
-        for function in result["functions"]:
-            function["parameters"] = [
-                param for param in function["parameters"] 
-                if param.get("name") != "env"
-            ]
-        return result
-
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return {"error": str(e)}
 
@@ -189,7 +199,7 @@ async def functionizer_agent(contract_code):
         dict: Dictionary containing functions metadata
     """
     analysis = await analyze_contract(contract_code)
-    print(json.dumps(analysis, indent=2))
+    log_payload(logger, logging.DEBUG, "contract analysis", analysis)
     return analysis
 
 # Sample contracts for testing
@@ -252,9 +262,9 @@ async def run_test():
     # print("\n=== Testing with custom contract ===")
     # await functionizer_agent(custom_contract)
 
-async def functoniser_agent(contract_code):
+async def functoniser_agent(contract_code, deadline=None):
 
-    analysis = await analyze_contract(contract_code)
-    print(json.dumps(analysis, indent=2))
+    analysis = await analyze_contract(contract_code, deadline)
+    log_payload(logger, logging.DEBUG, "contract analysis", analysis)
 
     return analysis
\ No newline at end of file
@@ -0,0 +1,79 @@
+import re
+from deadline import with_deadline
+from model_registry import stage_completion
+from prompt_budget import fit_prompt
+from agent_registry import AGENTS, DEFAULT_AGENT
+from domain_guidance import DOMAIN_GUIDANCE, domain_rules
+
+
+# The first line of the fused response carries the chosen domain, e.g. "AGENT: storage"
+HEADER_PATTERN = re.compile(r"^\s*\**AGENT\**\s*:\s*\**\s*([a-z_]+)", re.IGNORECASE)
+
+async def generate_prompt(user_query, examples=True):
+    """
+    Generates one compact prompt that carries condensed guidance for all four domains,
+    so the model can pick a domain and answer in the same completion.
+    """
+    domain_guidance = "".join(
+        f"    {number}. **{domain}**: {covers}.\n" + domain_rules(domain, indent="       ", samples=examples)
+        for number, (domain, (covers, _, _)) in enumerate(DOMAIN_GUIDANCE.items(), start=1)
+    )
+
+    prompt = (
+        "You are an expert in Rust and smart contract development using the Stellar blockchain and Soroban SDK. "
+        "The user may ask you to debug code, generate a contract, explain code, or complete code at a copilot location.\n\n"
+        "First classify the query into exactly one of these domains, then answer it using that domain's guidance:\n"
+        f"{domain_guidance}\n"
+        "If the query does not match any of the above domains, use 'general'.\n\n"
+        "All contracts start with `#![no_std]`, import from `soroban_sdk`, and use `#[contract]` and `#[contractimpl]`.\n\n"
+        "Output format:\n"
+        "- The very first line must be `AGENT: <domain>` with one of: general, storage, cross_contract, atomic_swap.\n"
+        "- Then explain briefly what the user is asking for and cite the important points.\n"
+        "- Follow this with a Rust code block (if applicable) and close it.\n\n"
+        f"User Query: {user_query}\n\n"
+        "Provide your response below:"
+    )
+    return prompt
+
+def split_header(text: str):
+    """
+    Splits the `AGENT: <domain>` header line from the fused response.
+    Returns (agent, response); defaults to 'general' when the header is missing.
+    """
+    first_line, _, rest = text.partition("\n")
+    match = HEADER_PATTERN.match(first_line)
+    if match and match.group(1).lower() in AGENTS:
+        return match.group(1).lower(), rest.lstrip("\n")
+    return DEFAULT_AGENT, text
+
+async def fused_agent(user_query, deadline=None, request_type=None):
+    """
+    Picks the domain and answers the query in a single streamed completion.
+    Returns a tuple of (agent, response).
+    """
+    prompt = await fit_prompt("fused_agent", generate_prompt, user_query)
+
+    async def complete():
+        stream = await stage_completion(
+            "fused_agent",
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            top_p=0.95,
+            stream=True,  # Stream so the routing header is known before the answer completes
+            reasoning_format="hidden",
+            deadline=deadline,
+            request_type=request_type,
+        )
+
+        content = ""
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                content += chunk.choices[0].delta.content
+        return content
+
+    content = await with_deadline(deadline, complete(), "fused_agent")
+    return split_header(content)
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+# Worker pool and result store limits
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 100))
+JOB_STORE_SIZE = int(os.environ.get("JOB_STORE_SIZE", 1000))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 600))  # Seconds a finished job is kept
+JOB_DRAIN_TIMEOUT = float(os.environ.get("JOB_DRAIN_TIMEOUT", 10))  # Seconds queued jobs may run on shutdown
+
+class JobQueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, request: dict, tenant: str, deadline=None):
+        self.id = uuid.uuid4().hex
+        self.request = request  # The /ai fields, as built by response_cache.cache_request
+        self.request_type = request["request_type"]
+        self.tenant = tenant
+        self.deadline = deadline  # Counts from submission, so time spent queued is part of the budget
+        self.status = "queued"  # queued -> running -> completed | failed
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "request_type": self.request_type,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+class JobStore:
+    """
+    Bounded in-memory store for jobs.
+    Finished jobs expire after `ttl` seconds, and the oldest finished jobs are
+    evicted first when the store is full.
+    """
+    def __init__(self, max_size: int = JOB_STORE_SIZE, ttl: float = JOB_RESULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _expired(self, job: Job, now: float) -> bool:
+        return job.finished and now - job.finished_at > self.ttl
+
+    def purge(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items() if self._expired(job, now)]:
+            del self._jobs[job_id]
+
+    def add(self, job: Job):
+        self.purge()
+        if len(self._jobs) >= self.max_size:
+            # Evict the oldest finished job; pending jobs are bounded by the queue
+            for job_id, old_job in self._jobs.items():
+                if old_job.finished:
+                    del self._jobs[job_id]
+                    break
+        self._jobs[job.id] = job
+
+    def get(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job is not None and self._expired(job, time.time()):
+            del self._jobs[job_id]
+            return None
+        return job
+
+class JobPool:
+    """
+    Runs queued jobs on a fixed number of asyncio workers.
+    `handler` is awaited as handler(request, tenant, deadline).
+    """
+    def __init__(self, handler, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE, store: JobStore = None):
+        self.handler = handler
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.store = store or JobStore()
+        self._tasks = []
+
+    async def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self, drain_timeout: float = 0):
+        """Stops the workers, first letting queued and running jobs finish for up to `drain_timeout` seconds."""
+        if drain_timeout > 0 and self._tasks:
+            try:
+                await asyncio.wait_for(self.queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, request: dict, tenant: str, deadline=None) -> Job:
+        job = Job(request, tenant, deadline)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull("Job queue is full, try again later")
+        self.store.add(job)
+        return job
+
+    async def wait(self, job: Job, timeout: float):
+        """Waits up to `timeout` seconds for the job to finish (long-poll)."""
+        if timeout > 0 and not job.finished:
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await self.handler(job.request, job.tenant, job.deadline)
+                job.status = "completed"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                job.done.set()
+                self.queue.task_done()
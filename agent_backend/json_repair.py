@@ -0,0 +1,153 @@
+import json
+import logging
+import re
+import typing
+
+from pydantic import ValidationError
+
+from structured_log import get_logger, log_event
+
+logger = get_logger("json_repair")
+
+# Double-quoted JSON strings, so fixes can be limited to the text between them
+STRING_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"', re.DOTALL)
+SINGLE_QUOTED_PATTERN = re.compile(r"'(?:\\.|[^'\\])*'", re.DOTALL)
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+UNQUOTED_KEY = re.compile(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)(\s*:)")
+PYTHON_LITERALS = [(re.compile(r"\bTrue\b"), "true"), (re.compile(r"\bFalse\b"), "false"), (re.compile(r"\bNone\b"), "null")]
+# A key left without its value when the output was cut off
+DANGLING_KEY = re.compile(r',?\s*"(?:\\.|[^"\\])*"\s*:\s*$')
+THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+# Stage -> counts of clean parses, local repairs, failed repairs and re-asks of the model
+repair_counts = {}
+
+def record_repair(stage: str, outcome: str):
+    counts = repair_counts.setdefault(stage, {"clean": 0, "repaired": 0, "failed": 0, "reasked": 0})
+    counts[outcome] += 1
+    if outcome != "clean":
+        log_event(logger, logging.INFO, f"json {outcome}", stage=stage)
+
+def extract_json_object(text: str) -> str:
+    """
+    Returns the outermost JSON object in `text`, skipping reasoning preambles and surrounding prose.
+    An object cut off by the token limit is closed so that the parts already generated can be parsed.
+    """
+    text = THINK_BLOCK.sub("", text)
+    if "</think>" in text:
+        text = text.rsplit("</think>", 1)[1]
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No JSON object found")
+
+    closers = []
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if closers:
+                closers.pop()
+            if not closers:
+                return text[start:index + 1]
+
+    # Truncated: close the open string, drop a dangling key or comma, then close the brackets
+    candidate = text[start:]
+    if in_string:
+        candidate += "\\" if escaped else ""
+        candidate += '"'
+    candidate = DANGLING_KEY.sub("", candidate.rstrip()).rstrip().rstrip(",")
+    return candidate + "".join(reversed(closers))
+
+def fix_syntax(text: str) -> str:
+    """Fixes single quotes, trailing commas, unquoted keys and Python literals outside of strings."""
+    fixed = ""
+    position = 0
+    for match in STRING_PATTERN.finditer(text):
+        fixed += _fix_unquoted(text[position:match.start()]) + match.group()
+        position = match.end()
+    return fixed + _fix_unquoted(text[position:])
+
+def _fix_unquoted(segment: str) -> str:
+    # Single-quoted strings (Python dict style) become JSON strings
+    fixed = ""
+    position = 0
+    for match in SINGLE_QUOTED_PATTERN.finditer(segment):
+        fixed += _fix_structure(segment[position:match.start()]) + json.dumps(match.group()[1:-1].replace("\\'", "'"))
+        position = match.end()
+    return fixed + _fix_structure(segment[position:])
+
+def _fix_structure(segment: str) -> str:
+    segment = TRAILING_COMMA.sub(r"\1", segment)
+    segment = UNQUOTED_KEY.sub(r'\1"\2"\3', segment)
+    for pattern, replacement in PYTHON_LITERALS:
+        segment = pattern.sub(replacement, segment)
+    return segment
+
+def _load(text: str) -> tuple:
+    """Returns (data, repaired). Control characters inside strings, e.g. raw newlines in code, are allowed."""
+    try:
+        return json.loads(text, strict=False), False
+    except ValueError:
+        pass
+    return json.loads(fix_syntax(extract_json_object(text)), strict=False), True
+
+def coerce(model, data: dict) -> dict:
+    """Matches keys case-insensitively and wraps or converts values to the model's field types."""
+    keys = {key.lower(): key for key in data}
+    coerced = {}
+    for name, field in model.model_fields.items():
+        key = name if name in data else keys.get(name.lower())
+        if key is None:
+            continue
+        value = data[key]
+        origin = typing.get_origin(field.annotation)
+        if origin in (list, typing.List) and not isinstance(value, list):
+            value = [] if value is None else [value]
+        elif field.annotation is str and not isinstance(value, str) and value is not None:
+            value = str(value)
+        coerced[name] = value
+    return coerced
+
+def parse_json(stage: str, text: str) -> dict:
+    """Parses a JSON object from model output, repairing it locally when needed. Raises ValueError."""
+    try:
+        data, repaired = _load(text)
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+    except ValueError as e:
+        record_repair(stage, "failed")
+        raise ValueError(f"Unrepairable JSON from {stage}: {e}")
+    record_repair(stage, "repaired" if repaired else "clean")
+    return data
+
+def parse_model(stage: str, text: str, model):
+    """
+    Parses model output into the pydantic `model`, repairing the JSON and coercing
+    field types locally when needed. Raises ValueError when the output cannot be repaired.
+    """
+    try:
+        data, repaired = _load(text)
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        try:
+            result = model.model_validate(data)
+        except ValidationError:
+            result = model.model_validate(coerce(model, data))
+            repaired = True
+    except ValueError as e:
+        record_repair(stage, "failed")
+        raise ValueError(f"Unrepairable JSON from {stage}: {e}")
+    record_repair(stage, "repaired" if repaired else "clean")
+    return result
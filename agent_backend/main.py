@@ -1,13 +1,40 @@
-from fastapi import FastAPI, Request
+# Imported first so the startup profile covers the remaining imports
+from startup_profile import profile, FirstRequestMiddleware
+from fastapi import FastAPI, Request, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Literal
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
 import asyncio
-from utils import query_handler, functioniser
+import json
+import logging
+from utils import query_handler, functioniser, build_query, stream_code
+from jobs import JobPool, JobQueueFull, JOB_DRAIN_TIMEOUT
+from deadline import Deadline, DeadlineExceeded
+from tenancy import scheduler, tenant_id_from_headers, QuotaExceeded
+from providers import pool
+from model_registry import registry
+from completion_sizer import sizer
+from json_repair import repair_counts
+from capture import capture_request
+from structured_log import RequestIdMiddleware, get_logger, log_event, log_payload
+from responses import FastJSONResponse, CompressionMiddleware, content_etag, etag_matches
+from token_estimator import estimator
+from prompt_budget import trim_counts
+from sessions import SessionNotFound, SessionTooLarge, run_turn, store as session_store
+from unified_diff import PatchError
+from best_of_n import stats as best_of_stats
+from compile_check import VERIFY_PREWARM, get_verifier
+from patch_edits import patch_counts
+from validate_request import routing_metrics
+from response_cache import cache as response_cache, cache_request, cacheable
+from agent_registry import AGENT_PREWARM, AgentBusy, agent_metrics, prewarm, load_times
 import uvicorn
 
+profile.mark("imported")
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+logger = get_logger("api")
 
 # Enable CORS
 app.add_middleware(
@@ -16,27 +43,340 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],   # Allow all HTTP methods
     allow_headers=["*"],   # Allow all headers
+    expose_headers=["X-Request-ID", "ETag", "X-Cache"],
 )
 
+# Compresses large non-streamed responses such as whole generated contracts
+app.add_middleware(CompressionMiddleware)
+
+# Tags every log line of a request with its X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(FirstRequestMiddleware)
+
+# Background worker pool for long generations
+async def answer_ai_request(cached_request: dict, tenant: str, deadline=None):
+    """Answers an /ai request from the cache, or through the tenant's scheduler slot. Returns the result and X-Cache state."""
+    # Identical requests share one answer; a stale one is served at once and regenerated in the background
+    result, cache_state = response_cache.lookup(cached_request)
+    if result is None:
+        result = await scheduler.run(tenant, query_handler(**cached_request, deadline=deadline), deadline)
+        if cacheable(result, deadline):
+            response_cache.put(cached_request, result)
+    return result, cache_state
+
+async def run_job(cached_request: dict, tenant: str, deadline=None):
+    result, _ = await answer_ai_request(cached_request, tenant, deadline)
+    return result
+
+job_pool = JobPool(run_job)
+
+# Upper bound on how long a single long-poll request may be held open
+MAX_JOB_WAIT = 30.0
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+@app.exception_handler(QuotaExceeded)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceeded):
+    return JSONResponse(status_code=429, content={"detail": str(exc)})
+
+@app.exception_handler(AgentBusy)
+async def agent_busy_handler(request: Request, exc: AgentBusy):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(SessionNotFound)
+async def session_not_found_handler(request: Request, exc: SessionNotFound):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+@app.exception_handler(SessionTooLarge)
+async def session_too_large_handler(request: Request, exc: SessionTooLarge):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
+@app.exception_handler(PatchError)
+async def patch_error_handler(request: Request, exc: PatchError):
+    # The diff was made against a different version of the code than the session holds
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+def resolve_deadline(body_deadline_ms, header_deadline_ms):
+    # The body field takes precedence over the X-Deadline-Ms header
+    deadline_ms = body_deadline_ms if body_deadline_ms is not None else header_deadline_ms
+    if deadline_ms is not None and deadline_ms <= 0:
+        raise HTTPException(status_code=422, detail="deadline_ms must be positive")
+    return Deadline.from_ms(deadline_ms)
+
+@app.on_event("startup")
+async def start_verifier():
+    # Builds the dependencies once and prepares the sandbox crates in the background
+    if VERIFY_PREWARM:
+        await get_verifier().start()
+
+@app.on_event("startup")
+async def start_job_pool():
+    await job_pool.start()
+
+@app.on_event("startup")
+async def start_cache_refresher():
+    # Regenerates stale cached answers in the background
+    await response_cache.start(query_handler)
+
+async def run_prewarm():
+    seconds = await prewarm()
+    profile.mark("prewarmed")
+    log_event(logger, logging.INFO, "prewarmed", seconds=round(seconds, 3))
+
+@app.on_event("startup")
+async def start_prewarm():
+    profile.mark("started")
+    # Agents otherwise load on first use; prewarming runs alongside the first requests
+    if AGENT_PREWARM:
+        app.state.prewarm_task = asyncio.create_task(run_prewarm())
+
+@app.on_event("shutdown")
+async def stop_job_pool():
+    # Runs once the server has stopped accepting requests, so queued jobs can still finish
+    await job_pool.stop(JOB_DRAIN_TIMEOUT)
+    await response_cache.stop()
+
 # Request body model
 class AIRequest(BaseModel):
     request_type: Literal["copilot", "generation", "debugging", "assistance"]
     user_code: str  # Code with rust tags present
     context: str    # Additional context (user prompt or compilation error)
+    deadline_ms: Optional[int] = None  # Time budget for the answer, overrides the X-Deadline-Ms header
+    best_of: int = Field(1, ge=1)  # Candidates generated for debugging and generation; the first that compiles is returned
+    edit_mode: Literal["full", "patch"] = "full"  # "patch" answers debugging and copilot requests with edits applied to user_code
+    response_mode: Literal["full", "code_only"] = "full"  # "code_only" answers with the code blocks only, without explanations
+
+def ai_cache_request(request: AIRequest) -> dict:
+    return cache_request(
+        request.request_type, request.user_code, request.context, request.best_of, request.edit_mode, request.response_mode
+    )
 
 @app.post("/ai")
-async def async_endpoint(request: AIRequest):
-    result = await query_handler(request.request_type, request.user_code, request.context)
-    print(result)
-    return result
+async def async_endpoint(
+    request: AIRequest,
+    x_deadline_ms: Optional[int] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    deadline = resolve_deadline(request.deadline_ms, x_deadline_ms)
+    tenant = tenant_id_from_headers(x_api_key, x_tenant_id)
+    capture_request("/ai", request.model_dump(), tenant)
+    result, cache_state = await answer_ai_request(ai_cache_request(request), tenant, deadline)
+    log_payload(logger, logging.INFO, "ai response", result, request_type=request.request_type, tenant=tenant, cache=cache_state)
+    return FastJSONResponse(result, headers={"X-Cache": cache_state})
+
+@app.post("/ai/stream")
+async def stream_endpoint(
+    request: AIRequest,
+    x_deadline_ms: Optional[int] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    # Streams only the code to insert, mainly for copilot requests
+    deadline = resolve_deadline(request.deadline_ms, x_deadline_ms)
+    tenant = tenant_id_from_headers(x_api_key, x_tenant_id)
+    capture_request("/ai/stream", request.model_dump(), tenant)
+    final_query = build_query(request.request_type, request.user_code, request.context)
+    if final_query is None:
+        raise HTTPException(status_code=400, detail="Copilot requests need exactly two ###### markers in user_code")
+    # Check the quota before the response starts, so over-quota tenants still get a 429
+    scheduler.admit(tenant)
+
+    async def code_chunks():
+        async with scheduler.slot(tenant, deadline):
+            async for code in stream_code(final_query, deadline, request.request_type):
+                yield code
+
+    return StreamingResponse(code_chunks(), media_type="text/plain")
+
+@app.post("/ai/jobs", status_code=202)
+async def submit_job(
+    request: AIRequest,
+    x_deadline_ms: Optional[int] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    deadline = resolve_deadline(request.deadline_ms, x_deadline_ms)
+    tenant = tenant_id_from_headers(x_api_key, x_tenant_id)
+    capture_request("/ai/jobs", request.model_dump(), tenant)
+    # Over-quota tenants get a 429 now rather than a failed job later
+    scheduler.admit(tenant)
+    try:
+        job = job_pool.submit(ai_cache_request(request), tenant, deadline)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+def get_job_or_404(job_id: str):
+    job = job_pool.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/ai/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    # wait > 0 long-polls until the job finishes or the wait runs out
+    job = get_job_or_404(job_id)
+    await job_pool.wait(job, min(wait, MAX_JOB_WAIT))
+    return job.to_dict()
+
+@app.get("/ai/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = get_job_or_404(job_id)
+
+    async def event_stream():
+        yield f"event: status\ndata: {json.dumps({'job_id': job.id, 'status': job.status})}\n\n"
+        while not job.finished:
+            await job_pool.wait(job, MAX_JOB_WAIT)
+            if not job.finished:
+                # Keep the connection alive through proxies
+                yield ": keep-alive\n\n"
+        yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 class FunCode(BaseModel):
     code: str
+    deadline_ms: Optional[int] = None  # Time budget for the analysis, overrides the X-Deadline-Ms header
 
 @app.post("/functioniser")
-async def async_functioniser(request: FunCode):
-    result = await functioniser(request.code)
+async def async_functioniser(
+    request: FunCode,
+    x_deadline_ms: Optional[int] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    deadline = resolve_deadline(request.deadline_ms, x_deadline_ms)
+    tenant = tenant_id_from_headers(x_api_key, x_tenant_id)
+    capture_request("/functioniser", request.model_dump(), tenant)
+    # The analysis of identical code with the same model is treated as the same result,
+    # so clients that already hold it skip the LLM call entirely
+    etag = content_etag(registry.stage("analyze_contract").model, request.code)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    result = await scheduler.run(tenant, functioniser(request.code, deadline), deadline)
+    if "error" in result:
+        return result
+    return FastJSONResponse(result, headers={"ETag": etag})
+
+class SessionCreate(BaseModel):
+    user_code: str = ""  # Starting version of the code the session works on
+
+class SessionTurn(BaseModel):
+    request_type: Literal["copilot", "generation", "debugging", "assistance"]
+    context: str  # The new instruction or compilation error
+    code_diff: Optional[str] = None  # Unified diff against the session's latest code
+    user_code: Optional[str] = None  # Replaces the session's code instead of a diff
+    deadline_ms: Optional[int] = None
+
+@app.post("/sessions", status_code=201)
+async def create_session(
+    request: SessionCreate,
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    tenant = tenant_id_from_headers(x_api_key, x_tenant_id)
+    return session_store.create(tenant, request.user_code).to_dict()
+
+@app.post("/sessions/{session_id}/ai")
+async def session_turn(
+    session_id: str,
+    request: SessionTurn,
+    x_deadline_ms: Optional[int] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    # Only the diff and the new instruction are sent; the history comes from the session
+    deadline = resolve_deadline(request.deadline_ms, x_deadline_ms)
+    tenant = tenant_id_from_headers(x_api_key, x_tenant_id)
+    session = session_store.get(session_id, tenant)
+    result = await scheduler.run(
+        tenant,
+        run_turn(session, query_handler, request.request_type, request.context, deadline, request.user_code, request.code_diff),
+        deadline,
+    )
+    if result is None:
+        raise HTTPException(status_code=400, detail="Copilot requests need exactly two ###### markers in the session code")
+    log_payload(logger, logging.INFO, "session response", result, request_type=request.request_type, tenant=tenant)
     return result
 
+@app.get("/sessions/{session_id}")
+async def get_session(
+    session_id: str,
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    session = session_store.get(session_id, tenant_id_from_headers(x_api_key, x_tenant_id))
+    return {**session.to_dict(), "user_code": session.code}
+
+@app.delete("/sessions/{session_id}", status_code=204)
+async def delete_session(
+    session_id: str,
+    x_api_key: Optional[str] = Header(None),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    session_store.delete(session_id, tenant_id_from_headers(x_api_key, x_tenant_id))
+    return Response(status_code=204)
+
+@app.get("/metrics/tenants")
+async def tenant_metrics():
+    return scheduler.metrics()
+
+@app.get("/metrics/providers")
+async def provider_metrics():
+    return pool.metrics()
+
+@app.get("/metrics/stages")
+async def stage_metrics():
+    return registry.metrics()
+
+@app.get("/metrics/completion-sizes")
+async def completion_size_metrics():
+    return sizer.metrics()
+
+@app.get("/metrics/json-repair")
+async def json_repair_metrics():
+    return repair_counts
+
+@app.get("/metrics/agents")
+async def agents_metrics():
+    return agent_metrics()
+
+@app.get("/metrics/startup")
+async def startup_metrics():
+    return profile.metrics(load_times)
+
+@app.get("/metrics/sessions")
+async def session_metrics():
+    return session_store.metrics()
+
+@app.get("/metrics/best-of")
+async def best_of_metrics():
+    return best_of_stats.metrics()
+
+@app.get("/metrics/patches")
+async def patch_metrics():
+    return patch_counts
+
+@app.get("/metrics/verifier")
+async def verifier_metrics():
+    return get_verifier().metrics()
+
+@app.get("/metrics/routing")
+async def route_batch_metrics():
+    return routing_metrics()
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return response_cache.metrics()
+
+@app.get("/metrics/tokens")
+async def token_metrics():
+    return {"estimator": estimator.metrics(), "trims": trim_counts}
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
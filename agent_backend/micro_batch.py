@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+import statistics
+from collections import deque
+
+class MicroBatcher:
+    """
+    Collects items submitted within `wait` seconds of the first one, up to `max_size`, and
+    hands them to `process(items)` together. `process` returns one result per item, in order;
+    a result that is an exception is raised to that item's caller only.
+    Batches run in an empty context, so no caller's context variables (tenant, request id) leak into them.
+    """
+    def __init__(self, process, wait: float, max_size: int):
+        self.process = process
+        self.wait = wait
+        self.max_size = max_size
+        self._pending = []  # (item, future)
+        self._timer = None
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+        self.sizes = deque(maxlen=1000)
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._run(batch), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        # Callers that gave up while the batch was collecting are left out
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+        self.batches += 1
+        self.items += len(batch)
+        self.sizes.append(len(batch))
+        try:
+            results = await self.process([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def metrics(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else None,
+            "p50_batch_size": statistics.median(self.sizes) if self.sizes else None,
+            "max_batch_size": max(self.sizes) if self.sizes else None,
+            "wait_ms": self.wait * 1000,
+            "max_size": self.max_size,
+        }
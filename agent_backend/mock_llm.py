@@ -0,0 +1,142 @@
+"""
+Local OpenAI-compatible stand-in for the LLM endpoints, for tests and benchmarks.
+Serves canned answers for routing, extraction, functionising and generation prompts
+with configurable latency and error rate.
+
+Usage:
+    python mock_llm.py [--port 9000] [--latency 0.5] [--error-rate 0.0]
+
+Then enable the "local-mock" endpoint in llm_config.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+import uvicorn
+
+# Seconds of simulated time-to-first-token and per-response generation time
+MOCK_LLM_LATENCY = float(os.environ.get("MOCK_LLM_LATENCY", 0.5))
+MOCK_LLM_ERROR_RATE = float(os.environ.get("MOCK_LLM_ERROR_RATE", 0.0))
+
+SAMPLE_CODE = """#![no_std]
+use soroban_sdk::{contract, contractimpl, symbol_short, Env, Symbol};
+
+const COUNTER: Symbol = symbol_short!("COUNTER");
+
+#[contract]
+pub struct IncrementContract;
+
+#[contractimpl]
+impl IncrementContract {
+    pub fn increment(env: Env) -> u32 {
+        let mut count: u32 = env.storage().instance().get(&COUNTER).unwrap_or(0);
+        count += 1;
+        env.storage().instance().set(&COUNTER, &count);
+        env.storage().instance().extend_ttl(50, 100);
+        count
+    }
+}"""
+
+app = FastAPI()
+
+def canned_answer(prompt: str, json_mode: bool) -> str:
+    if json_mode and "pick an agent for each" in prompt:
+        return json.dumps({"labels": ["storage"] * prompt.count("\n<<<\n")})
+    if json_mode and "assign an agent" in prompt:
+        return json.dumps({"expected_field": "storage", "reason": "Mock router"})
+    if json_mode and "Fix the interface" in prompt:
+        function = {"name": "increment", "parameters": [{"name": "env", "type": "Env"}], "returns": "u32", "description": "Mock function"}
+        return json.dumps({
+            "explanation": "Mock plan", "contract_a_crate": "contract_a", "contract_a_functions": [function],
+            "contract_b_functions": [function], "key_points": ["Mock point"],
+        })
+    if json_mode and "functions array" in prompt:
+        return json.dumps({"functions": [{"name": "increment", "parameters": [{"name": "env", "type": "Env"}], "returns": "u32"}]})
+    if json_mode:
+        return json.dumps({"code_updation_required": True, "code_requested": [SAMPLE_CODE]})
+
+    if "Rust code blocks only" in prompt:
+        return f"```rust\n{SAMPLE_CODE}\n```"
+
+    answer = (
+        "The user is asking for a counter stored in instance storage.\n\n"
+        "- The counter is read with `get` and written back with `set`.\n"
+        "- `extend_ttl` keeps the instance entry alive.\n\n"
+        f"```rust\n{SAMPLE_CODE}\n```\n\n"
+        "Let me know if you need anything else."
+    )
+    if "AGENT: <domain>" in prompt:
+        answer = "AGENT: storage\n" + answer
+    return answer
+
+def usage(prompt: str, answer: str) -> dict:
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(answer) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+async def stream_answer(completion_id: str, model: str, answer: str, prompt: str):
+    words = answer.split(" ")
+    delay = MOCK_LLM_LATENCY / max(len(words), 1)
+    for index, word in enumerate(words):
+        content = word if index == len(words) - 1 else word + " "
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(delay)
+    final = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "x_groq": {"id": completion_id, "usage": usage(prompt, answer)},
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < MOCK_LLM_ERROR_RATE:
+        raise HTTPException(status_code=503, detail="Mock endpoint failure")
+
+    prompt = "\n".join(message.get("content") or "" for message in body.get("messages", []))
+    json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+    answer = canned_answer(prompt, json_mode)
+    model = body.get("model", "mock")
+    completion_id = "chatcmpl-" + uuid.uuid4().hex
+
+    if body.get("stream"):
+        return StreamingResponse(stream_answer(completion_id, model, answer, prompt), media_type="text/event-stream")
+
+    await asyncio.sleep(MOCK_LLM_LATENCY)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": usage(prompt, answer),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock LLM endpoint")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=MOCK_LLM_LATENCY)
+    parser.add_argument("--error-rate", type=float, default=MOCK_LLM_ERROR_RATE)
+    args = parser.parse_args()
+    MOCK_LLM_LATENCY = args.latency
+    MOCK_LLM_ERROR_RATE = args.error_rate
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
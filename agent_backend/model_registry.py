@@ -0,0 +1,263 @@
+import json
+import logging
+import time
+
+from completion_sizer import sizer
+from deadline import MIN_STAGE_SECONDS, with_deadline, completion_tokens
+from json_repair import record_repair
+from token_estimator import estimator
+from providers import LLM_CONFIG, chat_completion
+from structured_log import get_logger, log_event
+from tenancy import record_tokens
+
+# While a stage runs on its fallback model, every Nth call still goes to the primary to probe recovery
+PROBE_EVERY = 10
+
+logger = get_logger("stages")
+
+class StageConfig:
+    """
+    Model, sampling and token settings for one pipeline stage, plus its latency SLO.
+    When the primary model's EWMA latency misses the SLO the stage switches to its fallback model.
+    """
+    def __init__(self, name: str, config: dict, alpha: float):
+        self.name = name
+        self.model = config["model"]
+        self.temperature = config.get("temperature", 0.6)
+        self.max_tokens = config.get("max_tokens", 2048)
+        self.prompt_budget = config.get("prompt_budget")  # Prompt tokens the stage trims its inputs to
+        self.slo_ms = config.get("slo_ms")
+        self.fallback = config.get("fallback")
+        self.alpha = alpha
+        self.ewma_latency = {}  # model -> EWMA latency in seconds
+        self.calls = 0
+        self.errors = 0
+        self.fallback_calls = 0
+        self.quality_ok = 0
+        self.quality_bad = 0
+
+    def missing_slo(self) -> bool:
+        latency = self.ewma_latency.get(self.model)
+        return self.slo_ms is not None and latency is not None and latency * 1000 > self.slo_ms
+
+    def select_model(self) -> str:
+        if self.fallback and self.missing_slo() and self.calls % PROBE_EVERY != 0:
+            return self.fallback
+        return self.model
+
+    def record_latency(self, model: str, latency: float):
+        previous = self.ewma_latency.get(model)
+        if previous is None:
+            self.ewma_latency[model] = latency
+        else:
+            self.ewma_latency[model] = self.alpha * latency + (1 - self.alpha) * previous
+
+    def record_quality(self, ok: bool):
+        if ok:
+            self.quality_ok += 1
+        else:
+            self.quality_bad += 1
+
+    def metrics(self) -> dict:
+        return {
+            "model": self.model,
+            "fallback": self.fallback,
+            "slo_ms": self.slo_ms,
+            "missing_slo": self.missing_slo(),
+            "ewma_latency_ms": {model: latency * 1000 for model, latency in self.ewma_latency.items()},
+            "calls": self.calls,
+            "errors": self.errors,
+            "fallback_calls": self.fallback_calls,
+            "quality_ok": self.quality_ok,
+            "quality_bad": self.quality_bad,
+        }
+
+class ModelRegistry:
+    def __init__(self, stages: dict, models: dict):
+        self.stages = stages
+        self.models = models  # model -> {"reasoning": bool}
+
+    @classmethod
+    def from_file(cls, path: str = LLM_CONFIG):
+        with open(path) as f:
+            config = json.load(f)
+        alpha = config.get("ewma_alpha", 0.3)
+        stages = {name: StageConfig(name, stage, alpha) for name, stage in config.get("stages", {}).items()}
+        return cls(stages, config.get("models", {}))
+
+    def stage(self, name: str) -> StageConfig:
+        if name not in self.stages:
+            raise KeyError(f"Stage '{name}' is not configured in the model registry")
+        return self.stages[name]
+
+    def is_reasoning(self, model: str) -> bool:
+        return self.models.get(model, {}).get("reasoning", False)
+
+    def metrics(self) -> dict:
+        return {name: stage.metrics() for name, stage in self.stages.items()}
+
+registry = ModelRegistry.from_file()
+
+async def stage_completion(stage_name: str, deadline=None, request_type=None, **params):
+    """
+    Creates a chat completion for a pipeline stage.
+    The model, temperature and token limit come from the registry, the token limit is sized from
+    the completion lengths observed for the stage and request type and lowered to fit the deadline,
+    and the latency of each call is recorded against the model used.
+    A non-streamed completion cut off by the sized limit is retried once with the configured limit.
+    """
+    stage = registry.stage(stage_name)
+    model = stage.select_model()
+    stage.calls += 1
+    if model != stage.model:
+        stage.fallback_calls += 1
+
+    limit = params.pop("max_completion_tokens", stage.max_tokens)
+    sized_limit = sizer.max_tokens(stage_name, request_type, limit)
+    params["model"] = model
+    params.setdefault("temperature", stage.temperature)
+    params["max_completion_tokens"] = completion_tokens(deadline, sized_limit)
+    if not registry.is_reasoning(model):
+        params.pop("reasoning_format", None)
+
+    # Counted once per call to calibrate the local token estimator against the upstream usage
+    raw_prompt_tokens = estimator.messages_raw_count(params.get("messages", []))
+    start = time.monotonic()
+    try:
+        response = await with_deadline(deadline, chat_completion(**params), stage_name)
+        if params.get("stream"):
+            return _timed_stream(stage, model, start, response, request_type, raw_prompt_tokens)
+
+        if response.choices[0].finish_reason == "length":
+            retry = sized_limit < limit
+            sizer.record_truncation(stage_name, request_type, retry)
+            if retry:
+                params["max_completion_tokens"] = completion_tokens(deadline, limit)
+                response = await with_deadline(deadline, chat_completion(**params), stage_name)
+    except Exception:
+        stage.errors += 1
+        raise
+
+    latency = time.monotonic() - start
+    stage.record_latency(model, latency)
+    truncated = response.choices[0].finish_reason == "length"
+    if not truncated and response.usage is not None:
+        sizer.record(stage_name, request_type, response.usage.completion_tokens)
+    usage = response.usage
+    log_event(
+        logger, logging.INFO, "stage completed",
+        stage=stage_name, model=model, latency_ms=round(latency * 1000, 1),
+        completion_tokens=usage.completion_tokens if usage is not None else None,
+        prompt_tokens=usage.prompt_tokens if usage is not None else None,
+        estimated_prompt_tokens=estimator.record(stage_name, raw_prompt_tokens, usage.prompt_tokens) if usage is not None else None,
+        truncated=truncated,
+    )
+    # A completion cut off by the token limit is counted as a quality miss;
+    # JSON stages record their own quality once the output has been parsed
+    if params.get("response_format") is None:
+        stage.record_quality(not truncated)
+    return response
+
+async def _timed_stream(stage: StageConfig, model: str, start: float, stream, request_type=None, raw_prompt_tokens=0):
+    finish_reason = None
+    usage = None
+    content = []
+    failed = False
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                content.append(chunk.choices[0].delta.content)
+            # Groq reports the usage of a streamed completion on its final chunk
+            x_groq = getattr(chunk, "x_groq", None)
+            if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                usage = x_groq.usage
+            yield chunk
+    except Exception:
+        stage.errors += 1
+        failed = True
+        raise
+    finally:
+        # Also runs when the caller closes the stream early, e.g. once the wanted code block is complete
+        await stream.aclose()
+        _record_stream(stage, model, start, request_type, raw_prompt_tokens, finish_reason, usage, "".join(content), failed)
+
+def _record_stream(stage: StageConfig, model: str, start: float, request_type, raw_prompt_tokens: int, finish_reason, usage, content: str, failed: bool):
+    if usage is None:
+        # Closed before the final chunk: charge the tenant the estimated prompt and the text received so far
+        prompt_tokens = round(raw_prompt_tokens * estimator.scale(stage.name))
+        completion_tokens = estimator.estimate(content, stage.name)
+        record_tokens(prompt_tokens, completion_tokens)
+    if failed:
+        return
+    latency = time.monotonic() - start
+    stage.record_latency(model, latency)
+    if usage is None:
+        log_event(
+            logger, logging.INFO, "stage streamed",
+            stage=stage.name, model=model, latency_ms=round(latency * 1000, 1),
+            completion_tokens=completion_tokens, prompt_tokens=prompt_tokens, estimated=True,
+            finish_reason=finish_reason,
+        )
+    else:
+        log_event(
+            logger, logging.INFO, "stage streamed",
+            stage=stage.name, model=model, latency_ms=round(latency * 1000, 1),
+            completion_tokens=usage.completion_tokens,
+            prompt_tokens=usage.prompt_tokens,
+            estimated_prompt_tokens=estimator.record(stage.name, raw_prompt_tokens, usage.prompt_tokens),
+            finish_reason=finish_reason,
+        )
+    if finish_reason == "length":
+        sizer.record_truncation(stage.name, request_type, False)
+    elif usage is not None:
+        sizer.record(stage.name, request_type, usage.completion_tokens)
+    stage.record_quality(finish_reason != "length")
+
+async def structured_completion(stage_name: str, parse, messages: list, deadline=None, request_type=None, **params):
+    """
+    Creates a JSON-mode completion for a stage and returns parse(content).
+    `parse` repairs common slips locally and raises ValueError only when that fails; the model is then
+    asked once more to correct its output. Quality is recorded from the first answer.
+    """
+    response = await stage_completion(
+        stage_name,
+        messages=messages,
+        stream=False,  # Streaming is not supported in JSON mode
+        response_format={"type": "json_object"},
+        deadline=deadline,
+        request_type=request_type,
+        **params,
+    )
+    content = response.choices[0].message.content
+    try:
+        result = parse(content)
+    except ValueError as e:
+        record_quality(stage_name, False)
+        if deadline is not None and deadline.remaining() < MIN_STAGE_SECONDS:
+            raise
+        error = e
+    else:
+        record_quality(stage_name, True)
+        return result
+
+    record_repair(stage_name, "reasked")
+    messages = messages + [
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": f"That response could not be parsed ({error}). Reply with only the corrected JSON object."},
+    ]
+    response = await stage_completion(
+        stage_name,
+        messages=messages,
+        stream=False,
+        response_format={"type": "json_object"},
+        deadline=deadline,
+        request_type=request_type,
+        **params,
+    )
+    return parse(response.choices[0].message.content)
+
+def record_quality(stage_name: str, ok: bool):
+    """Records a stage-specific quality signal, e.g. whether its structured output parsed."""
+    registry.stage(stage_name).record_quality(ok)
@@ -0,0 +1,88 @@
+import logging
+import re
+
+from structured_log import get_logger, log_event
+from unified_diff import PatchError, make_diff, replace_block
+
+# Request types answered with edits to user_code instead of a whole new contract
+PATCH_REQUEST_TYPES = ("debugging", "copilot")
+
+EDIT_BLOCK_PATTERN = re.compile(r"<<<<<<< SEARCH[ \t]*\n(.*?)\n?=======[ \t]*\n(.*?)\n?>>>>>>> REPLACE", re.DOTALL)
+
+# Put ahead of the whole query, so trimming never cuts them off and they stay outside the copilot markers
+PATCH_INSTRUCTIONS = """Answer with minimal edits instead of the whole contract:
+- Explain the problem and the fix briefly.
+- Then give each change as an edit block, copying the lines to replace exactly from the user's code:
+<<<<<<< SEARCH
+lines to replace
+=======
+replacement lines
+>>>>>>> REPLACE
+- Keep each SEARCH part short but unique within the code, and do not repeat unchanged code.
+"""
+
+COPILOT_PATCH_INSTRUCTIONS = """- For the copilot request, use exactly one edit block. Its SEARCH part is these lines of the user's code, copied exactly
+(the request shown between the ###### markers below is not part of the code):
+{marker_block}
+- Its REPLACE part is the code that goes in their place, without the ###### markers.
+"""
+
+logger = get_logger("patch_edits")
+
+# Outcomes of patch-mode answers: applied exactly, applied with fuzzy matching, or regenerated in full
+patch_counts = {"exact": 0, "fuzzy": 0, "fallback": 0}
+
+def marker_block(user_code: str) -> str:
+    """The lines of user_code from the first ###### marker line to the second, inclusive."""
+    lines = user_code.split("\n")
+    markers = [index for index, line in enumerate(lines) if "######" in line]
+    return "\n".join(lines[markers[0]:markers[-1] + 1])
+
+def patch_instructions(request_type: str, user_code: str) -> str:
+    """The edit instructions for the request; a copilot request is told the exact marker lines to replace."""
+    if request_type == "copilot":
+        return PATCH_INSTRUCTIONS + COPILOT_PATCH_INSTRUCTIONS.format(marker_block=marker_block(user_code))
+    return PATCH_INSTRUCTIONS
+
+def parse_edits(answer: str) -> list:
+    """Returns the (search, replace) pairs of the edit blocks in the answer."""
+    return [(search, replace) for search, replace in EDIT_BLOCK_PATTERN.findall(answer)]
+
+def apply_edits(code: str, edits: list) -> tuple:
+    """
+    Applies (search, replace) edits to `code`, each located exactly or fuzzily.
+    Returns (patched code, whether any edit needed fuzzy matching). Raises PatchError.
+    """
+    if not edits:
+        raise PatchError("The answer has no edit blocks")
+    lines = code.split("\n")
+    any_fuzzy = False
+    position = 0
+    for number, (search, replace) in enumerate(edits, start=1):
+        if not search.strip():
+            raise PatchError(f"Edit {number} has an empty SEARCH part")
+        new_lines = replace.split("\n") if replace else []
+        # Edits usually come in file order, so the next match is expected after the previous one
+        start, fuzzy = replace_block(lines, search.split("\n"), new_lines, position)
+        if start == -1:
+            raise PatchError(f"Edit {number} does not match the code")
+        any_fuzzy = any_fuzzy or fuzzy
+        position = start + len(new_lines)
+    return "\n".join(lines), any_fuzzy
+
+def patch_result(request_type: str, user_code: str, answer: str) -> dict:
+    """Applies the edits of a patch-mode answer. Raises PatchError when they do not apply cleanly."""
+    patched, fuzzy = apply_edits(user_code, parse_edits(answer))
+    if request_type == "copilot" and "######" in patched:
+        raise PatchError("The edits left the copilot markers in the code")
+    patch_counts["fuzzy" if fuzzy else "exact"] += 1
+    return {
+        "agent_response": answer,
+        "edit_mode": "patch",
+        "patch": make_diff(user_code, patched),
+        "patched_code": patched,
+    }
+
+def record_fallback(request_type: str, error: PatchError):
+    patch_counts["fallback"] += 1
+    log_event(logger, logging.INFO, "patch fell back to full answer", request_type=request_type, error=str(error))
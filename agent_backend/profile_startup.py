@@ -0,0 +1,106 @@
+"""
+Profiles the cold start of a worker: import time per module, then time-to-first-request
+of a freshly started server with and without background prewarming.
+
+Usage:
+    python profile_startup.py [--top 15] [--port 8200]
+
+The request phase sends real /ai requests; point LLM_CONFIG at mock_llm.py to profile offline.
+"""
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+QUERY = {
+    "request_type": "generation",
+    "user_code": "",
+    "context": "Write a smart contract that stores user details",
+}
+
+def import_times() -> list:
+    """(module, self ms, cumulative ms, depth) for every module imported by `import main`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us) / 1000, int(cumulative_us) / 1000, len(indent) // 2))
+    return rows
+
+def report_imports(rows: list, top: int):
+    local = {name[:-3] for name in os.listdir(HERE) if name.endswith(".py")}
+    total = next(cumulative for module, _, cumulative, depth in rows if module == "main")
+    print(f"import main: {total:.1f} ms")
+
+    print(f"\n{'project module':<28} {'self (ms)':>10} {'cumulative (ms)':>16}")
+    for module, self_ms, cumulative_ms, _ in sorted(rows, key=lambda row: -row[2]):
+        if module in local:
+            print(f"{module:<28} {self_ms:>10.1f} {cumulative_ms:>16.1f}")
+
+    # Top-level packages, i.e. what each import statement actually costs
+    print(f"\n{'package':<28} {'cumulative (ms)':>16}")
+    packages = [row for row in rows if "." not in row[0] and row[0] not in local]
+    for module, _, cumulative_ms, _ in sorted(packages, key=lambda row: -row[2])[:top]:
+        print(f"{module:<28} {cumulative_ms:>16.1f}")
+
+async def first_requests(port: int, prewarm: bool) -> dict:
+    # The answer cache is off, or the first request would be a hit on the cache file of an earlier run
+    env = dict(os.environ, AGENT_PREWARM="1" if prewarm else "0", RESPONSE_CACHE_PATH="", RESPONSE_CACHE_SIZE="0")
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            while True:
+                try:
+                    await client.get(url + "/metrics/startup")
+                    break
+                except httpx.HTTPError:
+                    await asyncio.sleep(0.05)
+            ready = time.perf_counter() - start
+
+            request_start = time.perf_counter()
+            await client.post(url + "/ai", json=QUERY)
+            first = time.perf_counter() - request_start
+            request_start = time.perf_counter()
+            await client.post(url + "/ai", json=QUERY)
+            second = time.perf_counter() - request_start
+            startup = (await client.get(url + "/metrics/startup")).json()
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {"ready": ready, "first": first, "second": second, "startup": startup}
+
+async def main():
+    parser = argparse.ArgumentParser(description="Profile worker cold start")
+    parser.add_argument("--top", type=int, default=15, help="Packages listed by import cost")
+    parser.add_argument("--port", type=int, default=8200)
+    args = parser.parse_args()
+
+    report_imports(import_times(), args.top)
+
+    print(f"\n{'prewarm':<8} {'ready (s)':>10} {'1st request (s)':>16} {'2nd request (s)':>16}")
+    for prewarm in (False, True):
+        result = await first_requests(args.port, prewarm)
+        print(f"{'on' if prewarm else 'off':<8} {result['ready']:>10.3f} {result['first']:>16.3f} {result['second']:>16.3f}")
+        print(f"         marks: {result['startup']['marks']}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,166 @@
+import contextvars
+import os
+import re
+
+from model_registry import registry
+from token_estimator import estimator
+
+# Context is trimmed before code, but never below this many tokens
+CONTEXT_MIN_TOKENS = int(os.environ.get("CONTEXT_MIN_TOKENS", 256))
+TRUNCATED_MARKER = "\n[... truncated ...]"
+
+# Line numbers referenced by compiler errors, e.g. "--> src/lib.rs:12:5" or "line 12"
+ERROR_LINE_PATTERN = re.compile(r"(?:-->\s*\S+?:|\bline\s+)(\d+)")
+CODE_BLOCK_PATTERN = re.compile(r"```.*?```", re.DOTALL)
+# Lines the functioniser needs to see: the contract impl blocks and function signatures
+SIGNATURE_PATTERN = re.compile(r"#\[contractimpl\]|\bfn\s+\w+")
+
+# Stage -> number of prompts that had to be trimmed, by step
+trim_counts = {}
+
+class QueryParts:
+    """The pieces a query was built from, so an oversize query can be rebuilt from trimmed pieces."""
+    def __init__(self, request_type: str, user_code: str, context: str, query: str, render):
+        self.request_type = request_type
+        self.user_code = user_code
+        self.context = context
+        self.query = query
+        self.render = render  # render(request_type, user_code, context) -> query
+
+# Set by build_query for the request being served
+request_parts = contextvars.ContextVar("request_parts", default=None)
+
+def _count_trim(stage: str, step: str):
+    counts = trim_counts.setdefault(stage, {"examples": 0, "inputs": 0, "over_budget": 0})
+    counts[step] += 1
+
+def trim_head(text: str, tokens: int) -> str:
+    """Keeps the beginning of `text` that fits in `tokens`."""
+    total = estimator.estimate(text)
+    if total <= tokens:
+        return text
+    keep = max(0, int(len(text) * tokens / total) - len(TRUNCATED_MARKER))
+    return text[:keep] + TRUNCATED_MARKER
+
+def focus_lines(request_type: str, user_code: str, context: str) -> list:
+    """Lines of user_code the request is about: the copilot markers or lines named in the error."""
+    lines = user_code.split("\n")
+    if request_type == "copilot":
+        return [index for index, line in enumerate(lines) if "######" in line]
+    if request_type == "debugging":
+        return sorted({int(number) - 1 for number in ERROR_LINE_PATTERN.findall(context) if 0 < int(number) <= len(lines)})
+    return []
+
+def trim_code(code: str, tokens: int, focus: list) -> str:
+    """
+    Keeps the lines closest to the focus lines (the start of the code without focus) within `tokens`.
+    Focus lines are always kept; each run of dropped lines is replaced by a marker.
+    """
+    if estimator.estimate(code) <= tokens:
+        return code
+    lines = code.split("\n")
+    anchors = focus or [0]
+    order = sorted(range(len(lines)), key=lambda index: (min(abs(index - anchor) for anchor in anchors), index))
+    kept = set(focus)
+    used = sum(estimator.estimate(lines[index]) + 1 for index in kept)
+    for index in order:
+        if index in kept:
+            continue
+        cost = estimator.estimate(lines[index]) + 1
+        if used + cost > tokens:
+            break
+        kept.add(index)
+        used += cost
+
+    trimmed = []
+    omitted = 0
+    for index, line in enumerate(lines):
+        if index in kept:
+            if omitted:
+                trimmed.append(f"// ... {omitted} lines omitted ...")
+                omitted = 0
+            trimmed.append(line)
+        else:
+            omitted += 1
+    if omitted:
+        trimmed.append(f"// ... {omitted} lines omitted ...")
+    return "\n".join(trimmed)
+
+def trim_contract(code: str, tokens: int) -> str:
+    """Shortens contract code to `tokens`, keeping the function signatures and the lines around them."""
+    focus = [index for index, line in enumerate(code.split("\n")) if SIGNATURE_PATTERN.search(line)]
+    return trim_code(code, tokens, focus)
+
+def trim_query(user_query: str, tokens: int) -> str:
+    """
+    Shortens a query to `tokens`: the context is trimmed first (down to CONTEXT_MIN_TOKENS),
+    then the code outside the focus region. Queries not built by build_query keep their head.
+    """
+    parts = request_parts.get()
+    if parts is None or parts.query != user_query:
+        return trim_head(user_query, tokens)
+
+    context_tokens = estimator.estimate(parts.context)
+    code_tokens = estimator.estimate(parts.user_code)
+    overhead = max(0, estimator.estimate(parts.query) - context_tokens - code_tokens)
+    overflow = overhead + context_tokens + code_tokens - tokens
+    if overflow <= 0:
+        return user_query
+
+    floor = min(context_tokens, CONTEXT_MIN_TOKENS)
+    context = trim_head(parts.context, max(floor, context_tokens - overflow))
+    code_allowance = tokens - overhead - estimator.estimate(context)
+    focus = focus_lines(parts.request_type, parts.user_code, parts.context)
+    code = trim_code(parts.user_code, code_allowance, focus)
+    return parts.render(parts.request_type, code, context)
+
+def trim_answer(answer: str, tokens: int) -> str:
+    """Shortens an agent answer to `tokens`: prose outside code blocks goes first, then the end of the code."""
+    if estimator.estimate(answer) <= tokens:
+        return answer
+    # Keep only the first line of each prose segment between code blocks
+    pieces = []
+    position = 0
+    for match in CODE_BLOCK_PATTERN.finditer(answer):
+        prose = answer[position:match.start()].strip()
+        if prose:
+            pieces.append(prose.split("\n", 1)[0])
+        pieces.append(match.group())
+        position = match.end()
+    prose = answer[position:].strip()
+    if prose:
+        pieces.append(prose.split("\n", 1)[0])
+    return trim_head("\n\n".join(pieces), tokens)
+
+def trim_extraction(inputs: tuple, tokens: int) -> tuple:
+    """Shortens a (user query, agent answer) pair to `tokens`, trimming the query before the answer."""
+    user_query, answer = inputs
+    query_tokens = estimator.estimate(user_query)
+    query_allowance = max(tokens - estimator.estimate(answer), min(query_tokens, tokens // 2))
+    user_query = trim_query(user_query, query_allowance)
+    return user_query, trim_answer(answer, tokens - estimator.estimate(user_query))
+
+async def fit_prompt(stage: str, generate_prompt, inputs, trim=trim_query) -> str:
+    """
+    Builds the prompt for `stage` within the stage's prompt_budget.
+    Oversize prompts are trimmed deterministically: the examples are dropped first
+    (generate_prompt(inputs, examples=False)), then trim(inputs, tokens) shortens the inputs.
+    """
+    budget = registry.stage(stage).prompt_budget
+    prompt = await generate_prompt(inputs)
+    if budget is None or estimator.estimate(prompt, stage) <= budget:
+        return prompt
+
+    _count_trim(stage, "examples")
+    prompt = await generate_prompt(inputs, examples=False)
+    prompt_tokens = estimator.estimate(prompt, stage)
+    if prompt_tokens <= budget:
+        return prompt
+
+    _count_trim(stage, "inputs")
+    input_tokens = estimator.estimate(inputs if isinstance(inputs, str) else "\n".join(inputs), stage)
+    allowance = budget - (prompt_tokens - input_tokens)
+    prompt = await generate_prompt(trim(inputs, max(allowance, 0)), examples=False)
+    if estimator.estimate(prompt, stage) > budget:
+        _count_trim(stage, "over_budget")
+    return prompt
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from deadline import DeadlineExceeded
+from tenancy import record_usage, record_stream_usage
+
+# API keys are read from the environment when the first client is created
+load_dotenv()
+
+# Endpoint configuration file, see llm_config.json
+LLM_CONFIG = os.environ.get("LLM_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_config.json"))
+
+# Parameters only understood by Groq endpoints
+GROQ_ONLY_PARAMS = ["reasoning_format"]
+
+class NoHealthyEndpoint(Exception):
+    pass
+
+def should_fail_over(error: Exception) -> bool:
+    """
+    Whether another endpoint may succeed where this one failed: timeouts, connection errors,
+    rate limits and 5xx responses. Other 4xx responses (a bad request, an invalid key) would fail
+    everywhere, so they are raised as they are and do not count against the endpoint.
+    """
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    # APITimeoutError subclasses APIConnectionError in both the Groq and the OpenAI SDKs
+    if any(cls.__name__ == "APIConnectionError" for cls in type(error).__mro__):
+        return True
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError))
+
+class Endpoint:
+    """
+    One OpenAI-compatible chat completions endpoint.
+    Tracks an EWMA of latency and error rate so the pool can route to the fastest healthy endpoint.
+    """
+    def __init__(self, config: dict, alpha: float, max_error_rate: float, cooldown: float):
+        self.name = config["name"]
+        self.kind = config.get("kind", "groq")  # "groq" uses AsyncGroq, "openai" uses AsyncOpenAI
+        self.base_url = config.get("base_url")
+        self.api_key = config.get("api_key")
+        self.api_key_env = config.get("api_key_env", "GROQ_API_KEY")
+        self.model = config["model"]
+        self.model_map = config.get("model_map", {})
+        self.timeout = config.get("timeout", 60)
+        self.max_retries = config.get("max_retries", 0)
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.ewma_latency = None
+        self.ewma_error = 0.0
+        self.last_failure = 0.0
+        self.calls = 0
+        self.failures = 0
+        self._client = None
+
+    @property
+    def client(self):
+        # Clients are created on first use so unused endpoints cost nothing at startup
+        if self._client is None:
+            api_key = self.api_key or os.environ.get(self.api_key_env)
+            if self.kind == "openai":
+                from openai import AsyncOpenAI
+                self._client = AsyncOpenAI(api_key=api_key, base_url=self.base_url, timeout=self.timeout, max_retries=self.max_retries)
+            else:
+                from groq import AsyncGroq
+                self._client = AsyncGroq(api_key=api_key, base_url=self.base_url, timeout=self.timeout, max_retries=self.max_retries)
+        return self._client
+
+    def resolve_model(self, model=None) -> str:
+        if model is None:
+            return self.model
+        return self.model_map.get(model, model)
+
+    def healthy(self) -> bool:
+        if self.ewma_error < self.max_error_rate:
+            return True
+        # Let a request through after the cooldown to probe whether the endpoint recovered
+        return time.monotonic() - self.last_failure > self.cooldown
+
+    def record_success(self, latency: float):
+        self.calls += 1
+        self.ewma_error = (1 - self.alpha) * self.ewma_error
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+
+    def record_failure(self):
+        self.calls += 1
+        self.failures += 1
+        self.last_failure = time.monotonic()
+        self.ewma_error = self.alpha + (1 - self.alpha) * self.ewma_error
+
+    def prepare(self, params: dict) -> dict:
+        params = dict(params)
+        params["model"] = self.resolve_model(params.get("model"))
+        if self.kind != "groq":
+            for name in GROQ_ONLY_PARAMS:
+                params.pop(name, None)
+        return params
+
+    def metrics(self) -> dict:
+        return {
+            "kind": self.kind,
+            "model": self.model,
+            "healthy": self.healthy(),
+            "ewma_latency": self.ewma_latency,
+            "ewma_error": self.ewma_error,
+            "calls": self.calls,
+            "failures": self.failures,
+        }
+
+class ProviderPool:
+    def __init__(self, endpoints: list, error_penalty: float = 10.0):
+        self.endpoints = endpoints
+        self.error_penalty = error_penalty  # Seconds added to the latency score per unit of error rate
+
+    @classmethod
+    def from_file(cls, path: str = LLM_CONFIG):
+        with open(path) as f:
+            config = json.load(f)
+        alpha = config.get("ewma_alpha", 0.3)
+        max_error_rate = config.get("max_error_rate", 0.5)
+        cooldown = config.get("cooldown_seconds", 30)
+        endpoints = [
+            Endpoint(endpoint, alpha, max_error_rate, cooldown)
+            for endpoint in config["endpoints"]
+            if endpoint.get("enabled", True)
+        ]
+        return cls(endpoints, config.get("error_penalty_seconds", 10.0))
+
+    def ranked(self) -> list:
+        """
+        Healthy endpoints first, ordered by EWMA latency plus a penalty for recent errors.
+        Endpoints without a latency sample sort ahead so they get measured;
+        unhealthy endpoints are kept as a last resort.
+        """
+        def key(endpoint):
+            latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else 0.0
+            return (not endpoint.healthy(), latency + endpoint.ewma_error * self.error_penalty)
+        return sorted(self.endpoints, key=key)
+
+    async def create(self, **params):
+        """
+        Creates a chat completion on the fastest healthy endpoint.
+        Calls failing with a timeout, rate limit or 5xx fail over to the next endpoint. Streamed calls
+        fail over only while opening the stream, since tokens already sent to the caller cannot be replayed.
+        """
+        if not self.endpoints:
+            raise NoHealthyEndpoint("No LLM endpoints are configured")
+
+        last_error = None
+        for endpoint in self.ranked():
+            start = time.monotonic()
+            try:
+                response = await endpoint.client.chat.completions.create(**endpoint.prepare(params))
+            except (asyncio.CancelledError, DeadlineExceeded):
+                raise
+            except Exception as e:
+                if not should_fail_over(e):
+                    raise
+                endpoint.record_failure()
+                last_error = e
+                continue
+
+            endpoint.record_success(time.monotonic() - start)
+            if params.get("stream"):
+                return self._record_stream(response)
+            record_usage(response.usage)
+            return response
+
+        raise last_error
+
+    async def _record_stream(self, stream):
+        try:
+            async for chunk in stream:
+                record_stream_usage(chunk)
+                yield chunk
+        finally:
+            # Closing early (e.g. once the wanted code block is complete) releases the upstream connection
+            await stream.close()
+
+    def metrics(self) -> dict:
+        return {endpoint.name: endpoint.metrics() for endpoint in self.endpoints}
+
+pool = ProviderPool.from_file()
+
+async def chat_completion(**params):
+    """Drop-in replacement for client.chat.completions.create routed through the provider pool."""
+    return await pool.create(**params)
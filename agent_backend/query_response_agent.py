@@ -1,10 +1,11 @@
 from typing import List, Literal
 import json
+import re
 from pydantic import BaseModel
-from groq import Groq, AsyncGroq
-
-# Initialize Groq client
-groq = AsyncGroq()
+from deadline import EXTRACTION_MIN_SECONDS
+from model_registry import structured_completion
+from json_repair import parse_model
+from prompt_budget import fit_prompt, trim_extraction
 
 # Data model for the agent's response
 class Response(BaseModel):
@@ -89,13 +90,24 @@ code_requested: ["
 
 "]
 """
-async def extract_code_from_response(user_query: str, agent_response: str) -> Response:
+
+CODE_BLOCK_PATTERN = re.compile(r"```(?:rust|rs)?[ \t]*\n(.*?)```", re.DOTALL)
+
+def extract_code_locally(agent_response: str) -> Response:
     """
-    Uses the LLM to determine if code is required and extracts the relevant code snippets.
-    Returns a JSON response with the required fields.
+    Extracts the fenced Rust code blocks from the agent response without calling the LLM.
+    Used when the deadline leaves no time for the extraction call.
     """
-    # Define the prompt for the LLM
-    prompt = (
+    code_blocks = [block.strip("\n") for block in CODE_BLOCK_PATTERN.findall(agent_response)]
+    return Response(code_updation_required=bool(code_blocks), code_requested=code_blocks)
+
+async def generate_prompt(inputs, examples=True):
+    """Builds the extraction prompt for a (user query, agent response) pair."""
+    user_query, agent_response = inputs
+    # Dropped first when the prompt is over the stage's token budget
+    examples_section = f"Refer to the below examples for clarity:\n{example_queries}\n\n" if examples else ""
+
+    return (
         "You are a code extraction assistant. Your task is to analyze the user query and agent response to determine if code is required and extract the relevant code snippets.\n\n"
         "Here are the rules:\n"
         "1. If the user query involves debugging or copilot assistance, extract the code snippet that should be used to fix or complete the code. Make sure to maintain the formatting style of the original code, assume that the code snippet will be written from the leftmost position.\n"
@@ -105,8 +117,7 @@ async def extract_code_from_response(user_query: str, agent_response: str) -> Re
         "In case of debugging, copilot task, code generation and cross contracts, code generation is True.\n\n"
         "The response must be a JSON object with the following schema:\n"
         f"{json.dumps(Response.model_json_schema(), indent=2)}\n\n"
-        "Refer to the below examples for clarity:\n"
-        f"{example_queries}\n\n"
+        f"{examples_section}"
         "Now generate the response for the below query and response:\n"
         "Incorrect responses will lead to severe penalties.\n\n"
         "Here is the user query:\n"
@@ -116,30 +127,37 @@ async def extract_code_from_response(user_query: str, agent_response: str) -> Re
         "Provide your response below:"
     )
 
-    # Call the Groq API with JSON response mode
-    chat_completion = await groq.chat.completions.create(
+async def extract_code_from_response(user_query: str, agent_response: str, deadline=None, request_type=None) -> Response:
+    """
+    Uses the LLM to determine if code is required and extracts the relevant code snippets.
+    Returns a JSON response with the required fields.
+    Skips the LLM call and extracts the code blocks locally when the deadline is too close.
+    """
+    if deadline is not None and deadline.remaining() < EXTRACTION_MIN_SECONDS:
+        return extract_code_locally(agent_response)
+
+    prompt = await fit_prompt("extract_code_from_response", generate_prompt, (user_query, agent_response), trim=trim_extraction)
+
+    # Call the LLM with JSON response mode; malformed output is repaired locally before re-asking
+    return await structured_completion(
+        "extract_code_from_response",
+        lambda content: parse_model("extract_code_from_response", content, Response),
         messages=[
             {
                 "role": "user",
                 "content": prompt,
             }
         ],
-        model="deepseek-r1-distill-llama-70b",
-        temperature=0.5,  # Set temperature to 0.5 for balanced creativity and accuracy
-        stream=False,  # Streaming is not supported in JSON mode
-        response_format={"type": "json_object"},  # Enable JSON mode
-        max_completion_tokens=8192,
+        deadline=deadline,
+        request_type=request_type,
     )
 
-    # Parse the JSON response into the Response model
-    return Response.model_validate_json(chat_completion.choices[0].message.content)
-
-async def query_response_agent(user_query, agent_response):
+async def query_response_agent(user_query, agent_response, deadline=None, request_type=None):
     """
     Main function to test the agent.
     """
     # Extract the relevant code from the agent's response
-    response = await extract_code_from_response(user_query, agent_response)
+    response = await extract_code_from_response(user_query, agent_response, deadline, request_type)
     return response
     # # Print the response
     # print(f"Code Updation Required: {response.code_updation_required}")
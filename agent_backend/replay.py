@@ -0,0 +1,96 @@
+"""
+Replays a request log captured with CAPTURE_LOG against a running server, keeping the
+original inter-arrival times. Reports throughput, latency distribution and cache-hit rate.
+
+Usage:
+    python replay.py captured.jsonl [--url http://127.0.0.1:8000] [--speed 1] [--concurrency 64]
+
+--speed 1 replays in real time, --speed 10 ten times faster, --speed 0 as fast as possible.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import Counter
+
+import httpx
+
+def load_log(path: str) -> list:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["ts"])
+
+def percentile(ordered: list, fraction: float):
+    if not ordered:
+        return None
+    return ordered[math.ceil(fraction * (len(ordered) - 1))]
+
+async def send(client, url, record, semaphore, results):
+    headers = {"X-Tenant-ID": record["tenant"]} if record.get("tenant") else {}
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            response = await client.post(url + record["endpoint"], json=record["payload"], headers=headers)
+            await response.aread()
+            status = response.status_code
+            cache = response.headers.get("X-Cache")
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+            cache = None
+        results.append({"latency": time.perf_counter() - start, "status": status, "cache": cache})
+
+async def replay(records: list, url: str, speed: float, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+    tasks = []
+    first_ts = records[0]["ts"]
+    start = time.perf_counter()
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        for record in records:
+            if speed > 0:
+                # Keep the original inter-arrival times, scaled by the speed factor
+                delay = (record["ts"] - first_ts) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(client, url, record, semaphore, results)))
+        await asyncio.gather(*tasks)
+
+    return results, time.perf_counter() - start
+
+def report(results: list, elapsed: float):
+    latencies = sorted(result["latency"] for result in results)
+    statuses = Counter(str(result["status"]) for result in results)
+    cache_results = [result["cache"] for result in results if result["cache"]]
+
+    print(f"requests:   {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.2f} req/s)")
+    print(f"status:     {dict(statuses)}")
+    print(
+        "latency:    "
+        f"p50 {percentile(latencies, 0.50):.3f}s  p90 {percentile(latencies, 0.90):.3f}s  "
+        f"p99 {percentile(latencies, 0.99):.3f}s  max {latencies[-1]:.3f}s"
+    )
+    if cache_results:
+        hits = sum(1 for cache in cache_results if cache.upper() in ("HIT", "STALE"))
+        print(f"cache hits: {hits}/{len(cache_results)} ({hits / len(cache_results):.0%})")
+    else:
+        print("cache hits: n/a (server sent no X-Cache headers)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured /ai and /functioniser traffic")
+    parser.add_argument("log", help="JSONL log written by the server with CAPTURE_LOG set")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    args = parser.parse_args()
+
+    records = load_log(args.log)
+    if not records:
+        print("No requests in log")
+        return
+    results, elapsed = asyncio.run(replay(records, args.url.rstrip("/"), args.speed, args.concurrency))
+    report(results, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import heapq
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+
+from agent_registry import AGENTS, FUSED_AGENT
+from model_registry import registry
+from structured_log import get_logger, log_event
+from tenancy import scheduler
+
+# Seconds an answer is fresh, and how much longer a stale answer is still served while it is regenerated
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 24 * 3600))
+RESPONSE_CACHE_GRACE = float(os.environ.get("RESPONSE_CACHE_GRACE", 6 * 3600))
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 2000))  # Answers kept, least recently hit evicted first
+# SQLite file the answers are kept in across restarts; empty keeps them in memory only
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "stellar_response_cache.sqlite3"))
+
+# Background regeneration of stale answers: concurrent refreshes, and upstream tokens they may use per quota window
+CACHE_REFRESH_CONCURRENCY = int(os.environ.get("CACHE_REFRESH_CONCURRENCY", 1))
+CACHE_REFRESH_TOKENS = int(os.environ.get("CACHE_REFRESH_TOKENS", 50000))
+CACHE_REFRESH_INTERVAL = float(os.environ.get("CACHE_REFRESH_INTERVAL", 30))  # Seconds between sweeps for stale answers
+# Refreshes run as their own scheduler tenant, at a low weight so user requests go first
+REFRESH_TENANT = "cache-refresh"
+REFRESH_WEIGHT = 0.1
+
+# Modules holding the prompt templates, and the stages whose models shape the answer
+PROMPT_MODULES = [spec.module for spec in AGENTS.values()] + [FUSED_AGENT.module, "validate_request", "patch_edits", "code_only", "domain_guidance"]
+ANSWER_STAGES = ["determine_agent", "determine_agent_batch", "cross_contract_plan", "cross_contract_half"] + [spec.stage for spec in AGENTS.values()] + [FUSED_AGENT.stage]
+
+logger = get_logger("response_cache")
+
+scheduler.weights.setdefault(REFRESH_TENANT, REFRESH_WEIGHT)
+
+def prompt_version() -> str:
+    """Hash of the sources holding the prompt templates; read from disk, so no agent module is imported."""
+    digest = hashlib.sha256()
+    for module_name in PROMPT_MODULES:
+        spec = importlib.util.find_spec(module_name)
+        with open(spec.origin, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def answer_models() -> str:
+    return ",".join(sorted({registry.stage(name).model for name in ANSWER_STAGES if name in registry.stages}))
+
+def cache_request(request_type: str, user_code: str, context: str, best_of: int = 1, edit_mode: str = "full", response_mode: str = "full") -> dict:
+    """The /ai fields an answer depends on, which are also the query_handler arguments to regenerate it."""
+    return {
+        "request_type": request_type, "user_code": user_code, "context": context,
+        "best_of": best_of, "edit_mode": edit_mode, "response_mode": response_mode,
+    }
+
+def cacheable(result, deadline=None) -> bool:
+    """
+    Whether an answer may be shared through the cache. Answers made under a deadline may come from
+    a degraded path (the local router, a lowered token cap, a cut-short best-of), and a best-of answer
+    whose code did not compile is not worth serving again.
+    """
+    if result is None or deadline is not None:
+        return False
+    return result.get("verification", {}).get("verified", True)
+
+def request_key(request: dict) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+class CacheEntry:
+    def __init__(self, key: str, request: dict, result: dict, prompt_version: str, model: str, created_at: float = None, hits: int = 0):
+        self.key = key
+        self.request = request  # The query_handler arguments, to regenerate the answer
+        self.result = result
+        self.prompt_version = prompt_version
+        self.model = model
+        self.created_at = created_at or time.time()
+        self.hits = hits
+        self.refresh_failed_at = 0.0
+
+    def row(self) -> tuple:
+        return (self.key, json.dumps(self.request), json.dumps(self.result), self.prompt_version, self.model, self.created_at, self.hits)
+
+class ResponseCache:
+    """
+    Answers of /ai by request, tagged with the prompt version and models that produced them.
+    An answer past its TTL, or made with other prompts or models, is stale: it is still served within
+    the grace window while a background refresher regenerates it, most hit answers first, as a
+    low-weight scheduler tenant with its own concurrency and token budget.
+    """
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL, grace: float = RESPONSE_CACHE_GRACE):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.grace = grace
+        self.prompt_version = prompt_version()
+        self.model = answer_models()
+        # Answers made with other prompts or models count as stale from the moment this version started
+        self.version_started_at = time.time()
+        self._entries = OrderedDict()
+        self._db = None
+        self._queue = []  # (-hits, seq, key) of answers waiting for a refresh
+        self._queued = set()
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._refreshes = set()
+        self.handler = None
+        self.counts = {"HIT": 0, "STALE": 0, "MISS": 0}
+        self.refreshed = 0
+        self.refresh_errors = 0
+        self.expired = 0
+        self._writes = []  # (sql, rows) waiting to be written to the file
+        self._writer = None
+
+    def _connect(self) -> list:
+        # Used by one worker thread at a time: the load, then the single writer task
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, request TEXT, result TEXT, "
+            "prompt_version TEXT, model TEXT, created_at REAL, hits INTEGER)"
+        )
+        # The most hit answers are kept, and the least hit are the first evicted
+        return self._db.execute(
+            "SELECT * FROM (SELECT * FROM answers ORDER BY hits DESC LIMIT ?) ORDER BY hits", (self.max_size,)
+        ).fetchall()
+
+    async def open(self):
+        """
+        Opens the cache file and loads its answers, in the serving process and off the event loop.
+        Each server worker opens its own connection, so none is shared across a fork.
+        """
+        if not self.path or self._db is not None:
+            return
+        rows = await asyncio.to_thread(self._connect)
+        # Loaded in front of the answers already in memory, the least hit first to be evicted
+        for key, request, result, version, model, created_at, hits in reversed(rows):
+            # Answers cached in memory before the file was opened are newer
+            if key not in self._entries:
+                self._entries[key] = CacheEntry(key, json.loads(request), json.loads(result), version, model, created_at, hits)
+                self._entries.move_to_end(key, last=False)
+
+    async def close(self):
+        """Writes what is pending and closes the cache file."""
+        if self._db is None:
+            return
+        self._save_hits()
+        if self._writer is not None:
+            await self._writer
+        db, self._db = self._db, None
+        await asyncio.to_thread(db.close)
+
+    def _persist(self, sql: str, rows: list):
+        """Queues a write; a single writer task applies the queued writes in a worker thread."""
+        if self._db is None:
+            return
+        self._writes.append((sql, rows))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        while self._writes:
+            writes, self._writes = self._writes, []
+            try:
+                await asyncio.to_thread(self._apply, writes)
+            except sqlite3.Error as e:
+                log_event(logger, logging.WARNING, "cache write failed", error=str(e))
+
+    def _apply(self, writes: list):
+        for sql, rows in writes:
+            self._db.executemany(sql, rows)
+        self._db.commit()
+
+    def _write(self, entry: CacheEntry):
+        self._persist("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)", [entry.row()])
+
+    def _save_hits(self):
+        self._persist("UPDATE answers SET hits = ? WHERE key = ?", [(entry.hits, entry.key) for entry in self._entries.values()])
+
+    def _delete(self, key: str):
+        self._entries.pop(key, None)
+        self._persist("DELETE FROM answers WHERE key = ?", [(key,)])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stale_since(self, entry: CacheEntry):
+        """When the answer went stale, or None while it is fresh."""
+        expires_at = entry.created_at + self.ttl
+        if (entry.prompt_version, entry.model) != (self.prompt_version, self.model):
+            return min(expires_at, max(entry.created_at, self.version_started_at))
+        return expires_at if time.time() >= expires_at else None
+
+    def is_fresh(self, request: dict) -> bool:
+        entry = self._entries.get(request_key(request))
+        return entry is not None and self.stale_since(entry) is None
+
+    def lookup(self, request: dict) -> tuple:
+        """Returns (result, "HIT" | "STALE" | "MISS"); stale answers are queued for a refresh."""
+        key = request_key(request)
+        entry = self._entries.get(key)
+        state = "MISS"
+        if entry is not None:
+            stale_since = self.stale_since(entry)
+            if stale_since is None:
+                state = "HIT"
+            elif time.time() < stale_since + self.grace:
+                state = "STALE"
+                self.enqueue(entry)
+            else:
+                self._delete(key)
+                self.expired += 1
+        self.counts[state] += 1
+        if state == "MISS":
+            return None, state
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        return entry.result, state
+
+    def put(self, request: dict, result: dict):
+        key = request_key(request)
+        hits = self._entries[key].hits if key in self._entries else 0
+        entry = CacheEntry(key, request, result, self.prompt_version, self.model, hits=hits)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._write(entry)
+        while len(self._entries) > self.max_size:
+            self._delete(next(iter(self._entries)))
+
+    def enqueue(self, entry: CacheEntry):
+        # An answer whose refresh just failed waits for the next sweep
+        if entry.key in self._queued or time.time() - entry.refresh_failed_at < CACHE_REFRESH_INTERVAL:
+            return
+        self._queued.add(entry.key)
+        heapq.heappush(self._queue, (-entry.hits, next(self._seq), entry.key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def sweep(self):
+        """Queues every stale answer still inside the grace window and drops the expired ones."""
+        now = time.time()
+        for entry in list(self._entries.values()):
+            stale_since = self.stale_since(entry)
+            if stale_since is None:
+                continue
+            if now < stale_since + self.grace:
+                self.enqueue(entry)
+            else:
+                self._delete(entry.key)
+                self.expired += 1
+        # Hit counts are written in batches, so the refresh order survives a restart
+        self._save_hits()
+
+    def refresh_cost(self) -> float:
+        """Mean upstream tokens of one refresh so far."""
+        state = scheduler.tenant(REFRESH_TENANT)
+        return (state.prompt_tokens + state.completion_tokens) / self.refreshed if self.refreshed else 0.0
+
+    def within_budget(self) -> bool:
+        # Refreshes in flight have not recorded their usage yet, so their expected cost is reserved
+        expected = self.refresh_cost() * (len(self._refreshes) + 1)
+        return scheduler.tenant(REFRESH_TENANT).window_tokens() + expected <= CACHE_REFRESH_TOKENS
+
+    async def start(self, handler):
+        """Opens the cache file and starts the refresher; `handler` regenerates an answer like query_handler(**request)."""
+        await self.open()
+        if self._task is None:
+            self.handler = handler
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            for task in [self._task, *self._refreshes]:
+                task.cancel()
+            await asyncio.gather(self._task, *self._refreshes, return_exceptions=True)
+            self._task = None
+        await self.close()
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(CACHE_REFRESH_CONCURRENCY)
+        last_sweep = 0.0
+        while True:
+            if time.monotonic() - last_sweep >= CACHE_REFRESH_INTERVAL:
+                self.sweep()
+                last_sweep = time.monotonic()
+            if not self._queue or not self.within_budget():
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), CACHE_REFRESH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await semaphore.acquire()
+            _, _, key = heapq.heappop(self._queue)
+            self._queued.discard(key)
+            entry = self._entries.get(key)
+            if entry is None or self.stale_since(entry) is None:
+                semaphore.release()
+                continue
+            task = asyncio.create_task(self._refresh(entry))
+            self._refreshes.add(task)
+            task.add_done_callback(self._refreshes.discard)
+            task.add_done_callback(lambda _: semaphore.release())
+
+    async def _refresh(self, entry: CacheEntry):
+        start = time.monotonic()
+        try:
+            result = await scheduler.run(REFRESH_TENANT, self.handler(**entry.request))
+        except Exception as e:
+            self.refresh_errors += 1
+            entry.refresh_failed_at = time.time()
+            log_event(logger, logging.WARNING, "cache refresh failed", error=str(e) or type(e).__name__)
+            return
+        self.refreshed += 1
+        if cacheable(result) and entry.key in self._entries:
+            self.put(entry.request, result)
+        log_event(logger, logging.INFO, "cache refreshed", hits=entry.hits, seconds=round(time.monotonic() - start, 3))
+
+    def metrics(self) -> dict:
+        lookups = sum(self.counts.values())
+        return {
+            "entries": len(self._entries),
+            "persistent": self._db is not None,
+            "pending_writes": len(self._writes),
+            "prompt_version": self.prompt_version,
+            "model": self.model,
+            "lookups": dict(self.counts),
+            "hit_rate": (self.counts["HIT"] + self.counts["STALE"]) / lookups if lookups else None,
+            "expired": self.expired,
+            "refresh_queue": len(self._queue),
+            "refreshing": len(self._refreshes),
+            "refreshed": self.refreshed,
+            "refresh_errors": self.refresh_errors,
+            "refresh_window_tokens": scheduler.tenant(REFRESH_TENANT).window_tokens(),
+            "refresh_token_budget": CACHE_REFRESH_TOKENS,
+        }
+
+cache = ResponseCache()
@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import json
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed."""
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# Content codings that CompressionMiddleware appends to the ETag of a compressed response
+ETAG_ENCODINGS = ("br", "gzip")
+
+def content_etag(*parts: str) -> str:
+    """Strong ETag for a response fully determined by `parts`."""
+    digest = hashlib.sha256("\0".join(parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires; a compressed variant's tag validates the same content
+    candidates = [strip_encoding(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")]
+    return etag in candidates
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """The tag of the `encoding`-compressed variant, e.g. "abc" -> "abc-gzip"."""
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+def strip_encoding(etag: str) -> str:
+    for encoding in ETAG_ENCODINGS:
+        if etag.endswith(f'-{encoding}"'):
+            return etag[:-len(encoding) - 2] + '"'
+    return etag
+
+def choose_encoding(accept_encoding: str):
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.strip().partition("=")
+        try:
+            if name.strip() == "q" and float(value) == 0:
+                continue  # q=0 explicitly refuses the coding
+        except ValueError:
+            pass
+        accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses single-message responses of at least `minimum_size` bytes
+    with br (when brotli is installed) or gzip, and gives them an ETag of their own. Streamed
+    responses (no Content-Length, or Server-Sent Events) pass through unchanged, headers first,
+    so their chunks still reach the client as soon as they are produced.
+    """
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=list(message.get("headers", [])))
+                if message["status"] == 304 and "etag" in headers:
+                    # Revalidating the compressed variant confirms that variant's tag
+                    variant = encoded_etag(headers["etag"], encoding)
+                    if variant in request_headers.get("if-none-match", ""):
+                        headers["ETag"] = variant
+                        headers.add_vary_header("Accept-Encoding")
+                        message["headers"] = headers.raw
+                if "content-length" not in headers or headers.get("content-type", "").startswith("text/event-stream"):
+                    await send(message)
+                    return
+                # Held back until the body shows whether the response is worth compressing
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            if message.get("more_body", False) or len(body) < self.minimum_size or "content-encoding" in headers:
+                await send(start)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            # The compressed bytes differ from the identity ones, so they get a different strong tag
+            if "etag" in headers:
+                headers["ETag"] = encoded_etag(headers["etag"], encoding)
+            start["headers"] = headers.raw
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
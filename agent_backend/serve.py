@@ -0,0 +1,93 @@
+"""
+Production launcher for the API.
+
+Runs several worker processes with the uvloop event loop and the httptools HTTP parser when
+they are installed, tuned keep-alive and listen backlog, and a graceful shutdown that lets
+in-flight LLM calls finish. With gunicorn installed the app is imported once and the workers
+are forked from it (preload), otherwise uvicorn's own process manager is used.
+
+Usage:
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers N]
+
+`python main.py` remains the development mode (single process, auto-reload).
+"""
+import argparse
+import importlib.util
+import os
+
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
+# Requests mostly wait on LLM calls, so one worker per core covers the CPU-bound work (JSON, compression)
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1))
+# Longer than the usual 60 s idle timeout of load balancers, so they close idle connections first
+KEEP_ALIVE_SECONDS = int(os.environ.get("KEEP_ALIVE_SECONDS", 75))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", 2048))
+# Seconds in-flight requests get to finish after a shutdown signal
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", 60))
+
+def has_module(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+def run_gunicorn(host: str, port: int, workers: int):
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    # The uvicorn worker picks uvloop and httptools automatically when they are installed
+    worker_class = "uvicorn_worker.UvicornWorker" if has_module("uvicorn_worker") else "uvicorn.workers.UvicornWorker"
+    PreloadedApplication({
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": worker_class,
+        "preload_app": True,
+        "keepalive": KEEP_ALIVE_SECONDS,
+        "backlog": SERVER_BACKLOG,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        # Streamed answers can stay open for minutes; the event loop heartbeat still detects hung workers
+        "timeout": GRACEFUL_TIMEOUT * 2,
+        "accesslog": None,
+    }).run()
+
+def run_uvicorn(host: str, port: int, workers: int):
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop="uvloop" if has_module("uvloop") else "asyncio",
+        http="httptools" if has_module("httptools") else "h11",
+        timeout_keep_alive=KEEP_ALIVE_SECONDS,
+        backlog=SERVER_BACKLOG,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        # Requests are already logged as JSON with their request id
+        access_log=False,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with production settings")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--no-gunicorn", action="store_true", help="Use uvicorn's process manager even if gunicorn is installed")
+    args = parser.parse_args()
+
+    if has_module("gunicorn") and not args.no_gunicorn:
+        run_gunicorn(args.host, args.port, args.workers)
+    else:
+        run_uvicorn(args.host, args.port, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from model_registry import stage_completion
+from prompt_budget import trim_answer, trim_head
+from structured_log import get_logger, log_event
+from tenancy import scheduler
+from token_estimator import estimator
+from unified_diff import apply_diff
+
+# Store limits: sessions idle for longer expire, and the least recently used are evicted first
+SESSION_IDLE_SECONDS = float(os.environ.get("SESSION_IDLE_SECONDS", 1800))
+SESSION_MAX_COUNT = int(os.environ.get("SESSION_MAX_COUNT", 1000))
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", 64 * 1024 * 1024))  # Across all sessions
+SESSION_MAX_CODE_BYTES = int(os.environ.get("SESSION_MAX_CODE_BYTES", 256 * 1024))  # Per session
+
+# Turns kept verbatim; older turns are folded into the rolling summary
+SESSION_RECENT_TURNS = int(os.environ.get("SESSION_RECENT_TURNS", 4))
+# Prompt tokens for the summary plus the recent turns, and the cap for the summary alone
+SESSION_HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", 1500))
+SESSION_SUMMARY_TOKENS = int(os.environ.get("SESSION_SUMMARY_TOKENS", 400))
+
+logger = get_logger("sessions")
+
+class SessionNotFound(Exception):
+    pass
+
+class SessionTooLarge(Exception):
+    pass
+
+def check_code_size(code: str):
+    if len(code.encode()) > SESSION_MAX_CODE_BYTES:
+        raise SessionTooLarge(f"Session code is over {SESSION_MAX_CODE_BYTES} bytes")
+
+class Turn:
+    def __init__(self, request_type: str, instruction: str, response: str):
+        self.request_type = request_type
+        self.instruction = instruction
+        self.response = response
+        self.at = time.time()
+
+    def render(self, response_tokens: int) -> str:
+        return f"[{self.request_type}] User: {self.instruction}\nAssistant: {trim_answer(self.response, response_tokens)}"
+
+    def size(self) -> int:
+        return len(self.instruction) + len(self.response)
+
+class Session:
+    """
+    One user's conversation: the latest version of their code, the recent turns verbatim,
+    and a rolling summary of everything older.
+    """
+    def __init__(self, tenant: str, code: str = ""):
+        self.id = uuid.uuid4().hex
+        self.tenant = tenant
+        self.code = code
+        self.code_version = 1
+        self.summary = ""
+        self.turns = deque()
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.lock = asyncio.Lock()  # Turns of a session run one at a time
+
+    def size(self) -> int:
+        return len(self.code) + len(self.summary) + sum(turn.size() for turn in self.turns)
+
+    def update_code(self, user_code=None, code_diff=None):
+        """Replaces the code, or applies a unified diff to it. Raises PatchError when the diff does not apply."""
+        if user_code is not None:
+            code = user_code
+        elif code_diff:
+            code = apply_diff(self.code, code_diff)
+        else:
+            return
+        check_code_size(code)
+        if code != self.code:
+            self.code = code
+            self.code_version += 1
+
+    def history(self, tokens: int = SESSION_HISTORY_TOKENS) -> str:
+        """The summary and as many recent turns as fit in `tokens`, newest turns first to be kept."""
+        parts = []
+        remaining = tokens
+        if self.summary:
+            summary = trim_head(self.summary, min(SESSION_SUMMARY_TOKENS, remaining))
+            parts.append(f"Summary of earlier turns:\n{summary}")
+            remaining -= estimator.estimate(parts[0])
+        recent = []
+        for turn in reversed(self.turns):
+            # Each turn gets at most half of what is left, so older turns still show up in brief
+            text = turn.render(max(64, remaining // 2))
+            cost = estimator.estimate(text)
+            if cost > remaining:
+                break
+            recent.append(text)
+            remaining -= cost
+        if recent:
+            parts.append("Recent turns:\n" + "\n\n".join(reversed(recent)))
+        return "\n\n".join(parts)
+
+    def context(self, instruction: str) -> str:
+        history = self.history()
+        if not history:
+            return instruction
+        return f"Conversation so far:\n{history}\n\nCurrent request: {instruction}"
+
+    def add_turn(self, turn: Turn) -> list:
+        """Records a turn and returns the turns that fell out of the recent window."""
+        self.turns.append(turn)
+        folded = []
+        while len(self.turns) > SESSION_RECENT_TURNS:
+            folded.append(self.turns.popleft())
+        return folded
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.id,
+            "code_version": self.code_version,
+            "turns": len(self.turns),
+            "summary": self.summary,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+        }
+
+class SessionStore:
+    """
+    Bounded in-memory session store. Sessions expire after `idle` seconds without a turn,
+    and the least recently used are evicted when over `max_count` sessions or `max_bytes` in total.
+    """
+    def __init__(self, max_count: int = SESSION_MAX_COUNT, max_bytes: int = SESSION_MAX_BYTES, idle: float = SESSION_IDLE_SECONDS):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.idle = idle
+        self._sessions = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def bytes(self) -> int:
+        return sum(session.size() for session in self._sessions.values())
+
+    def purge(self):
+        cutoff = time.time() - self.idle
+        for session_id in [session_id for session_id, session in self._sessions.items() if session.last_used < cutoff]:
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def enforce_limits(self):
+        self.purge()
+        while self._sessions and (len(self._sessions) > self.max_count or self.bytes() > self.max_bytes):
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def create(self, tenant: str, code: str = "") -> Session:
+        check_code_size(code)
+        session = Session(tenant, code)
+        self._sessions[session.id] = session
+        self.enforce_limits()
+        return session
+
+    def get(self, session_id: str, tenant: str) -> Session:
+        """Raises SessionNotFound for unknown, expired or other tenants' sessions."""
+        session = self._sessions.get(session_id)
+        if session is not None and session.last_used < time.time() - self.idle:
+            del self._sessions[session_id]
+            self.expired += 1
+            session = None
+        if session is None or session.tenant != tenant:
+            raise SessionNotFound("Session not found or expired")
+        session.last_used = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id: str, tenant: str):
+        self.get(session_id, tenant)
+        del self._sessions[session_id]
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self.bytes(),
+            "max_count": self.max_count,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+def summarize_locally(summary: str, turns: list) -> str:
+    """Appends one line per turn and drops the oldest lines beyond SESSION_SUMMARY_TOKENS."""
+    lines = summary.split("\n") if summary else []
+    for turn in turns:
+        answer = trim_answer(turn.response, 0).split("\n", 1)[0]
+        lines.append(f"- [{turn.request_type}] {turn.instruction.strip()[:200]} -> {answer[:200]}")
+    while len(lines) > 1 and estimator.estimate("\n".join(lines)) > SESSION_SUMMARY_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+async def summarize(summary: str, turns: list) -> str:
+    """Folds `turns` into the running summary with the summarize_session stage."""
+    transcript = "\n\n".join(turn.render(SESSION_SUMMARY_TOKENS) for turn in turns)
+    prompt = (
+        "You maintain the running summary of a Soroban smart contract coding session.\n"
+        "Update the summary with the new turns below. Keep the user's goals, constraints, decisions, "
+        "what was tried and failed, and the current state of the contract. Leave out code, greetings and filler.\n"
+        f"Answer with the updated summary only, in at most {SESSION_SUMMARY_TOKENS // 2} words.\n\n"
+        f"Current summary:\n{summary or '(empty)'}\n\n"
+        f"New turns:\n{transcript}"
+    )
+    response = await stage_completion(
+        "summarize_session",
+        messages=[{"role": "user", "content": prompt}],
+        stream=False,
+    )
+    return response.choices[0].message.content.strip()
+
+async def compact(session: Session, turns: list):
+    """Folds turns that left the recent window into the summary, locally if the summarizer fails."""
+    async with session.lock:
+        try:
+            # Counted against the session's tenant like any other completion
+            session.summary = await scheduler.run(session.tenant, summarize(session.summary, turns))
+        except Exception as e:
+            log_event(logger, logging.WARNING, "session summary fell back to local", session_id=session.id, error=str(e))
+            session.summary = summarize_locally(session.summary, turns)
+
+# Compactions in flight, so they are not garbage collected before finishing
+_compactions = set()
+
+async def run_turn(session: Session, handler, request_type: str, instruction: str, deadline=None, user_code=None, code_diff=None):
+    """
+    Runs one turn: updates the session code, answers with `handler` on a prompt made of the
+    history and the new instruction, then records the turn. Older turns are summarized in the background.
+    `handler` is awaited as handler(request_type, code, context, deadline) like query_handler.
+    """
+    # A summary of this session may be waiting for a scheduler slot while holding the lock,
+    # so waiting for the lock must not hold a slot
+    locked = False
+    try:
+        async with scheduler.yielded(deadline):
+            await session.lock.acquire()
+            locked = True
+        session.update_code(user_code, code_diff)
+        result = await handler(request_type, session.code, session.context(instruction), deadline)
+        if result is None:
+            return None
+        folded = session.add_turn(Turn(request_type, instruction, result["agent_response"]))
+    finally:
+        if locked:
+            session.lock.release()
+    store.enforce_limits()
+
+    if folded:
+        task = asyncio.create_task(compact(session, folded))
+        _compactions.add(task)
+        task.add_done_callback(_compactions.discard)
+    return {**result, "session_id": session.id, "code_version": session.code_version}
+
+store = SessionStore()
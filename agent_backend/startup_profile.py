@@ -0,0 +1,56 @@
+import os
+import time
+
+def process_start_time():
+    """Wall-clock start of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name; the start time is field 22 of the full line
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StartupProfile:
+    """
+    Records how long a worker takes to import the app, finish startup, prewarm and serve its
+    first request. Times are seconds since the process started (or since this module was imported).
+    """
+    def __init__(self):
+        self.imported_at = time.time()
+        self.process_started_at = process_start_time() or self.imported_at
+        self.marks = {}
+        self.first_request_seconds = None
+
+    def mark(self, name: str):
+        self.marks[name] = round(time.time() - self.process_started_at, 4)
+
+    def metrics(self, load_times: dict) -> dict:
+        return {
+            "process_started_at": self.process_started_at,
+            "marks": self.marks,
+            "first_request_seconds": self.first_request_seconds,
+            "module_load_seconds": {name: round(seconds, 4) for name, seconds in load_times.items()},
+        }
+
+profile = StartupProfile()
+
+class FirstRequestMiddleware:
+    """Marks when the first HTTP request of the process has been answered, then gets out of the way."""
+    def __init__(self, app):
+        self.app = app
+        self.seen = False
+
+    async def __call__(self, scope, receive, send):
+        if self.seen or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.seen = True
+        start = time.time()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.first_request_seconds = round(time.time() - start, 4)
+            profile.mark("first_request_done")
@@ -1,12 +1,7 @@
-from groq import Groq, AsyncGroq
-import os
+from model_registry import stage_completion
+from prompt_budget import fit_prompt
 
-# Initialize Groq client
-client = AsyncGroq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
-
-async def generate_prompt(user_query):
+async def generate_prompt(user_query, examples=True):
     """
     Generates a prompt for the Groq model based on the user's query.
     Includes a sample code reference, Rust data structures, functions, and examples.
@@ -141,6 +136,12 @@ async def generate_prompt(user_query):
     ```
     """
 
+    # Dropped first when the prompt is over the stage's token budget
+    examples_section = (
+        "Here are some key Rust data structures, functions, and examples to guide your responses:\n"
+        f"{rust_examples}\n\n"
+    ) if examples else ""
+
     prompt = (
         "You are an expert in Rust and smart contract development using the Stellar blockchain and Soroban SDK. "
         "Your task is to assist the user in one of the following ways:\n"
@@ -169,8 +170,7 @@ async def generate_prompt(user_query):
         "3. **Assistance**:\n"
         "   - Provide detailed explanations of functions, macros, or concepts, including their purpose, usage, and interaction with the Stellar blockchain.\n"
         "   - Include examples and best practices (e.g., TTL management, logging).\n\n"
-        "Here are some key Rust data structures, functions, and examples to guide your responses:\n"
-        f"{rust_examples}\n\n"
+        f"{examples_section}"
         "For each case, follow this output format:\n"
         "- First, explain what the user is asking for (debugging, generating code, or assistance).\n"
         "- Then, cite the important points (e.g., what is wrong in debugging, what the generated code does, or what the property/function does).\n"
@@ -181,27 +181,27 @@ async def generate_prompt(user_query):
     )
     return prompt
 
-async def storage_agent(user_query):
+async def storage_agent(user_query, deadline=None, request_type=None):
     """
     Main function to handle user input and interact with the Groq API.
     """
     # Generate the prompt
-    prompt = await generate_prompt(user_query)
+    prompt = await fit_prompt("storage_agent", generate_prompt, user_query)
 
-    # Call the Groq API
-    chat_completion = await client.chat.completions.create(
-        model="deepseek-r1-distill-llama-70b",
+    # Call the LLM with the model and limits configured for this stage
+    response = await stage_completion(
+        "storage_agent",
         messages=[
             {
                 "role": "user",
                 "content": prompt
             }
         ],
-        temperature=0.6,  # Optimal temperature for reasoning tasks
-        max_completion_tokens=2048,  # Adjust based on complexity
         top_p=0.95,
         stream=False,  # Enable streaming for incremental output
-        reasoning_format="hidden"
+        reasoning_format="hidden",
+        deadline=deadline,
+        request_type=request_type,
     )
 
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+    return response.choices[0].message.content
\ No newline at end of file
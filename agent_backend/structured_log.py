@@ -0,0 +1,154 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Payloads longer than this are logged as a truncated preview unless sampled
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 500))
+# Fraction of large payloads logged in full
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", 0.01))
+
+# Id of the request being served, attached to every log record it produces
+request_id = contextvars.ContextVar("request_id", default=None)
+
+class RequestIdFilter(logging.Filter):
+    # Runs in the logging thread of the caller, so the request's context is still visible
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+_listener = None
+
+def configure_logging():
+    """
+    Routes the 'stellar_orbit' loggers through a queue drained by a background thread,
+    so writing log lines never blocks the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger("stellar_orbit")
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    root.propagate = False
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+def _restart_after_fork():
+    # The listener thread does not survive a fork (e.g. a preloaded app forking its workers),
+    # so each child replaces the inherited queue with its own
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger("stellar_orbit")
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    _listener = None
+    configure_logging()
+
+atexit.register(_stop_listener)
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+def get_logger(name: str) -> logging.Logger:
+    configure_logging()
+    return logging.getLogger(f"stellar_orbit.{name}")
+
+def log_event(logger: logging.Logger, level: int, msg: str, **fields):
+    """Logs `msg` with structured fields."""
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, extra={"fields": fields})
+
+def log_payload(logger: logging.Logger, level: int, msg: str, payload, **fields):
+    """
+    Logs a potentially large payload. Payloads over LOG_PAYLOAD_MAX_CHARS are cut to a preview
+    and only a sampled fraction is logged in full.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    text = payload if isinstance(payload, str) else json.dumps(payload, default=str)
+    fields["payload_chars"] = len(text)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        text = text[:LOG_PAYLOAD_MAX_CHARS]
+        fields["payload_truncated"] = True
+    fields["payload"] = text
+    logger.log(level, msg, extra={"fields": fields})
+
+class Timer:
+    """Measures elapsed milliseconds for log fields."""
+    def __init__(self):
+        self.start = time.monotonic()
+
+    def ms(self) -> float:
+        return round((time.monotonic() - self.start) * 1000, 1)
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware that assigns each request an id (from X-Request-ID or a new one),
+    exposes it to the loggers, echoes it in the response, and logs the request duration.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.logger = get_logger("http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        current_id = headers.get(b"x-request-id", b"").decode() or uuid.uuid4().hex
+        token = request_id.set(current_id)
+        timer = Timer()
+        status = None
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", current_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            log_event(
+                self.logger, logging.INFO, "request",
+                method=scope["method"], path=scope["path"], status=status, duration_ms=timer.ms(),
+            )
+            request_id.reset(token)
@@ -0,0 +1,285 @@
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import statistics
+import time
+from collections import deque
+
+from deadline import DeadlineExceeded
+
+# Maximum number of requests served concurrently across all tenants
+SCHEDULER_CONCURRENCY = int(os.environ.get("SCHEDULER_CONCURRENCY", 8))
+# Upstream tokens (prompt + completion) each tenant may consume per window
+TENANT_TOKEN_QUOTA = int(os.environ.get("TENANT_TOKEN_QUOTA", 200000))
+TENANT_QUOTA_WINDOW = float(os.environ.get("TENANT_QUOTA_WINDOW", 3600))  # Seconds
+# "reject" answers over-quota tenants with 429, "deprioritize" serves them at a reduced weight
+TENANT_QUOTA_POLICY = os.environ.get("TENANT_QUOTA_POLICY", "reject")
+DEPRIORITIZED_WEIGHT_FACTOR = 0.1
+# Per-tenant weights, e.g. "team-a=3,team-b=1"; unlisted tenants get weight 1
+TENANT_WEIGHTS = os.environ.get("TENANT_WEIGHTS", "")
+
+ANONYMOUS_TENANT = "anonymous"
+
+# Tenant of the request being served, read when upstream usage is recorded
+current_tenant = contextvars.ContextVar("current_tenant", default=None)
+# Scheduler slot of the request being served, which yielded() gives up and takes back
+current_slot = contextvars.ContextVar("current_slot", default=None)
+
+class QuotaExceeded(Exception):
+    pass
+
+def parse_weights(spec: str) -> dict:
+    weights = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, weight = item.split("=", 1)
+            weights[name.strip()] = float(weight)
+    return weights
+
+def tenant_id_from_headers(api_key=None, tenant_id=None) -> str:
+    """
+    Identifies the tenant from the X-Tenant-ID header, or from the X-API-Key header.
+    API keys are hashed so they never show up in metrics.
+    """
+    if tenant_id:
+        return tenant_id
+    if api_key:
+        return "key-" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return ANONYMOUS_TENANT
+
+class TenantState:
+    def __init__(self, name: str, weight: float = 1.0):
+        self.name = name
+        self.weight = weight
+        self.last_finish = 0.0  # Virtual finish time of the tenant's last queued request
+        self.usage = deque()  # (timestamp, tokens) within the quota window
+        self.requests = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = deque(maxlen=1000)
+        self.queue_waits = deque(maxlen=1000)
+
+    def window_tokens(self) -> int:
+        cutoff = time.time() - TENANT_QUOTA_WINDOW
+        while self.usage and self.usage[0][0] < cutoff:
+            self.usage.popleft()
+        return sum(tokens for _, tokens in self.usage)
+
+    def over_quota(self) -> bool:
+        return self.window_tokens() >= TENANT_TOKEN_QUOTA
+
+    def effective_weight(self) -> float:
+        if TENANT_QUOTA_POLICY == "deprioritize" and self.over_quota():
+            return self.weight * DEPRIORITIZED_WEIGHT_FACTOR
+        return self.weight
+
+    def record_usage(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.usage.append((time.time(), prompt_tokens + completion_tokens))
+
+    def metrics(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "weight": self.weight,
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "window_tokens": self.window_tokens(),
+            "quota": TENANT_TOKEN_QUOTA,
+            "p50_latency": statistics.median(latencies) if latencies else None,
+            "p95_latency": latencies[math.ceil(0.95 * (len(latencies) - 1))] if latencies else None,
+            "mean_queue_wait": statistics.mean(self.queue_waits) if self.queue_waits else None,
+        }
+
+class Slot:
+    def __init__(self, state: TenantState):
+        self.state = state
+        self.held = True
+
+class FairScheduler:
+    """
+    Weighted fair queuing across tenants.
+    Each request gets a virtual finish time of max(virtual time, tenant's last finish) + cost / weight,
+    and free slots are handed to the waiting request with the smallest finish time.
+    """
+    def __init__(self, concurrency: int = SCHEDULER_CONCURRENCY, weights: dict = None):
+        self.concurrency = concurrency
+        self.weights = weights if weights is not None else parse_weights(TENANT_WEIGHTS)
+        self.active = 0
+        self.virtual_time = 0.0
+        self.tenants = {}
+        self._heap = []
+        self._seq = itertools.count()
+
+    def tenant(self, name: str) -> TenantState:
+        if name not in self.tenants:
+            self.tenants[name] = TenantState(name, self.weights.get(name, 1.0))
+        return self.tenants[name]
+
+    def _finish_tag(self, state: TenantState, cost: float) -> float:
+        start = max(self.virtual_time, state.last_finish)
+        state.last_finish = start + cost / state.effective_weight()
+        return state.last_finish
+
+    async def acquire(self, state: TenantState, cost: float = 1.0):
+        tag = self._finish_tag(state, cost)
+        if self.active < self.concurrency and not self._heap:
+            self.active += 1
+            self.virtual_time = max(self.virtual_time, tag)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, next(self._seq), waiter))
+        state.queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A slot granted right before cancellation must be handed back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            state.queued -= 1
+
+    def release(self):
+        self.active -= 1
+        while self.active < self.concurrency and self._heap:
+            tag, _, waiter = heapq.heappop(self._heap)
+            if waiter.done():
+                continue  # The waiter gave up (cancelled or timed out)
+            self.virtual_time = max(self.virtual_time, tag)
+            self.active += 1
+            waiter.set_result(None)
+
+    def admit(self, tenant_name: str) -> TenantState:
+        """Raises QuotaExceeded when the tenant is over quota and the policy is "reject"."""
+        state = self.tenant(tenant_name)
+        if TENANT_QUOTA_POLICY == "reject" and state.over_quota():
+            state.rejected += 1
+            raise QuotaExceeded(f"Tenant '{tenant_name}' exceeded its quota of {TENANT_TOKEN_QUOTA} tokens per {TENANT_QUOTA_WINDOW:.0f}s")
+        return state
+
+    async def _acquire_before(self, state: TenantState, deadline=None, cost: float = 1.0):
+        if deadline is None:
+            await self.acquire(state, cost)
+            return
+        try:
+            await asyncio.wait_for(self.acquire(state, cost), deadline.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Deadline of {deadline.budget:.2f}s exceeded while queued")
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tenant_name: str, deadline=None, cost: float = 1.0):
+        """Holds a scheduler slot for the tenant, waiting in fair order and at most until the deadline."""
+        state = self.admit(tenant_name)
+        state.requests += 1
+        queued_at = time.monotonic()
+        await self._acquire_before(state, deadline, cost)
+        state.queue_waits.append(time.monotonic() - queued_at)
+
+        state.in_flight += 1
+        slot = Slot(state)
+        token = current_tenant.set(state)
+        slot_token = current_slot.set(slot)
+        try:
+            yield state
+        finally:
+            current_slot.reset(slot_token)
+            current_tenant.reset(token)
+            state.in_flight -= 1
+            state.latencies.append(time.monotonic() - queued_at)
+            # A request cancelled inside yielded() no longer holds its slot
+            if slot.held:
+                self.release()
+
+    @contextlib.asynccontextmanager
+    async def yielded(self, deadline=None):
+        """
+        Gives up the current request's slot while it waits on another limited resource,
+        and takes a slot again in fair order, at most until the deadline, once the wait succeeded.
+        """
+        slot = current_slot.get()
+        if slot is None or not slot.held:
+            yield
+            return
+        self.release()
+        slot.held = False
+        # A failed wait does not queue again for a slot it would give back at once; slot() then has nothing to release
+        yield
+        await self._acquire_before(slot.state, deadline)
+        slot.held = True
+
+    async def run(self, tenant_name: str, awaitable, deadline=None, cost: float = 1.0):
+        """
+        Runs `awaitable` for the tenant once the scheduler grants it a slot.
+        Raises QuotaExceeded when the tenant is over quota and the policy is "reject".
+        """
+        try:
+            async with self.slot(tenant_name, deadline, cost):
+                return await awaitable
+        finally:
+            # Never leave the coroutine un-awaited when admission or queueing failed
+            awaitable.close()
+
+    def metrics(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": sum(1 for _, _, waiter in self._heap if not waiter.done()),
+            "concurrency": self.concurrency,
+            "tenants": {name: state.metrics() for name, state in self.tenants.items()},
+        }
+
+class SharedUsage:
+    """
+    Stands in for the current tenant while one completion serves several tenants' requests,
+    so its usage can then be split between them.
+    """
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record_usage(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def split(self, states: list):
+        """Records an even share of the usage on each request's tenant state (None for requests without one)."""
+        count = len(states)
+        for index, state in enumerate(states):
+            if state is None:
+                continue
+            # The first requests take the remainders, so the shares add up to the whole usage
+            prompt_share = self.prompt_tokens // count + (index < self.prompt_tokens % count)
+            completion_share = self.completion_tokens // count + (index < self.completion_tokens % count)
+            state.record_usage(prompt_share, completion_share)
+
+def record_usage(usage):
+    """Adds the upstream token usage of a completion to the current tenant."""
+    if usage is not None:
+        record_tokens(usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+def record_tokens(prompt_tokens: int, completion_tokens: int):
+    """Adds token counts to the current tenant, for completions whose upstream usage never arrived."""
+    state = current_tenant.get()
+    if state is not None:
+        state.record_usage(prompt_tokens, completion_tokens)
+
+def record_stream_usage(chunk):
+    """Groq reports the usage of a streamed completion on its final chunk."""
+    x_groq = getattr(chunk, "x_groq", None)
+    if x_groq is not None:
+        record_usage(getattr(x_groq, "usage", None))
+
+scheduler = FairScheduler()
@@ -0,0 +1,62 @@
+import os
+import re
+
+# Rough BPE pieces: short letter runs, digit groups and single punctuation marks
+TOKEN_PATTERN = re.compile(r"[A-Za-z]{1,8}|\d{1,3}|[^\sA-Za-z\d]")
+# Weight of each new observation in the per-stage calibration
+TOKEN_CALIBRATION_ALPHA = float(os.environ.get("TOKEN_CALIBRATION_ALPHA", 0.2))
+# Tokens the chat template adds per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def raw_count(text: str) -> int:
+    return len(TOKEN_PATTERN.findall(text))
+
+class TokenEstimator:
+    """
+    Estimates prompt tokens locally from a regex piece count, scaled per stage by the ratio of the
+    upstream usage.prompt_tokens to the raw count (an EWMA), so estimates track the real tokenizer.
+    """
+    def __init__(self, alpha: float = TOKEN_CALIBRATION_ALPHA):
+        self.alpha = alpha
+        self.scales = {}
+        self.samples = {}
+        self.abs_error = {}  # stage -> EWMA of |estimate - actual| / actual
+
+    def scale(self, stage=None) -> float:
+        if stage in self.scales:
+            return self.scales[stage]
+        # Stages without samples use the average calibration of the others
+        return sum(self.scales.values()) / len(self.scales) if self.scales else 1.0
+
+    def estimate(self, text: str, stage=None) -> int:
+        return round(raw_count(text) * self.scale(stage))
+
+    def messages_raw_count(self, messages: list) -> int:
+        return sum(raw_count(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def record(self, stage: str, raw: int, actual: int):
+        """
+        Compares the estimate for a sent prompt with the upstream count and recalibrates the stage.
+        Returns the estimate made before recalibrating.
+        """
+        if not raw or not actual:
+            return None
+        estimated = round(raw * self.scale(stage))
+        error = abs(estimated - actual) / actual
+        ratio = actual / raw
+        if stage in self.scales:
+            self.scales[stage] = self.alpha * ratio + (1 - self.alpha) * self.scales[stage]
+            self.abs_error[stage] = self.alpha * error + (1 - self.alpha) * self.abs_error[stage]
+        else:
+            self.scales[stage] = ratio
+            self.abs_error[stage] = error
+        self.samples[stage] = self.samples.get(stage, 0) + 1
+        return estimated
+
+    def metrics(self) -> dict:
+        return {
+            stage: {"scale": self.scales[stage], "samples": self.samples[stage], "ewma_abs_error": self.abs_error[stage]}
+            for stage in self.scales
+        }
+
+estimator = TokenEstimator()
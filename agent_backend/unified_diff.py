@@ -0,0 +1,125 @@
+import difflib
+import os
+import re
+
+# Lowest similarity at which a block that does not match exactly is still patched
+PATCH_FUZZ_RATIO = float(os.environ.get("PATCH_FUZZ_RATIO", 0.85))
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+class PatchError(ValueError):
+    pass
+
+class Hunk:
+    def __init__(self, old_start: int):
+        self.old_start = old_start  # 1-based line of the first old line
+        self.old_lines = []  # Context and removed lines
+        self.new_lines = []  # Context and added lines
+
+def parse_hunks(diff: str) -> list:
+    """Parses the hunks of a unified diff. File headers (---/+++) and other lines outside hunks are ignored."""
+    hunks = []
+    hunk = None
+    if diff.endswith("\n"):
+        diff = diff[:-1]
+    for line in diff.split("\n"):
+        match = HUNK_HEADER.match(line)
+        if match:
+            hunk = Hunk(int(match.group(1)))
+            hunks.append(hunk)
+        elif hunk is None or line.startswith("\\"):
+            continue  # Headers, or "\ No newline at end of file"
+        elif line.startswith("-") and not line.startswith("---"):
+            hunk.old_lines.append(line[1:])
+        elif line.startswith("+") and not line.startswith("+++"):
+            hunk.new_lines.append(line[1:])
+        elif line.startswith(" ") or line == "":
+            hunk.old_lines.append(line[1:])
+            hunk.new_lines.append(line[1:])
+        else:
+            hunk = None  # Anything else ends the hunk
+    if not hunks:
+        raise PatchError("Diff has no hunks")
+    return hunks
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip(" \t"))
+
+def _nearest(starts: list, expected: int) -> int:
+    return min(starts, key=lambda start: abs(start - expected)) if starts else -1
+
+def find_block(lines: list, block: list, expected: int, fuzz: float = PATCH_FUZZ_RATIO) -> tuple:
+    """
+    Returns (start, fuzzy) for the occurrence of `block` in `lines` closest to `expected`, or (-1, False).
+    An exact match is preferred, then a match ignoring indentation and trailing whitespace,
+    then the most similar window of the same length if its similarity is at least `fuzz`.
+    """
+    if not block:
+        return min(max(expected, 0), len(lines)), False
+    size = len(block)
+    windows = range(len(lines) - size + 1)
+    start = _nearest([start for start in windows if lines[start:start + size] == block], expected)
+    if start != -1:
+        return start, False
+
+    stripped = [line.strip() for line in lines]
+    target = [line.strip() for line in block]
+    start = _nearest([start for start in windows if stripped[start:start + size] == target], expected)
+    if start != -1:
+        return start, True
+
+    best, best_ratio = -1, fuzz
+    matcher = difflib.SequenceMatcher(None, b="\n".join(target), autojunk=False)
+    for start in windows:
+        matcher.set_seq1("\n".join(stripped[start:start + size]))
+        if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+            continue
+        ratio = matcher.ratio()
+        if ratio < best_ratio:
+            continue
+        if best == -1 or ratio > best_ratio or abs(start - expected) < abs(best - expected):
+            best, best_ratio = start, ratio
+    return best, best != -1
+
+def reindent(new_lines: list, old_block: list, matched: list) -> list:
+    """Shifts replacement lines by the indentation difference between the expected and the matched code."""
+    old_first = next((line for line in old_block if line.strip()), None)
+    matched_first = next((line for line in matched if line.strip()), None)
+    if old_first is None or matched_first is None:
+        return new_lines
+    shift = _indent(matched_first) - _indent(old_first)
+    if shift > 0:
+        return [" " * shift + line if line.strip() else line for line in new_lines]
+    if shift < 0:
+        return [line[min(-shift, _indent(line)):] for line in new_lines]
+    return new_lines
+
+def replace_block(lines: list, old_block: list, new_block: list, expected: int) -> tuple:
+    """Replaces `old_block` in `lines` in place, fuzzily if needed. Returns (start, fuzzy), start is -1 when not found."""
+    start, fuzzy = find_block(lines, old_block, expected)
+    if start == -1:
+        return start, fuzzy
+    matched = lines[start:start + len(old_block)]
+    lines[start:start + len(old_block)] = reindent(new_block, old_block, matched) if fuzzy else new_block
+    return start, fuzzy
+
+def apply_diff(original: str, diff: str) -> str:
+    """
+    Applies a unified diff to `original`. Hunks are located by their context, so line numbers
+    may be off when earlier edits moved the code, and context that differs slightly (e.g. in indentation)
+    still matches. Raises PatchError when a hunk does not match.
+    """
+    lines = original.split("\n")
+    offset = 0
+    for number, hunk in enumerate(parse_hunks(diff), start=1):
+        # An empty old range is inserted after line old_start
+        expected = hunk.old_start - 1 + offset if hunk.old_lines else hunk.old_start + offset
+        start, _ = replace_block(lines, hunk.old_lines, hunk.new_lines, expected)
+        if start == -1:
+            raise PatchError(f"Hunk {number} does not match the code at line {hunk.old_start}")
+        offset += len(hunk.new_lines) - len(hunk.old_lines)
+    return "\n".join(lines)
+
+def make_diff(original: str, updated: str) -> str:
+    """Unified diff from `original` to `updated`."""
+    return "\n".join(difflib.unified_diff(original.split("\n"), updated.split("\n"), "a", "b", lineterm=""))
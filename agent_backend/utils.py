@@ -1,14 +1,50 @@
 import asyncio
+import contextlib
+import logging
+import os
 import re
-from functioniser_agent import functoniser_agent
 from validate_request import determine_agent
-from hello_world_agent import hello_world_agent
-from storage_agent import storage_agent
-from cross_contract_agent import cross_contract_agent
-from atomic_swap_agent import atomic_swap_agent
+from agent_registry import FUSED_AGENT, get_agent, load_module
+from model_registry import stage_completion
+from prompt_budget import QueryParts, fit_prompt, request_parts
+from code_stream import CodeFenceParser
+from best_of_n import BEST_OF_MAX, BEST_OF_REQUEST_TYPES, best_of_n
+from code_only import code_only_result, run_code_only
+from patch_edits import PATCH_REQUEST_TYPES, patch_instructions, patch_result, record_fallback
+from query_response_agent import extract_code_locally
+from unified_diff import PatchError, make_diff
+from structured_log import get_logger, log_event
 import json
 
-async def query_handler(request_type: str, user_code: str, context: str):
+# "two_stage" routes with determine_agent and then calls the chosen agent,
+# "fused" routes and answers in a single streamed completion
+AGENT_MODE = os.environ.get("AGENT_MODE", "two_stage")
+
+logger = get_logger("utils")
+
+def build_query(request_type: str, user_code: str, context: str, render=None):
+    """
+    Builds the agent query for the request type, with render_query unless another `render` is given.
+    Returns None if the copilot markers in user_code are invalid.
+    """
+    render = render or render_query
+    final_query = render(request_type, user_code, context)
+    if final_query is not None:
+        # Kept so an oversize query can be rebuilt from a trimmed context and code
+        request_parts.set(QueryParts(request_type, user_code, context, final_query, render))
+    return final_query
+
+def patch_query_renderer(instructions: str):
+    """
+    Renders queries with the edit instructions in front, outside the copilot markers.
+    The instructions are made once from the untrimmed code, so trimming cannot change the marker lines they quote.
+    """
+    def render(request_type: str, user_code: str, context: str):
+        final_query = render_query(request_type, user_code, context)
+        return None if final_query is None else f"{instructions}\n{final_query}"
+    return render
+
+def render_query(request_type: str, user_code: str, context: str):
     context = context + "\n\n The output should be compatible with Soroban SDK and Rust.\n If required, use only the Soroban SDK and ensure the contract is memory-efficient.\n"
     final_query = ""
 
@@ -16,10 +52,10 @@ async def query_handler(request_type: str, user_code: str, context: str):
         matches = list(re.finditer(r"######", user_code))
         
         if len(matches) < 2:
-            print("Error: Less than two sets of ###### found in user_code.")
+            logger.warning("Less than two sets of ###### found in user_code")
             return None
         elif len(matches) > 2:
-            print("Error: More than two sets of ###### found in user_code.")
+            logger.warning("More than two sets of ###### found in user_code")
             return None
         else:
             start = matches[0].end()
@@ -37,23 +73,151 @@ async def query_handler(request_type: str, user_code: str, context: str):
         final_query = context + "\nThe following code is provided for context and may include relevant functions or data structures from the Soroban SDK. While it shouldn't directly influence your output, feel free to reference it if it helps explain or enhance the response.\n\n" + user_code
     elif request_type == "debugging":
         final_query = "Received Compilation or Runtime Error as follows, please fix the code:\n" + context + "\n\nHere's my code with the error:\n" + user_code
-    
-    determined_data = await determine_agent(final_query)
+
+    return final_query
+
+async def route_and_answer(final_query: str, deadline=None, request_type=None):
+    """
+    Routes the query with determine_agent and answers it with the chosen agent.
+    Returns a tuple of (agent, response).
+    """
+    determined_data = await determine_agent(final_query, deadline)
     determined_agent = determined_data.expected_field
-    response = ""
-    
-    if determined_agent == "general":
-        response = await hello_world_agent(final_query)
-    elif determined_agent == "storage":
-        response = await storage_agent(final_query)
-    elif determined_agent == "cross_contract":
-        response = await cross_contract_agent(final_query)
-    elif determined_agent == "atomic_swap":
-        response = await atomic_swap_agent(final_query)
-    
+    log_event(logger, logging.INFO, "routed", agent=determined_agent, request_type=request_type)
+    response = await get_agent(determined_agent).run(final_query, deadline, request_type)
+
+    return determined_agent, response
+
+async def routed_answerer(final_query: str, deadline=None, request_type=None, response_mode: str = "full", **fields):
+    """
+    Routes the query once and returns answer(query), which answers with the chosen agent,
+    for pipelines that ask the same agent more than once. Code-only answers are always routed
+    with determine_agent, since the fused prompt asks for explanations.
+    """
+    if AGENT_MODE == "fused" and response_mode == "full":
+        async def answer(query):
+            _, response = await FUSED_AGENT.run(query, deadline, request_type)
+            return response
+        return answer
+
+    determined_data = await determine_agent(final_query, deadline)
+    agent = get_agent(determined_data.expected_field)
+    log_event(logger, logging.INFO, "routed", agent=agent.name, request_type=request_type, response_mode=response_mode, **fields)
+
+    if response_mode == "code_only":
+        async def answer(query):
+            return await run_code_only(agent, query, deadline, request_type)
+        return answer
+
+    async def answer(query):
+        return await agent.run(query, deadline, request_type)
+    return answer
+
+async def best_of_answers(final_query: str, best_of: int, deadline=None, request_type=None, response_mode: str = "full"):
+    """Routes once, then generates `best_of` candidate answers and returns the first whose code compiles."""
+    answer = await routed_answerer(final_query, deadline, request_type, response_mode, best_of=best_of)
+    result = await best_of_n(lambda: answer(final_query), best_of, deadline)
+    if response_mode == "code_only":
+        return {**result, **code_only_result(result["agent_response"])}
+    return result
+
+async def patch_answer(request_type: str, user_code: str, context: str, deadline=None):
+    """
+    Asks the agent for minimal edits and applies them to user_code locally.
+    Falls back to a full answer from the same agent when the edits do not apply.
+    """
+    answer = await routed_answerer(build_query(request_type, user_code, context), deadline, request_type, edit_mode="patch")
+    render = patch_query_renderer(patch_instructions(request_type, user_code))
+    response = await answer(build_query(request_type, user_code, context, render))
+    try:
+        return patch_result(request_type, user_code, response)
+    except PatchError as e:
+        error = e
+        record_fallback(request_type, error)
+
+    response = await answer(build_query(request_type, user_code, context))
+    result = {"agent_response": response, "edit_mode": "full", "patch_error": str(error)}
+    # A debugging answer carries the whole fixed contract; a copilot answer only the inserted code
+    code_blocks = extract_code_locally(response).code_requested
+    if request_type == "debugging" and code_blocks:
+        result["patch"] = make_diff(user_code, code_blocks[0])
+        result["patched_code"] = code_blocks[0]
+    return result
+
+async def query_handler(request_type: str, user_code: str, context: str, deadline=None, best_of: int = 1, edit_mode: str = "full", response_mode: str = "full"):
+    final_query = build_query(request_type, user_code, context)
+    if final_query is None:
+        return None
+
+    # Patch answers need the edit blocks, so they take precedence over code-only answers
+    if edit_mode == "patch" and request_type in PATCH_REQUEST_TYPES:
+        return await patch_answer(request_type, user_code, context, deadline)
+    if best_of > 1 and request_type in BEST_OF_REQUEST_TYPES:
+        return await best_of_answers(final_query, min(best_of, BEST_OF_MAX), deadline, request_type, response_mode)
+    if response_mode == "code_only":
+        answer = await routed_answerer(final_query, deadline, request_type, response_mode)
+        return code_only_result(await answer(final_query))
+
+    if AGENT_MODE == "fused":
+        _, response = await FUSED_AGENT.run(final_query, deadline, request_type)
+    else:
+        _, response = await route_and_answer(final_query, deadline, request_type)
+
     return {
         "agent_response": response
     }
 
-async def functioniser(contract_code):
-    return await functoniser_agent(contract_code)
+async def stream_code(final_query: str, deadline=None, request_type=None):
+    """
+    Streams only the code of the first Rust code block of the agent's answer.
+    Code is yielded as soon as it is confirmed inside the fence, and the upstream
+    stream is closed as soon as the fence closes.
+    """
+    if AGENT_MODE == "fused":
+        agent = FUSED_AGENT
+    else:
+        determined_data = await determine_agent(final_query, deadline)
+        agent = get_agent(determined_data.expected_field)
+        log_event(logger, logging.INFO, "routed", agent=agent.name, request_type=request_type)
+
+    async with agent.bulkhead(request_type).slot(deadline):
+        # Closing the inner generator promptly releases the upstream stream when the client goes away
+        async with contextlib.aclosing(_stream_agent_code(agent, final_query, deadline, request_type)) as chunks:
+            async for code in chunks:
+                yield code
+
+async def _stream_agent_code(agent, final_query: str, deadline=None, request_type=None):
+    prompt = await fit_prompt(agent.stage, agent.load().generate_prompt, final_query)
+    stream = await stage_completion(
+        agent.stage,
+        messages=[
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        top_p=0.95,
+        stream=True,
+        reasoning_format="hidden",
+        deadline=deadline,
+        request_type=request_type,
+    )
+
+    parser = CodeFenceParser()
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                code = parser.feed(chunk.choices[0].delta.content)
+                if code:
+                    yield code
+            if parser.done or (deadline is not None and deadline.expired()):
+                break
+        else:
+            code = parser.finish()
+            if code:
+                yield code
+    finally:
+        await stream.aclose()
+
+async def functioniser(contract_code, deadline=None):
+    return await load_module("functioniser_agent").functoniser_agent(contract_code, deadline)
@@ -1,57 +1,88 @@
-from typing import Literal
+import asyncio
+import contextvars
 import json
-from pydantic import BaseModel
-from groq import Groq, AsyncGroq
+import logging
 import os
+from pydantic import BaseModel, field_validator
+from deadline import LOCAL_ROUTER_SECONDS
+from model_registry import structured_completion
+from json_repair import parse_model
+from micro_batch import MicroBatcher
+from prompt_budget import fit_prompt, trim_query
+from agent_registry import AGENTS, DEFAULT_AGENT
+from structured_log import get_logger, log_event, request_id
+from tenancy import SharedUsage, current_tenant
 
-# Initialize Groq client
-groq = AsyncGroq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
+# Routing requests arriving within ROUTE_BATCH_WAIT_MS of each other are classified in one completion,
+# at most ROUTE_BATCH_MAX_SIZE at a time; "0" routes every request on its own
+ROUTE_BATCH = os.environ.get("ROUTE_BATCH", "1") != "0"
+ROUTE_BATCH_WAIT_MS = float(os.environ.get("ROUTE_BATCH_WAIT_MS", 5))
+ROUTE_BATCH_MAX_SIZE = int(os.environ.get("ROUTE_BATCH_MAX_SIZE", 16))
+# Tokens each query may take in a batched routing prompt, trimmed around the user's request
+ROUTE_BATCH_QUERY_TOKENS = int(os.environ.get("ROUTE_BATCH_QUERY_TOKENS", 300))
+
+logger = get_logger("routing")
 
 # Data model for LLM to generate
 class Response(BaseModel):
-    expected_field: Literal["general", "storage", "cross_contract", "atomic_swap"]
+    expected_field: str  # Name of a registered agent
     reason: str
 
-async def determine_agent(user_query: str) -> Response:
+    @field_validator("expected_field", mode="before")
+    @classmethod
+    def registered_agent(cls, value):
+        # Tolerates "Storage", "atomic-swap" and similar spellings of a registered name
+        if isinstance(value, str):
+            value = normalize_label(value)
+        if value not in AGENTS:
+            raise ValueError(f"Unknown agent '{value}'")
+        return value
+
+class BatchResponse(BaseModel):
+    labels: list[str]  # One agent name per query, in query order
+
+def normalize_label(value: str) -> str:
+    return value.strip().lower().replace("-", "_").replace(" ", "_")
+
+def response_schema() -> dict:
+    schema = Response.model_json_schema()
+    schema["properties"]["expected_field"]["enum"] = list(AGENTS)
+    return schema
+
+def route_locally(user_query: str) -> Response:
     """
-    Determines which agent should handle the user's query based on detailed differentiation criteria.
-    Returns a JSON response indicating the appropriate agent.
+    Keyword-based router used when there is no time budget for the LLM router.
+    Agents are checked by routing priority so the most specific one wins.
+    Defaults to 'general' like the LLM routing rules.
     """
-    # Define the differentiation criteria in the user message
-    user_message = (
+    query = user_query.lower()
+    for spec in sorted(AGENTS.values(), key=lambda spec: -spec.route_priority):
+        for keyword in spec.keywords:
+            if keyword in query:
+                return Response(expected_field=spec.name, reason=f"Local router matched keyword '{keyword}'")
+    return Response(expected_field=DEFAULT_AGENT, reason="Local router found no matching keywords")
+
+def routing_rules(examples: bool = True) -> str:
+    """Routing rules for the LLM router, one numbered section per registered agent."""
+    rules = ""
+    for number, spec in enumerate(AGENTS.values(), start=1):
+        rules += f"{number}. **{spec.title} ({spec.name})**:\n"
+        rules += f"   - {spec.description}\n"
+        if examples and spec.examples:
+            rules += "   - Examples:\n"
+            for example in spec.examples:
+                rules += f"     - '{example}'\n"
+        if spec.keywords:
+            rules += "   - Keywords: " + ", ".join(f"'{keyword}'" for keyword in spec.keywords) + "\n"
+    return rules
+
+async def generate_prompt(user_query: str, examples: bool = True) -> str:
+    """Builds the router prompt with the differentiation criteria of every registered agent."""
+    return (
         "Your task is to assign an agent based on the query provided by the user.\n"
         "Determine which agent should handle the following query based on these rules:\n"
-        "1. **General Agent (general)**:\n"
-        "   - Use this agent for queries related to strings, greetings, or general-purpose tasks.\n"
-        "   - Examples:\n"
-        "     - 'Write a smart contract that returns \"Hello, World!\"'\n"
-        "     - 'Generate a simple greeting message'\n"
-        "     - 'Explain how to use strings in Soroban'\n"
-        "   - Keywords: 'hello', 'string', 'greeting', 'general', 'example'\n"
-        "2. **Storage Agent (storage)**:\n"
-        "   - Use this agent for queries related to storing or retrieving data.\n"
-        "   - Examples:\n"
-        "     - 'Write a smart contract that stores user details'\n"
-        "     - 'How do I retrieve data from persistent storage?'\n"
-        "     - 'Create a contract that saves and fetches data'\n"
-        "   - Keywords: 'store', 'retrieve', 'storage', 'data', 'persist', 'save', 'fetch'\n"
-        "3. **Cross-Contract Agent (cross_contract)**:\n"
-        "   - Use this agent for queries related to cross-contract interactions.\n"
-        "   - Examples:\n"
-        "     - 'Write a contract that calls another contract'\n"
-        "     - 'How do I interact with another contract in Soroban?'\n"
-        "     - 'Create a contract that uses another contract's function'\n"
-        "   - Keywords: 'cross contract', 'call contract', 'contract interaction', 'interact with contract'\n"
-        "4. **Atomic Swap Agent (atomic_swap)**:\n"
-        "   - Use this agent for queries related to atomic swaps between tokens.\n"
-        "   - Examples:\n"
-        "     - 'Write a contract for atomic swaps between two tokens'\n"
-        "     - 'How do I implement an atomic swap in Soroban?'\n"
-        "     - 'Create a contract that swaps tokens atomically'\n"
-        "   - Keywords: 'atomic swap', 'token swap', 'swap tokens', 'atomic exchange'\n"
-        "If the query does not match any of the above criteria, default to 'general'.\n\n"
+        f"{routing_rules(examples)}"
+        f"If the query does not match any of the above criteria, default to '{DEFAULT_AGENT}'.\n\n"
         "The query provided by the user will be based off of these categories only:"
         "1. Debugging.\n"
         "2. Code Generation.\n"
@@ -59,30 +90,132 @@ async def determine_agent(user_query: str) -> Response:
         "4. Copilot assistance.\n"
         "These categories should not influence your decision for the agent, but to understand the variety of queries the user can ask.\n\n"
         "The response must be a JSON object with the following schema:\n"
-        f"{json.dumps(Response.model_json_schema(), indent=2)}\n\n"
+        f"{json.dumps(response_schema(), indent=2)}\n\n"
         "Expected_field determines the agent to route to, and reason provides context for choosing so.\n"
         "Reason should be justified and clearly explain why the agent was chosen.\n"
         f"Determine which agent should handle the following query: {user_query}"
     )
 
-    # Call the Groq API with JSON response mode
-    chat_completion = await groq.chat.completions.create(
+async def generate_batch_prompt(user_queries: list, examples: bool = True) -> str:
+    """Builds the router prompt for several queries at once, answered with one label per query."""
+    # The queries are trimmed by the callers, which know how each query was built
+    queries = "".join(
+        f"Query {number}:\n<<<\n{query}\n>>>\n\n"
+        for number, query in enumerate(user_queries, start=1)
+    )
+    return (
+        "Your task is to pick an agent for each of the numbered queries below, independently of each other.\n"
+        "Determine which agent should handle each query based on these rules:\n"
+        f"{routing_rules(examples)}"
+        f"If a query does not match any of the above criteria, use '{DEFAULT_AGENT}'.\n\n"
+        "Queries can ask for debugging, code generation, code or function explanation, or copilot assistance; "
+        "this should not influence the choice of agent.\n\n"
+        f"Respond with a JSON object {{\"labels\": [...]}} holding exactly {len(user_queries)} agent names, "
+        f"one per query in the same order, each one of: {', '.join(AGENTS)}.\n\n"
+        f"{queries}"
+    )
+
+def parse_labels(user_queries: list, content: str) -> list:
+    """One Response per query; labels that name no agent fall back to the local router. Raises ValueError."""
+    labels = parse_model("determine_agent_batch", content, BatchResponse).labels
+    if len(labels) != len(user_queries):
+        raise ValueError(f"Expected {len(user_queries)} labels, got {len(labels)}")
+    responses = []
+    for query, label in zip(user_queries, labels):
+        label = normalize_label(label)
+        if label in AGENTS:
+            responses.append(Response(expected_field=label, reason="Batched router"))
+        else:
+            responses.append(route_locally(query))
+    return responses
+
+class RouteRequest:
+    """A routing call waiting in a batch, with the caller's context to charge and log it against."""
+    def __init__(self, user_query: str, deadline=None):
+        self.user_query = user_query
+        self.deadline = deadline
+        # Trimmed here, where the request's parts are known, so a copilot request keeps the text at its markers
+        self.batch_query = trim_query(user_query, ROUTE_BATCH_QUERY_TOKENS)
+        self.context = contextvars.copy_context()
+
+    def route_alone(self):
+        """Routes the request with the single-query prompt, in the caller's context."""
+        return asyncio.create_task(route_query(self.user_query, self.deadline), context=self.context)
+
+async def route_batch(requests: list) -> list:
+    """
+    Routes a batch of RouteRequests in one completion, under the tightest deadline of the batch.
+    The completion's usage is split evenly between the callers' tenants.
+    A single request is routed with the usual prompt; if the batch fails, each request is routed on its own.
+    """
+    if len(requests) == 1:
+        return [await requests[0].route_alone()]
+    user_queries = [request.batch_query for request in requests]
+    deadlines = [request.deadline for request in requests if request.deadline is not None]
+    deadline = min(deadlines, key=lambda deadline: deadline.remaining()) if deadlines else None
+    prompt = await generate_batch_prompt(user_queries)
+    usage = SharedUsage()
+    current_tenant.set(usage)
+    try:
+        responses = await structured_completion(
+            "determine_agent_batch",
+            lambda content: parse_labels(user_queries, content),
+            messages=[{"role": "user", "content": prompt}],
+            reasoning_format="hidden",
+            deadline=deadline,
+        )
+    except Exception as e:
+        batch_fallbacks["batches"] += 1
+        log_event(logger, logging.WARNING, "routing batch failed", size=len(requests), error=str(e) or type(e).__name__)
+        return await asyncio.gather(*(request.route_alone() for request in requests), return_exceptions=True)
+    finally:
+        usage.split([request.context.get(current_tenant) for request in requests])
+    log_event(
+        logger, logging.INFO, "routing batch", size=len(requests),
+        request_ids=[request.context.get(request_id) for request in requests],
+        prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens,
+    )
+    return responses
+
+route_batcher = MicroBatcher(route_batch, ROUTE_BATCH_WAIT_MS / 1000, ROUTE_BATCH_MAX_SIZE)
+
+# Batches routed one request at a time after the batched completion failed
+batch_fallbacks = {"batches": 0}
+
+def routing_metrics() -> dict:
+    return {"enabled": ROUTE_BATCH, **route_batcher.metrics(), "fallbacks": batch_fallbacks["batches"]}
+
+async def determine_agent(user_query: str, deadline=None) -> Response:
+    """
+    Determines which agent should handle the user's query based on detailed differentiation criteria.
+    Returns a JSON response indicating the appropriate agent.
+    Falls back to the local keyword router when the deadline leaves too little time for an LLM call.
+    Concurrent calls are batched into one completion unless ROUTE_BATCH=0.
+    """
+    if deadline is not None and deadline.remaining() < LOCAL_ROUTER_SECONDS:
+        return route_locally(user_query)
+    if ROUTE_BATCH:
+        return await route_batcher.submit(RouteRequest(user_query, deadline))
+    return await route_query(user_query, deadline)
+
+async def route_query(user_query: str, deadline=None) -> Response:
+    """Routes one query with the single-query prompt."""
+    user_message = await fit_prompt("determine_agent", generate_prompt, user_query)
+
+    # Call the LLM with JSON response mode; malformed output is repaired locally before re-asking
+    return await structured_completion(
+        "determine_agent",
+        lambda content: parse_model("determine_agent", content, Response),
         messages=[
             {
                 "role": "user",
                 "content": user_message,
             }
         ],
-        model="deepseek-r1-distill-llama-70b",
-        temperature=0.5,  # Set temperature to 0 for deterministic responses
-        stream=False,  # Streaming is not supported in JSON mode
-        response_format={"type": "json_object"},  # Enable JSON mode
-        reasoning_format="hidden"
+        reasoning_format="hidden",
+        deadline=deadline,
     )
 
-    # Parse the JSON response into the Response model
-    return Response.model_validate_json(chat_completion.choices[0].message.content)
-
 # def main():
 #     """
 #     Main function to handle user input and interact with the Groq API.
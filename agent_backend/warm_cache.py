@@ -0,0 +1,79 @@
+"""
+Answers a curated list of canonical queries with query_handler and writes the answers into the
+persistent answer cache (RESPONSE_CACHE_PATH), so a fresh deploy serves the common starter tasks at once.
+Answers that are already cached and fresh are skipped unless --force is given.
+
+Usage:
+    python warm_cache.py [--queries canonical.jsonl] [--concurrency 4] [--force]
+
+--queries reads one JSON object per line with request_type, context and optionally user_code;
+without it the built-in starter tasks below are used. Run it before starting the server, which
+loads the cache file at startup.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from response_cache import cache, cache_request, cacheable
+from utils import query_handler
+
+# The starter tasks most traffic is made of, matching the agents' built-in samples
+CANONICAL_QUERIES = [
+    ("generation", "", "Write a smart contract that returns \"Hello, World!\""),
+    ("generation", "", "Write a hello world smart contract that greets the user by name"),
+    ("generation", "", "Write a smart contract that increments a counter"),
+    ("generation", "", "Create a counter contract that saves the count and extends its TTL"),
+    ("generation", "", "Write a smart contract that stores user details"),
+    ("generation", "", "Write a contract for atomic swaps between two tokens"),
+    ("assistance", "", "How do I implement an atomic swap in Soroban?"),
+    ("assistance", "", "How do I retrieve data from persistent storage?"),
+]
+
+def load_queries(path: str) -> list:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [(record["request_type"], record.get("user_code", ""), record["context"]) for record in records]
+
+async def warm(request: dict, semaphore: asyncio.Semaphore, force: bool) -> tuple:
+    if not force and cache.is_fresh(request):
+        return "cached", 0.0
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            result = await query_handler(**request)
+        except Exception as e:
+            return f"failed: {str(e) or type(e).__name__}", time.perf_counter() - start
+        if result is None:
+            return "failed: invalid request", time.perf_counter() - start
+        if not cacheable(result):
+            return "skipped: unverified", time.perf_counter() - start
+        cache.put(request, result)
+        return "warmed", time.perf_counter() - start
+
+async def main():
+    parser = argparse.ArgumentParser(description="Warm the persistent answer cache with canonical queries")
+    parser.add_argument("--queries", help="JSON lines file of queries, instead of the built-in starter tasks")
+    parser.add_argument("--concurrency", type=int, default=4, help="Queries answered at once")
+    parser.add_argument("--force", action="store_true", help="Regenerate answers that are already cached and fresh")
+    args = parser.parse_args()
+
+    if cache.path == "":
+        parser.error("RESPONSE_CACHE_PATH is empty, so answers would not be persisted")
+    queries = load_queries(args.queries) if args.queries else CANONICAL_QUERIES
+    requests = [cache_request(request_type, user_code, context) for request_type, user_code, context in queries]
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    await cache.open()
+    start = time.perf_counter()
+    try:
+        outcomes = await asyncio.gather(*(warm(request, semaphore, args.force) for request in requests))
+    finally:
+        await cache.close()
+    for request, (outcome, seconds) in zip(requests, outcomes):
+        print(f"{outcome:<10} {seconds:>6.2f}s  [{request['request_type']}] {request['context'][:70]}")
+    warmed = sum(1 for outcome, _ in outcomes if outcome == "warmed")
+    print(f"{warmed} warmed of {len(requests)} queries in {time.perf_counter() - start:.2f}s, cache file {cache.path}")
+
+if __name__ == "__main__":
+    asyncio.run(main())